@@ -0,0 +1,25 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Microbenchmarks for the requiem package.
+
+Each module in this package may be run directly, e.g.:
+
+    python -m benchmarks.codec
+
+The suite module runs the whole set of per-call overhead benchmarks
+and can compare the results against a saved baseline; the support
+module provides stand-in servers for benchmarking clients.
+"""
@@ -0,0 +1,79 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark JSON encode and decode throughput for each codec."""
+
+import json
+import timeit
+
+from requiem import jsclient
+
+
+# Documents to encode and decode
+_docs = {
+    'small': {'id': 12345, 'name': 'example', 'enabled': True,
+              'tags': ['a', 'b', 'c']},
+    'large': [{'id': i, 'name': 'item %d' % i, 'value': i * 1.5,
+               'tags': ['x', 'y'], 'meta': {'owner': 'nobody'}}
+              for i in range(10000)],
+}
+
+
+def codecs():
+    """Return the list of available codecs."""
+
+    result = [jsclient.JSONCodec('json', json.dumps, json.loads)]
+    for name in ('simplejson', 'ujson'):
+        try:
+            mod = __import__(name)
+        except ImportError:
+            continue
+        result.append(jsclient.JSONCodec(name, mod.dumps, mod.loads))
+
+    return result
+
+
+def bench(codec, doc, number):
+    """Time encoding and decoding doc with codec.
+
+    Returns a tuple of the encode and decode throughput, in megabytes
+    per second.
+    """
+
+    text = codec.dumps(doc)
+    size = len(text) * number / 1e6
+
+    encode = min(timeit.repeat(lambda: codec.dumps(doc), number=number,
+                               repeat=3))
+    decode = min(timeit.repeat(lambda: codec.loads(text), number=number,
+                               repeat=3))
+
+    return size / encode, size / decode
+
+
+def main():
+    """Run the benchmark."""
+
+    print "default codec: %s" % jsclient.default_codec.name
+    for name, doc, number in (('small', _docs['small'], 20000),
+                              ('large', _docs['large'], 5)):
+        for codec in codecs():
+            encode, decode = bench(codec, doc, number)
+            print "%-6s %-10s encode %8.2f MB/s  decode %8.2f MB/s" % (
+                name, codec.name, encode, decode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Drive a client against a local server with LoadGenerator.
+
+Runs an open-loop load of item listings, with a sprinkling of client
+and server errors, against a support.Server, and prints the report:
+
+    python -m benchmarks.load --rate 500 --duration 10
+"""
+
+import argparse
+import json
+import sys
+
+from requiem import decorators
+from requiem import jsclient
+from requiem import loadgen
+
+from benchmarks import support
+
+
+class _Client(jsclient.JSONClient):
+    """A client for the local server."""
+
+    @decorators.restmethod('GET', '/items/{count}', 'delay')
+    def list_items(self, req, count, delay=None):
+        """List some items."""
+
+        return req.send().obj
+
+    @decorators.restmethod('GET', '/status/{status}', 'delay')
+    def get_status(self, req, status, delay=None):
+        """Retrieve a response with the given status."""
+
+        return req.send().obj
+
+
+def main(args=None):
+    """Run the load generator."""
+
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.load',
+        description="Drive a requiem client against a local server.")
+    parser.add_argument('--rate', type=float, default=200.0,
+                        help="Calls per second (default: %(default)s).")
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help="Seconds to run for (default: %(default)s).")
+    parser.add_argument('--workers', type=int, default=32,
+                        help="Worker threads (default: %(default)s).")
+    parser.add_argument('--delay', type=float, default=0.005,
+                        help="Server delay per call, in seconds (default: "
+                        "%(default)s).")
+    parser.add_argument('--uniform', action='store_true',
+                        help="Space calls evenly, instead of as a Poisson "
+                        "process.")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the report as JSON.")
+    opts = parser.parse_args(args)
+
+    delay = opts.delay or None
+    mix = [
+        (90, 'list_items',
+         lambda rand: {'count': rand.randint(1, 50), 'delay': delay}),
+        (5, 'get_status', {'status': 404, 'delay': delay}),
+        (5, 'get_status', {'status': 503, 'delay': delay}),
+    ]
+
+    with support.Server() as server:
+        client = _Client(server.url)
+        gen = loadgen.LoadGenerator(client, mix, opts.rate,
+                                    workers=opts.workers,
+                                    poisson=not opts.uniform)
+        report = gen.run(opts.duration)
+        client._client.clear()
+
+    if opts.json:
+        print json.dumps(report.summary(), indent=2, sort_keys=True)
+    else:
+        print report.format()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark ProcessorStack dispatch overhead per request.
+
+Measures the cost of running a request and its response through
+proc_request() and proc_response() as the number of processors
+grows, both for processors implementing every hook and for
+processors implementing none.
+"""
+
+import timeit
+
+from requiem import processor
+
+
+class _FullProcessor(object):
+    """Processor implementing every hook."""
+
+    def proc_request(self, req):
+        pass
+
+    def proc_response(self, resp):
+        pass
+
+    def proc_exception(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _EmptyProcessor(object):
+    """Processor implementing no hooks."""
+
+    pass
+
+
+def bench(proc_class, count, number=100000):
+    """Time dispatch through count processors of proc_class.
+
+    Returns the time per request, in microseconds.
+    """
+
+    stack = processor.ProcessorStack()
+    for _i in range(count):
+        stack.append(proc_class())
+
+    def dispatch():
+        stack.proc_response(stack.proc_request(None))
+
+    best = min(timeit.repeat(dispatch, number=number, repeat=3))
+
+    return best / number * 1e6
+
+
+def main():
+    """Run the benchmark."""
+
+    print "%-11s %13s %13s" % ('processors', 'full (us)', 'empty (us)')
+    for count in range(11):
+        print "%-11d %13.3f %13.3f" % (count, bench(_FullProcessor, count),
+                                       bench(_EmptyProcessor, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Benchmark the per-call overhead of requiem clients.
+
+Measures, separately, each stage a @restmethod() call goes through:
+argument binding, URL and query construction, header assembly in
+_make_req(), ProcessorStack dispatch, and JSON decoding, followed by
+complete calls, both against a FakeHttp client, which never touches
+the network, and against a local Server, single-threaded and from
+several threads at once.
+
+Results are printed as a table, and may be written as JSON with
+--json.  A previous JSON report may be given with --compare, in which
+case the change in each result is reported, and the exit status is 1
+if any result is slower than the baseline by more than --tolerance:
+
+    python -m benchmarks.suite --json baseline.json
+    ... upgrade requiem ...
+    python -m benchmarks.suite --compare baseline.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+import timeit
+
+from requiem import decorators
+from requiem import jsclient
+from requiem import processor
+from requiem import transport
+
+from benchmarks import support
+
+
+# Version of the JSON report format
+FORMAT = 1
+
+
+class _Client(jsclient.JSONClient):
+    """A representative client."""
+
+    @decorators.restmethod('GET', '/servers/{server_id}/ips', 'limit',
+                           'marker')
+    def list_ips(self, req, server_id, limit=None, marker=None):
+        """List the addresses of a server."""
+
+        return req
+
+    @decorators.restmethod('GET', '/servers/{server_id}',
+                           request_id='X-Request-Id')
+    def get_server(self, req, server_id, request_id=None):
+        """Retrieve a server."""
+
+        return req
+
+    @decorators.restmethod('GET', '/items/{count}')
+    def list_items(self, req, count):
+        """List some items."""
+
+        return req.send().obj
+
+
+class _Processor(object):
+    """Processor implementing every hook."""
+
+    def proc_request(self, req):
+        pass
+
+    def proc_response(self, resp):
+        pass
+
+    def proc_exception(self, exc_type, exc_value, traceback):
+        pass
+
+
+_baseurl = 'http://api.example.com/v2/tenant'
+
+
+def bench_bind():
+    """@restmethod() argument binding."""
+
+    client = _Client(_baseurl, client=support.FakeHttp())
+    plan = _Client.list_ips._restmethod
+
+    yield ('bind.positional',
+           lambda: plan.bind((client, 'abc-123', 10, 'def-456'), {}), 100000)
+    yield ('bind.keyword',
+           lambda: plan.bind((client, 'abc-123'),
+                             {'limit': 10, 'marker': 'def-456'}), 100000)
+
+
+def bench_url():
+    """URL joining and query building."""
+
+    plan = _Client.list_ips._restmethod
+    path = {'server_id': 'abc-123', 'limit': None, 'marker': None}
+    query = {'server_id': 'abc-123', 'limit': 10, 'marker': 'def-456'}
+
+    yield ('url.urljoin',
+           lambda: decorators._urljoin(_baseurl, '/servers/abc-123/ips'),
+           100000)
+    yield 'url.path', lambda: plan.build_url(_baseurl, path), 100000
+    yield 'url.query', lambda: plan.build_url(_baseurl, query), 100000
+
+
+def bench_make_req():
+    """Header assembly in _make_req()."""
+
+    url = _baseurl + '/servers/abc-123'
+    static = _Client(_baseurl, client=support.FakeHttp(),
+                     headers={'x-auth-token': 'secret',
+                              'user-agent': 'bench/1.0'})
+    dynamic = _Client(_baseurl, client=support.FakeHttp(),
+                      headers={'x-auth-token': lambda methname: 'secret',
+                               'user-agent': 'bench/1.0'})
+    method = _Client.get_server._restmethod.build_headers(
+        {'request_id': 'req-1'})
+
+    yield ('make_req.static',
+           lambda: static._make_req('GET', url, 'get_server'), 50000)
+    yield ('make_req.dynamic',
+           lambda: dynamic._make_req('GET', url, 'get_server'), 50000)
+    yield ('make_req.method',
+           lambda: static._make_req('GET', url, 'get_server', method),
+           50000)
+
+
+def bench_dispatch():
+    """ProcessorStack dispatch with 0 to 10 processors."""
+
+    for count in (0, 1, 2, 5, 10):
+        stack = processor.ProcessorStack()
+        for _i in range(count):
+            stack.append(_Processor())
+
+        def dispatch(stack=stack):
+            stack.proc_response(stack.proc_request(None))
+
+        yield 'dispatch.%d' % count, dispatch, 100000
+
+
+def bench_decode():
+    """JSONRequest decoding of small and large bodies."""
+
+    client = _Client(_baseurl, client=support.FakeHttp())
+    req = client._make_req('GET', _baseurl + '/items', 'list_items')
+
+    small = support.items(1)
+    large = support.items(5000)
+
+    yield 'decode.small', lambda: req._decode(small), 50000
+    yield 'decode.large', lambda: req._decode(large), 20
+
+
+def bench_call(threads=4):
+    """Complete calls, against FakeHttp and a local Server."""
+
+    client = _Client(_baseurl, client=support.FakeHttp())
+    yield 'call.fake', lambda: client.list_items(1), 20000
+
+    server = support.Server()
+    pool = transport.ConnectionPool(maxsize=threads)
+    try:
+        client = _Client(server.url, client=pool)
+
+        yield 'call.local', lambda: client.list_items(1), 1000
+        yield ('call.local.threads%d' % threads,
+               lambda: client.list_items(1), 1000, threads)
+    finally:
+        pool.clear()
+        server.stop()
+
+
+# All the benchmarks, in order
+_benchmarks = [bench_bind, bench_url, bench_make_req, bench_dispatch,
+               bench_decode, bench_call]
+
+
+def measure(func, number, repeat, threads=1):
+    """Time number calls of func, spread over threads threads.
+
+    Returns the best time per call over repeat runs, in seconds.
+    """
+
+    if threads == 1:
+        return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+    def worker(count):
+        for _i in xrange(count):
+            func()
+
+    best = None
+    for _i in range(repeat):
+        workers = [threading.Thread(target=worker,
+                                    args=(number // threads,))
+                   for _j in range(threads)]
+        start = time.time()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.time() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best / (number // threads * threads)
+
+
+def run(select=None, scale=1.0, repeat=3, threads=4):
+    """Run the benchmarks.
+
+    Only benchmarks whose names begin with one of the prefixes in
+    select are run, if it is given; the number of calls timed is
+    multiplied by scale.  Returns a dictionary mapping benchmark
+    names to dictionaries of the results.
+    """
+
+    results = {}
+    for bench in _benchmarks:
+        cases = bench(threads) if bench is bench_call else bench()
+        for case in cases:
+            name, func, number = case[:3]
+            nthreads = case[3] if len(case) > 3 else 1
+            if select and not any(name.startswith(s) for s in select):
+                continue
+
+            number = max(int(number * scale), nthreads)
+            per_call = measure(func, number, repeat, nthreads)
+            results[name] = {
+                'us_per_call': per_call * 1e6,
+                'calls_per_sec': 1.0 / per_call,
+                'number': number,
+                'threads': nthreads,
+            }
+
+    return results
+
+
+def report(results):
+    """Return a JSON-serializable report of the results."""
+
+    return {
+        'format': FORMAT,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'codec': jsclient.default_codec.name,
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Compare results against a baseline report.
+
+    Returns a list of (name, baseline, current, ratio, regressed)
+    tuples, where baseline and current are times per call, for the
+    benchmarks in both.  A benchmark has regressed if it is slower
+    than the baseline by more than the fraction tolerance.
+    """
+
+    previous = baseline['results']
+    comparison = []
+    for name in sorted(results):
+        if name not in previous:
+            continue
+
+        old = previous[name]['us_per_call']
+        new = results[name]['us_per_call']
+        ratio = new / old
+        comparison.append((name, old, new, ratio, ratio > 1.0 + tolerance))
+
+    return comparison
+
+
+def main(args=None):
+    """Run the benchmark suite."""
+
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.suite',
+        description="Benchmark the per-call overhead of requiem.")
+    parser.add_argument('select', nargs='*',
+                        help="Run only benchmarks whose names begin with "
+                        "one of these prefixes.")
+    parser.add_argument('--json', metavar='FILE',
+                        help="Write the results as JSON to FILE ('-' for "
+                        "standard output).")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Compare the results with the JSON report in "
+                        "FILE.")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="Fraction by which a result may be slower than "
+                        "the baseline before it is a regression (default: "
+                        "%(default)s).")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="Multiply the number of calls timed by SCALE.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Take the best of REPEAT runs (default: "
+                        "%(default)s).")
+    parser.add_argument('--threads', type=int, default=4,
+                        help="Threads for the multi-threaded calls "
+                        "(default: %(default)s).")
+    opts = parser.parse_args(args)
+
+    baseline = None
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+
+    results = run(opts.select, opts.scale, opts.repeat, opts.threads)
+
+    # Human-readable output goes to stderr if the JSON goes to stdout
+    out = sys.stderr if opts.json == '-' else sys.stdout
+    print >>out, "%-24s %12s %14s" % ('benchmark', 'us/call', 'calls/sec')
+    for name in sorted(results):
+        print >>out, "%-24s %12.3f %14.0f" % (
+            name, results[name]['us_per_call'],
+            results[name]['calls_per_sec'])
+
+    if opts.json:
+        text = json.dumps(report(results), indent=2, sort_keys=True)
+        if opts.json == '-':
+            print text
+        else:
+            with open(opts.json, 'w') as f:
+                print >>f, text
+
+    if baseline is None:
+        return 0
+
+    regressions = 0
+    print >>out
+    print >>out, "%-24s %12s %12s %8s" % ('benchmark', 'baseline', 'current',
+                                          'change')
+    for name, old, new, ratio, regressed in compare(results, baseline,
+                                                    opts.tolerance):
+        regressions += regressed
+        print >>out, "%-24s %12.3f %12.3f %+7.1f%%%s" % (
+            name, old, new, (ratio - 1.0) * 100.0,
+            '  REGRESSED' if regressed else '')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
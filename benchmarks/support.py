@@ -0,0 +1,187 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Stand-in HTTP servers for benchmarking requiem clients.
+
+FakeHttp has the signature of httplib2.Http.request() and answers
+every request from memory, so that the client code can be measured
+without any network or server overhead.  Server is a local,
+in-process HTTP/1.1 server for end-to-end measurements.
+
+Both understand the same paths:
+
+    /items/<count>   a JSON array of count small objects
+    /status/<code>   a small JSON object, with the given status
+    anything else    a small JSON object describing the request
+
+Requests to Server may also pass a 'delay' query argument, giving a
+number of seconds to wait before responding.
+"""
+
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+import urlparse
+
+import httplib2
+
+
+def _item(i):
+    """Return the i'th object of an item listing."""
+
+    return {'id': i, 'name': 'item %d' % i, 'enabled': True,
+            'tags': ['alpha', 'beta'], 'owner': {'id': 42, 'name': 'nobody'}}
+
+
+def items(count):
+    """Return the JSON text of a listing of count items."""
+
+    return json.dumps([_item(i) for i in range(count)])
+
+
+def respond(method, path, body):
+    """Compute the response to a request.
+
+    Returns a tuple of the status code and the JSON body.
+    """
+
+    parts = path.split('/')
+    if len(parts) == 3 and parts[1] == 'items':
+        return 200, items(int(parts[2]))
+    elif len(parts) == 3 and parts[1] == 'status':
+        status = int(parts[2])
+    else:
+        status = 200
+
+    return status, json.dumps({'method': method, 'path': path,
+                               'length': len(body or '')})
+
+
+class FakeHttp(object):
+    """An httplib2.Http stand-in which never touches the network.
+
+    Responses are computed once for each distinct method and path and
+    replayed thereafter.  Instances may be shared between threads.
+    """
+
+    def __init__(self):
+        """Initialize a fake client."""
+
+        self.requests = 0
+        self._responses = {}
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Answer a request."""
+
+        self.requests += 1
+        path = urlparse.urlsplit(uri).path
+        try:
+            status, text = self._responses[method, path]
+        except KeyError:
+            status, text = respond(method, path, None)
+            self._responses[method, path] = status, text
+
+        # A fresh response each time, since clients may modify it
+        resp = httplib2.Response({
+            'status': str(status),
+            'content-type': 'application/json',
+            'content-length': str(len(text)),
+        })
+        resp.reason = 'OK' if status < 400 else 'Error'
+
+        return resp, text
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Request handler for Server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    # Send each response in one piece, without waiting for ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """Suppress the request log."""
+
+        pass
+
+    def _respond(self):
+        """Handle any request."""
+
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+
+        url = urlparse.urlsplit(self.path)
+        delay = urlparse.parse_qs(url.query).get('delay')
+        if delay:
+            time.sleep(float(delay[0]))
+
+        status, text = self.server.respond(self.command, url.path, body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(text)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = _respond
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class Server(object):
+    """A local HTTP server running in a background thread.
+
+    Listens on an ephemeral port of the loopback interface; the
+    'url' attribute gives its base URL.  May be used as a context
+    manager.  The responses are computed by the respond callable,
+    which has the signature of the respond() function of this module.
+    """
+
+    def __init__(self, respond=respond):
+        """Start the server."""
+
+        self._server = _HTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.respond = respond
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        """Enter the context manager."""
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the context manager, stopping the server."""
+
+        self.stop()
+
+    def stop(self):
+        """Stop the server."""
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
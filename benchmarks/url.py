@@ -0,0 +1,86 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark URL construction for @restmethod() calls.
+
+Compares the compiled URL building of the call plan against the
+previous approach, which formatted the URI template, joined it to the
+base URL with urlparse, and built the query string with
+urllib.urlencode() on every call.
+"""
+
+import timeit
+import urllib
+
+from requiem import decorators
+
+
+def _legacy_build_url(baseurl, reluri, qargs, argmap):
+    """Build a URL the way @restmethod() used to."""
+
+    url = decorators._urljoin(baseurl, reluri.format(**argmap))
+    query = dict((k, argmap[k]) for k in qargs if argmap[k] is not None)
+    if query:
+        url += '?%s' % urllib.urlencode(query)
+
+    return url
+
+
+def _method(self, req, server_id=None, name=None, limit=None,
+            marker=None):
+    """A representative REST method."""
+
+    pass
+
+
+# (label, URI template, query arguments, argument map)
+_cases = [
+    ('static', '/servers', (), {}),
+    ('path', '/servers/{server_id}/ips', (), {'server_id': 12345}),
+    ('query', '/servers', ('name', 'limit', 'marker'),
+     {'name': 'web server', 'limit': 100, 'marker': None}),
+    ('path+query', '/servers/{server_id}/ips', ('limit', 'marker'),
+     {'server_id': 'abc-123', 'limit': 10, 'marker': 'def-456'}),
+]
+
+
+def bench(func, number=100000):
+    """Time func; returns the time per call, in microseconds."""
+
+    best = min(timeit.repeat(func, number=number, repeat=3))
+
+    return best / number * 1e6
+
+
+def main():
+    """Run the benchmark."""
+
+    baseurl = 'http://api.example.com/v2/tenant'
+
+    print "%-11s %13s %13s %9s" % ('case', 'legacy (us)', 'plan (us)',
+                                   'speedup')
+    for label, reluri, qargs, argmap in _cases:
+        plan = decorators._CallPlan(_method, 'GET', reluri, qargs, {})
+
+        legacy = bench(lambda: _legacy_build_url(baseurl, reluri, qargs,
+                                                 argmap))
+        compiled = bench(lambda: plan.build_url(baseurl, argmap))
+
+        print "%-11s %13.3f %13.3f %8.1fx" % (label, legacy, compiled,
+                                              legacy / compiled)
+
+
+if __name__ == '__main__':
+    main()
@@ -46,17 +46,29 @@ the documentation for @restmethod() itself.
 
 
 # Import everything
+from requiem import batch
+from requiem import breaker
+from requiem import cache
 from requiem import client
+from requiem import compression
 from requiem import decorators
 from requiem import exceptions
 from requiem import headers
+from requiem import limiter
+from requiem import loadgen
+from requiem import metrics
 from requiem import processor
 from requiem import request
+from requiem import retry
+from requiem import trace
+from requiem import transport
 
 
 # Build up our __all__ and import all the symbols
 __all__ = []
-for _mod in (client, decorators, exceptions, headers, processor, request):
+for _mod in (batch, breaker, cache, client, compression, decorators,
+             exceptions, headers, limiter, loadgen, metrics, processor,
+             request, retry, trace, transport):
     for _sym in _mod.__all__:
         vars()[_sym] = getattr(_mod, _sym)
     __all__ += _mod.__all__
@@ -0,0 +1,237 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import Queue
+import sys
+import threading
+import urlparse
+
+
+__all__ = ['Batch', 'BatchFuture']
+
+
+class BatchFuture(object):
+    """Represent the eventual result of a call submitted to a Batch."""
+
+    def __init__(self, host):
+        """Initialize a future."""
+
+        self.host = host
+        self._event = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def _set_result(self, result):
+        """Complete the future with a result."""
+
+        self._result = result
+        self._event.set()
+
+    def _set_exc_info(self, exc_info):
+        """Complete the future with an exception."""
+
+        self._exc_info = exc_info
+        self._event.set()
+
+    def _wait(self, timeout):
+        """Wait for the future to complete."""
+
+        if not self._event.wait(timeout):
+            raise RuntimeError("Timed out waiting for batch call")
+
+    def done(self):
+        """Return True if the call has completed."""
+
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the call to complete and return its result.
+
+        If the call raised an exception, that exception is re-raised.
+        """
+
+        self._wait(timeout)
+
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the call to complete and return its exception.
+
+        Returns None if the call completed successfully.
+        """
+
+        self._wait(timeout)
+
+        return self._exc_info[1] if self._exc_info is not None else None
+
+
+def _call_host(meth, args, kwargs):
+    """Determine the host a call will be made to.
+
+    Uses the call plan of @restmethod() decorated methods bound to a
+    client.  Returns None if the host cannot be determined.
+    """
+
+    plan = getattr(meth, '_restmethod', None)
+    client = getattr(meth, 'im_self', None)
+    if plan is None or client is None:
+        return None
+
+    try:
+        argmap, _self, _req_name = plan.bind((client,) + args, dict(kwargs))
+        url = plan.build_url(client._baseurl, argmap)
+    except Exception:
+        # The call will fail anyway; let it do so in the worker
+        return None
+
+    return urlparse.urlsplit(url).netloc.lower()
+
+
+class Batch(object):
+    """Run many independent REST calls concurrently.
+
+    Calls are submitted with submit() or map() and run on a bounded
+    pool of worker threads.  Each call goes through the normal
+    @restmethod() machinery, including the processor stack and
+    exception mapping.  If per_host is given, at most that many calls
+    to any one host are in flight at the same time; the remaining
+    calls for that host wait their turn without tying up a worker.
+
+    A Batch may be used as a context manager, in which case it waits
+    for all submitted calls and shuts down its workers on exit.
+    """
+
+    def __init__(self, max_workers=10, per_host=None):
+        """Initialize a batch."""
+
+        self.max_workers = max_workers
+        self.per_host = per_host
+
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._active = collections.defaultdict(int)
+        self._waiting = collections.defaultdict(collections.deque)
+        self._futures = []
+
+    def __enter__(self):
+        """Enter the context manager."""
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the context manager, waiting for all calls."""
+
+        self.shutdown()
+
+    def _worker(self):
+        """Worker thread main loop."""
+
+        while True:
+            work = self._queue.get()
+            if work is None:
+                # Shutting down
+                return
+
+            future, meth, args, kwargs = work
+            try:
+                result = meth(*args, **kwargs)
+            except:
+                future._set_exc_info(sys.exc_info())
+            else:
+                future._set_result(result)
+
+            # Release the host slot and schedule the next waiting call
+            if self.per_host is not None and future.host is not None:
+                self._release(future.host)
+
+    def _release(self, host):
+        """Release a host slot, scheduling a waiting call if any."""
+
+        with self._lock:
+            waiting = self._waiting[host]
+            if waiting:
+                self._queue.put(waiting.popleft())
+            else:
+                self._active[host] -= 1
+
+    def submit(self, meth, *args, **kwargs):
+        """Schedule meth(*args, **kwargs) and return a BatchFuture."""
+
+        host = None
+        if self.per_host is not None:
+            host = _call_host(meth, args, kwargs)
+
+        future = BatchFuture(host)
+        work = (future, meth, args, kwargs)
+
+        with self._lock:
+            # Start another worker, if we can use one
+            if len(self._workers) < self.max_workers:
+                thread = threading.Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+                self._workers.append(thread)
+
+            self._futures.append(future)
+
+            # Queue the call, unless the host is at its limit
+            if host is not None:
+                if self._active[host] >= self.per_host:
+                    self._waiting[host].append(work)
+                    return future
+                self._active[host] += 1
+
+            self._queue.put(work)
+
+        return future
+
+    def map(self, meth, *iterables):
+        """Call meth for each set of arguments from iterables.
+
+        All calls are submitted immediately; returns an iterator over
+        the results, in order.  If a call raised an exception, the
+        exception is raised when its result is reached.
+        """
+
+        futures = [self.submit(meth, *args) for args in zip(*iterables)]
+
+        return (future.result() for future in futures)
+
+    def shutdown(self, wait=True):
+        """Shut down the worker threads.
+
+        If wait is True (the default), waits for all submitted calls
+        to complete first.
+        """
+
+        if wait:
+            for future in self._futures:
+                future._event.wait()
+
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+            self._futures = []
+            for _thread in workers:
+                self._queue.put(None)
+
+        if wait:
+            for thread in workers:
+                thread.join()
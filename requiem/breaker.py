@@ -0,0 +1,327 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import httplib
+import socket
+import threading
+import time
+import urlparse
+
+from requiem import exceptions as exc
+from requiem import processor
+
+
+__all__ = ['CircuitBreaker']
+
+
+# Circuit states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class _Circuit(object):
+    """Track the health of a single host."""
+
+    def __init__(self, breaker, host):
+        """Initialize a circuit."""
+
+        self.breaker = breaker
+        self.host = host
+        self.state = CLOSED
+
+        # Sliding window of [bucket, successes, failures] lists
+        self.buckets = collections.deque()
+
+        self.opened_at = None
+        self.probes = 0
+        self.probe_successes = 0
+        self.probe_deadline = 0.0
+
+        self.rejected = 0
+        self.opens = 0
+        self.open_seconds = 0.0
+
+        self.lock = threading.Lock()
+
+    def _window(self, now):
+        """Return the current bucket, discarding expired ones."""
+
+        breaker = self.breaker
+        idx = int(now / breaker.bucket_width)
+        while self.buckets and self.buckets[0][0] <= idx - breaker.buckets:
+            self.buckets.popleft()
+        if not self.buckets or self.buckets[-1][0] != idx:
+            self.buckets.append([idx, 0, 0])
+
+        return self.buckets[-1]
+
+    def _transition(self, state, now, events):
+        """Change state; must be called with the lock held."""
+
+        old = self.state
+        if old == OPEN:
+            self.open_seconds += now - self.opened_at
+            self.opened_at = None
+
+        self.state = state
+        if state == OPEN:
+            self.opened_at = now
+            self.opens += 1
+        elif state == HALF_OPEN:
+            self.probes = 0
+            self.probe_successes = 0
+        else:
+            self.buckets.clear()
+
+        events.append((self.host, old, state))
+
+    def admit(self, now, events):
+        """Admit a request.
+
+        Returns True if the request is a half-open probe, or False if
+        it is an ordinary request.  Raises CircuitOpen if the request
+        may not be sent.
+        """
+
+        breaker = self.breaker
+        with self.lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + breaker.reset_timeout - now
+                if remaining > 0:
+                    self.rejected += 1
+                    raise exc.CircuitOpen(self.host, remaining)
+                self._transition(HALF_OPEN, now, events)
+
+            if self.state == CLOSED:
+                return False
+
+            # Half-open; probes which never complete eventually expire
+            if (self.probes >= breaker.half_open_probes and
+                    now < self.probe_deadline):
+                self.rejected += 1
+                raise exc.CircuitOpen(self.host,
+                                      self.probe_deadline - now)
+
+            self.probes += 1
+            self.probe_deadline = now + breaker.reset_timeout
+            return True
+
+    def release(self, probe):
+        """Release an admitted request without recording an outcome."""
+
+        if probe:
+            with self.lock:
+                if self.state == HALF_OPEN and self.probes > 0:
+                    self.probes -= 1
+
+    def record(self, probe, success, now, events):
+        """Record the outcome of an admitted request."""
+
+        breaker = self.breaker
+        with self.lock:
+            if self.state == HALF_OPEN:
+                if not probe:
+                    return
+                if self.probes > 0:
+                    self.probes -= 1
+
+                if not success:
+                    self._transition(OPEN, now, events)
+                else:
+                    self.probe_successes += 1
+                    if self.probe_successes >= breaker.close_after:
+                        self._transition(CLOSED, now, events)
+            elif self.state == CLOSED:
+                bucket = self._window(now)
+                bucket[1 if success else 2] += 1
+                if success:
+                    return
+
+                # Check whether the failure rate is too high
+                successes = sum(b[1] for b in self.buckets)
+                failures = sum(b[2] for b in self.buckets)
+                total = successes + failures
+                if (total >= breaker.min_requests and
+                        failures >= breaker.failure_ratio * total):
+                    self._transition(OPEN, now, events)
+
+    def stats(self, now):
+        """Return a dictionary of statistics for the circuit."""
+
+        with self.lock:
+            open_seconds = self.open_seconds
+            if self.state == OPEN:
+                open_seconds += now - self.opened_at
+
+            self._window(now)
+            return {
+                'state': self.state,
+                'successes': sum(b[1] for b in self.buckets),
+                'failures': sum(b[2] for b in self.buckets),
+                'rejected': self.rejected,
+                'opens': self.opens,
+                'open_seconds': open_seconds,
+            }
+
+
+class CircuitBreaker(processor.Processor):
+    """Fail fast when requests to a host keep failing.
+
+    Outcomes of requests are tracked for each host over a sliding
+    window of window seconds.  A request fails if its response status
+    is in statuses or if the client raised one of the exceptions
+    (connection errors, by default); other responses succeed.  Once
+    at least min_requests have been made in the window and at least
+    failure_ratio of them have failed, the circuit for the host opens:
+    further requests immediately raise CircuitOpen, without touching
+    the network.
+
+    After reset_timeout seconds, the circuit becomes half-open, and up
+    to half_open_probes requests at a time are let through.  If
+    close_after of these succeed in a row, the circuit closes again;
+    if any fails, it opens again.
+
+    State transitions are counted in the 'transitions' dictionary,
+    keyed by (old, new) state pairs, and are passed to the listener,
+    if one is given, as listener(host, old, new).  stats() returns the
+    state, window counts, and time spent open for each host.
+
+    A CircuitBreaker is thread-safe.  When used together with a
+    RetryProcessor, the outcome of each attempt is seen by the
+    breaker, whichever of the two is pushed first.
+    """
+
+    def __init__(self, failure_ratio=0.5, min_requests=20, window=10.0,
+                 buckets=10, reset_timeout=30.0, half_open_probes=1,
+                 close_after=1, statuses=(500, 502, 503, 504),
+                 exceptions=(socket.error, httplib.HTTPException),
+                 listener=None):
+        """Initialize a circuit breaker."""
+
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.buckets = buckets
+        self.bucket_width = float(window) / buckets
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.close_after = close_after
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.listener = listener
+
+        self.transitions = collections.defaultdict(int)
+
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, url):
+        """Look up the circuit for the host of url."""
+
+        host = urlparse.urlsplit(url).netloc.lower()
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            with self._lock:
+                circuit = self._circuits.setdefault(host,
+                                                    _Circuit(self, host))
+
+        return circuit
+
+    def _notify(self, events):
+        """Count state transitions and notify the listener."""
+
+        if not events:
+            return
+
+        with self._lock:
+            for _host, old, new in events:
+                self.transitions[(old, new)] += 1
+
+        if self.listener is not None:
+            for host, old, new in events:
+                self.listener(host, old, new)
+
+    def _finish(self, req, success):
+        """Record the outcome of req; success of None just releases it."""
+
+        admitted = getattr(req, '_circuit', None)
+        if admitted is None:
+            return
+        req._circuit = None
+
+        circuit, probe = admitted
+        if success is None:
+            circuit.release(probe)
+            return
+
+        events = []
+        circuit.record(probe, success, time.time(), events)
+        self._notify(events)
+
+    def proc_request(self, req):
+        """Admit the request, or raise CircuitOpen."""
+
+        # Release any admission an earlier attempt failed to record
+        self._finish(req, None)
+
+        events = []
+        circuit = self._circuit(req.url)
+        try:
+            probe = circuit.admit(time.time(), events)
+        finally:
+            self._notify(events)
+
+        req._circuit = (circuit, probe)
+
+    def proc_response(self, resp):
+        """Record the outcome of a response."""
+
+        req = getattr(resp, 'request', None)
+        if req is None:
+            return
+
+        # Cached responses say nothing about the host
+        if getattr(resp, 'fromcache', False):
+            self._finish(req, None)
+        else:
+            self._finish(req, resp.status not in self.statuses)
+
+    def proc_exception(self, exc_type, exc_value, traceback):
+        """Record the outcome of a failed request."""
+
+        req = getattr(exc_value, 'request', None)
+        if req is None or hasattr(exc_value, 'response'):
+            # Responses are recorded by proc_response()
+            return None
+
+        self._finish(req, False if isinstance(exc_value, self.exceptions)
+                     else None)
+
+        return None
+
+    def state(self, host):
+        """Return the state of the circuit for host."""
+
+        circuit = self._circuits.get(host.lower())
+        return circuit.state if circuit is not None else CLOSED
+
+    def stats(self):
+        """Return a dictionary mapping hosts to circuit statistics."""
+
+        now = time.time()
+        with self._lock:
+            circuits = self._circuits.items()
+
+        return dict((host, circuit.stats(now)) for host, circuit in circuits)
@@ -0,0 +1,726 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import email.utils
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import httplib2
+
+from requiem import processor
+
+
+__all__ = ['CacheProcessor', 'MemoryStore', 'SQLiteStore']
+
+
+# Status codes we cache
+_cacheable_status = frozenset([200, 203])
+
+
+# Request methods which invalidate cached entries
+_unsafe_methods = frozenset(['POST', 'PUT', 'DELETE', 'PATCH'])
+
+
+def _parse_cache_control(value):
+    """Parse a Cache-Control header into a dictionary.
+
+    Directives without values map to True.
+    """
+
+    result = {}
+    for directive in (value or '').split(','):
+        name, _sep, arg = directive.strip().partition('=')
+        if name:
+            result[name.lower()] = arg.strip().strip('"') if _sep else True
+
+    return result
+
+
+def _parse_date(value):
+    """Parse an HTTP date into a timestamp, or None if invalid."""
+
+    parsed = email.utils.parsedate_tz(value or '')
+    if parsed is None:
+        return None
+
+    return email.utils.mktime_tz(parsed)
+
+
+def _parse_int(value):
+    """Parse a non-negative integer, returning None if invalid."""
+
+    try:
+        result = int(value)
+    except (TypeError, ValueError):
+        return None
+
+    return result if result >= 0 else None
+
+
+def freshness(headers, now):
+    """Compute the time at which a response stops being fresh.
+
+    The headers are the response headers, with lower-case keys, and
+    now is the time the response was received.  Returns None if the
+    response has no explicit freshness information.
+    """
+
+    cc = _parse_cache_control(headers.get('cache-control'))
+    if 'no-cache' in cc:
+        return now
+
+    # Correct for time the response spent in other caches
+    age = _parse_int(headers.get('age')) or 0
+
+    max_age = _parse_int(cc.get('max-age'))
+    if max_age is not None:
+        return now + max_age - age
+
+    # Fall back to Expires, relative to Date
+    expires = _parse_date(headers.get('expires'))
+    if 'expires' in headers and expires is None:
+        # Invalid Expires means already expired
+        return now
+    elif expires is not None:
+        date = _parse_date(headers.get('date')) or now
+        return now + (expires - date) - age
+
+    return None
+
+
+def cacheable(req, resp):
+    """Determine whether a response may be stored at all."""
+
+    if req.method != 'GET' or resp.status not in _cacheable_status:
+        return False
+    elif not isinstance(resp.body, basestring):
+        # Streamed responses can't be cached
+        return False
+    elif resp.get('vary', '').strip() == '*':
+        return False
+
+    # Check for no-store
+    if 'no-store' in _parse_cache_control(resp.get('cache-control')):
+        return False
+    elif 'no-store' in _parse_cache_control(req.get('cache-control')):
+        return False
+
+    return True
+
+
+def _dumps_headers(headers):
+    """Serialize a dictionary of headers for storage."""
+
+    return json.dumps(headers, encoding='latin-1')
+
+
+def _loads_headers(text):
+    """Deserialize a dictionary of headers from storage."""
+
+    return dict((k.encode('latin-1'),
+                 v.encode('latin-1') if v is not None else None)
+                for k, v in json.loads(text).items())
+
+
+class CacheEntry(object):
+    """Represent a cached response."""
+
+    def __init__(self, status, reason, headers, body, vary, expires,
+                 stale_until=None):
+        """Initialize a cache entry.
+
+        The headers are the response headers, with lower-case keys;
+        vary maps the names of request headers the response varies on
+        to their values; expires is the time at which the entry
+        becomes stale, or None if it is stale immediately; and
+        stale_until is the time until which the stale entry may still
+        be served while it is revalidated in the background.
+        """
+
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.vary = vary
+        self.expires = expires
+        self.stale_until = stale_until
+
+        # Estimate the size of the entry
+        self.size = len(body) + sum(len(k) + len(v)
+                                    for k, v in headers.items())
+
+    def fresh(self, now):
+        """Determine whether the entry is fresh."""
+
+        return self.expires is not None and now < self.expires
+
+    def usable_stale(self, now):
+        """Determine whether a stale entry may be served for now."""
+
+        return self.stale_until is not None and now < self.stale_until
+
+    def matches(self, req):
+        """Determine whether the entry matches the request's headers."""
+
+        for hdr, value in self.vary.items():
+            if req.get(hdr) != value:
+                return False
+
+        return True
+
+    def response(self):
+        """Construct a new response from the entry."""
+
+        resp = httplib2.Response(dict(self.headers, status=str(self.status)))
+        resp.reason = self.reason
+        resp.fromcache = True
+        resp.body = self.body
+
+        return resp
+
+    @classmethod
+    def from_headers(cls, status, reason, headers, body, vary, now,
+                     stale_while_revalidate=None):
+        """Construct an entry, computing its freshness from the headers.
+
+        If the response does not include a stale-while-revalidate
+        Cache-Control directive, the stale_while_revalidate argument
+        gives the default window, in seconds.
+        """
+
+        expires = freshness(headers, now)
+
+        # Determine how long a stale entry may be served
+        stale_until = None
+        cc = _parse_cache_control(headers.get('cache-control'))
+        window = _parse_int(cc.get('stale-while-revalidate'))
+        if window is None:
+            window = stale_while_revalidate
+        if (window and expires is not None and 'no-cache' not in cc and
+                'must-revalidate' not in cc):
+            stale_until = expires + window
+
+        return cls(status, reason, headers, body, vary, expires, stale_until)
+
+    @classmethod
+    def from_response(cls, req, resp, now, stale_while_revalidate=None):
+        """Construct an entry from a request and its response."""
+
+        headers = dict((k, v) for k, v in resp.items() if k != 'status')
+        vary = dict((hdr.strip(), req.get(hdr.strip()))
+                    for hdr in resp.get('vary', '').split(',')
+                    if hdr.strip())
+
+        return cls.from_headers(resp.status, resp.reason, headers, resp.body,
+                                vary, now, stale_while_revalidate)
+
+
+class MemoryStore(object):
+    """In-process cache storage.
+
+    Entries are kept in a least-recently-used cache bounded by both
+    the number of entries and their total size, in bytes.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        """Initialize a memory store."""
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.stores = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Look up an entry, marking it as recently used."""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+
+        return entry
+
+    def put(self, key, entry):
+        """Store an entry, evicting old entries as needed."""
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+
+            # Don't store entries which would fill the cache alone
+            if entry.size > self.max_bytes:
+                return
+
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self.stores += 1
+
+            # Evict least recently used entries
+            while (len(self._entries) > self.max_entries or
+                   self._bytes > self.max_bytes):
+                _key, old = self._entries.popitem(last=False)
+                self._bytes -= old.size
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove the entry for the specified key, if any."""
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+
+    def clear(self):
+        """Remove all entries."""
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return a dictionary of storage statistics."""
+
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'stores': self.stores,
+                'evictions': self.evictions,
+            }
+
+
+class SQLiteStore(object):
+    """Cache storage in a SQLite database file.
+
+    The database may be shared by all processes on a host--for
+    instance, the workers of a pre-forking server--so that new and
+    restarted workers find a warm cache.  Each write is an atomic
+    transaction; when the store exceeds max_entries or max_bytes, the
+    least recently used entries are evicted.  To avoid a write on
+    every read, the last-use time of an entry is only updated if it
+    is more than touch_interval seconds old.  Database errors, such
+    as a lock timeout, are treated as cache misses.
+    """
+
+    # Bump when the schema changes; older databases are only a cache,
+    # so they are simply dropped and recreated
+    _version = 2
+    _drop = (
+        'DROP TABLE IF EXISTS entries',
+        'DROP TABLE IF EXISTS totals',
+    )
+    # The small columns come before the body so that scans which
+    # don't need the body never read its overflow pages
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS entries ('
+        'key TEXT PRIMARY KEY, status INTEGER, reason TEXT, vary TEXT, '
+        'expires REAL, stale_until REAL, size INTEGER, atime REAL, '
+        'headers TEXT, body BLOB)',
+        'CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime, size)',
+        # Running totals, so that eviction need not scan the table;
+        # the triggers keep them current within each transaction
+        'CREATE TABLE IF NOT EXISTS totals (count INTEGER, bytes INTEGER)',
+        'INSERT INTO totals SELECT 0, 0 WHERE NOT EXISTS '
+        '(SELECT 1 FROM totals)',
+        'CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries '
+        'BEGIN UPDATE totals SET count = count + 1, '
+        'bytes = bytes + NEW.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries '
+        'BEGIN UPDATE totals SET count = count - 1, '
+        'bytes = bytes - OLD.size; END',
+    )
+
+    def __init__(self, path, max_entries=10000, max_bytes=256 * 1024 * 1024,
+                 timeout=5.0, touch_interval=60.0):
+        """Initialize a SQLite store, creating the database if needed."""
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.touch_interval = touch_interval
+
+        # Counters are per-process
+        self.stores = 0
+        self.evictions = 0
+        self.errors = 0
+
+        self._local = threading.local()
+        self._conn()
+
+    def _conn(self):
+        """Get the database connection for this thread and process.
+
+        SQLite connections must not be used across a fork, so a new
+        connection is opened if the process ID has changed.
+        """
+
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._setup(conn)
+            self._local.conn = conn
+            self._local.pid = pid
+
+        return conn
+
+    def _setup(self, conn):
+        """Create or upgrade the database schema."""
+
+        if conn.execute('PRAGMA user_version').fetchone()[0] == self._version:
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have upgraded it in the meantime
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != self._version:
+                for stmt in self._drop + self._schema:
+                    conn.execute(stmt)
+                conn.execute('PRAGMA user_version = %d' % self._version)
+            conn.execute('COMMIT')
+        except:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            raise
+
+    def get(self, key):
+        """Look up an entry."""
+
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                'SELECT status, reason, headers, body, vary, expires, '
+                'stale_until, atime FROM entries WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+
+            # Update the last-use time, but not too often
+            now = time.time()
+            if now - row[7] > self.touch_interval:
+                conn.execute('UPDATE entries SET atime = ? WHERE key = ?',
+                             (now, key))
+        except sqlite3.Error:
+            self.errors += 1
+            return None
+
+        return CacheEntry(row[0], row[1], _loads_headers(row[2]),
+                          str(row[3]), _loads_headers(row[4]), row[5],
+                          row[6])
+
+    def put(self, key, entry):
+        """Store an entry, evicting old entries as needed."""
+
+        if entry.size > self.max_bytes:
+            self.delete(key)
+            return
+
+        try:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Delete explicitly, rather than INSERT OR REPLACE, so
+                # the delete trigger keeps the totals right
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                conn.execute(
+                    'INSERT INTO entries VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, entry.status, entry.reason,
+                     _dumps_headers(entry.vary), entry.expires,
+                     entry.stale_until, entry.size, time.time(),
+                     _dumps_headers(entry.headers),
+                     sqlite3.Binary(entry.body)))
+                self._evict(conn)
+                conn.execute('COMMIT')
+            except:
+                # Don't leave the transaction open, even if COMMIT
+                # failed; SQLite may already have rolled it back
+                try:
+                    conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                raise
+            self.stores += 1
+        except sqlite3.Error:
+            self.errors += 1
+
+    def _evict(self, conn):
+        """Evict least recently used entries to stay within the limits.
+
+        Must be called within a transaction.
+        """
+
+        count, total = conn.execute(
+            'SELECT count, bytes FROM totals').fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        # The (atime, size) index covers this query, so it walks only
+        # as far as it needs to and never touches the table itself
+        victims = []
+        for rowid, size in conn.execute(
+                'SELECT rowid, size FROM entries ORDER BY atime'):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((rowid,))
+            count -= 1
+            total -= size
+
+        conn.executemany('DELETE FROM entries WHERE rowid = ?', victims)
+        self.evictions += len(victims)
+
+    def delete(self, key):
+        """Remove the entry for the specified key, if any."""
+
+        try:
+            self._conn().execute('DELETE FROM entries WHERE key = ?', (key,))
+        except sqlite3.Error:
+            self.errors += 1
+
+    def clear(self):
+        """Remove all entries."""
+
+        try:
+            self._conn().execute('DELETE FROM entries')
+        except sqlite3.Error:
+            self.errors += 1
+
+    def stats(self):
+        """Return a dictionary of storage statistics."""
+
+        try:
+            count, total = self._conn().execute(
+                'SELECT count, bytes FROM totals').fetchone()
+        except sqlite3.Error:
+            self.errors += 1
+            count = total = None
+
+        return {
+            'entries': count,
+            'bytes': total,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'errors': self.errors,
+        }
+
+
+class CacheProcessor(processor.Processor):
+    """Cache responses to GET requests.
+
+    Responses are kept in a store; by default, this is a MemoryStore
+    bounded by max_entries and max_bytes, but another store, such as
+    a SQLiteStore shared by several processes, may be passed as the
+    store argument.  Fresh entries, as determined by the
+    Cache-Control and Expires headers, are returned directly from
+    proc_request(), without contacting the server.  For stale
+    entries, If-None-Match and If-Modified-Since headers are added to
+    the request, and a 304 response is turned back into the cached
+    response.
+
+    Stale entries within their stale-while-revalidate window--given
+    by the Cache-Control directive of that name or, failing that, by
+    the stale_while_revalidate argument--are served immediately while
+    a background thread revalidates them.
+
+    The 'hits', 'stale_hits', 'misses', and 'revalidated' attributes
+    count cache events; stats() returns them, along with the store's
+    statistics, as a dictionary.
+    """
+
+    # Request attributes copied to background revalidation requests
+    _refresh_attrs = ('codec', 'compression', 'max_redirects')
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024,
+                 store=None, stale_while_revalidate=None):
+        """Initialize a cache processor."""
+
+        self.store = store or MemoryStore(max_entries, max_bytes)
+        self.stale_while_revalidate = stale_while_revalidate
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _refresh(self, req):
+        """Revalidate the entry for req in a background thread."""
+
+        with self._lock:
+            if req.url in self._refreshing:
+                return
+            self._refreshing.add(req.url)
+
+        # Build a copy of the request which bypasses fresh entries
+        headers = req._headers.copy()
+        headers['Cache-Control'] = 'no-cache'
+        refresh = req.__class__(req.method, req.url, req.client,
+                                req.procstack, body=req.body,
+                                headers=headers,
+                                debug=req._debug if req._debugging else None,
+                                debugging=req._debugging)
+
+        # Carry over the per-request settings, such as the codec
+        for attr in self._refresh_attrs:
+            if attr in req.__dict__:
+                setattr(refresh, attr, req.__dict__[attr])
+
+        def run():
+            try:
+                refresh.send()
+            except Exception:
+                # The stale entry stays in place
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(req.url)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self, req, entry):
+        """Construct and process a response from an entry."""
+
+        resp = entry.response()
+        resp.request = req
+        req.proc_response(resp)
+
+        return resp
+
+    def invalidate(self, url):
+        """Remove the entry for the specified URL, if any."""
+
+        self.store.delete(url)
+
+    def clear(self):
+        """Remove all entries."""
+
+        self.store.clear()
+
+    def stats(self):
+        """Return a dictionary of cache statistics."""
+
+        result = self.store.stats()
+        with self._lock:
+            result.update(hits=self.hits, stale_hits=self.stale_hits,
+                          misses=self.misses, revalidated=self.revalidated)
+
+        return result
+
+    def proc_request(self, req):
+        """Serve fresh entries, or make the request conditional."""
+
+        if req.method in _unsafe_methods:
+            self.invalidate(req.url)
+            return None
+        elif req.method != 'GET':
+            return None
+
+        # Look up a matching entry
+        entry = self.store.get(req.url)
+        if entry is None or not entry.matches(req):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Serve a fresh entry, unless the request demands revalidation
+        now = time.time()
+        cc = _parse_cache_control(req.get('cache-control'))
+        if 'no-cache' not in cc:
+            if entry.fresh(now):
+                with self._lock:
+                    self.hits += 1
+                return self._serve(req, entry)
+            elif entry.usable_stale(now):
+                with self._lock:
+                    self.stale_hits += 1
+                self._refresh(req)
+                return self._serve(req, entry)
+
+        # Stale; revalidate using the validators we have
+        with self._lock:
+            self.misses += 1
+        if 'etag' in entry.headers and 'if-none-match' not in req:
+            req['if-none-match'] = entry.headers['etag']
+        if ('last-modified' in entry.headers and
+                'if-modified-since' not in req):
+            req['if-modified-since'] = entry.headers['last-modified']
+
+        return None
+
+    def proc_response(self, resp):
+        """Store responses and turn 304 responses into cached ones."""
+
+        req = getattr(resp, 'request', None)
+        if req is None or getattr(resp, 'fromcache', False):
+            return
+
+        now = time.time()
+
+        # Handle revalidation
+        if resp.status == 304 and req.method == 'GET':
+            entry = self.store.get(req.url)
+            if entry is None:
+                return
+
+            # Update the entry from the 304's headers
+            headers = dict(entry.headers)
+            headers.update((k, v) for k, v in resp.items() if k != 'status')
+            entry = CacheEntry.from_headers(entry.status, entry.reason,
+                                            headers, entry.body, entry.vary,
+                                            now, self.stale_while_revalidate)
+            self.store.put(req.url, entry)
+            with self._lock:
+                self.revalidated += 1
+
+            # Turn the response into the cached response
+            resp.clear()
+            resp.update(headers)
+            resp['status'] = str(entry.status)
+            resp.status = entry.status
+            resp.reason = entry.reason
+            resp.body = entry.body
+            req.proc_response(resp)
+            return
+
+        # Store cacheable responses which we can either serve or
+        # revalidate
+        if not cacheable(req, resp):
+            return
+        entry = CacheEntry.from_response(req, resp, now,
+                                         self.stale_while_revalidate)
+        if (entry.expires is not None and entry.expires > now or
+                'etag' in entry.headers or 'last-modified' in entry.headers):
+            self.store.put(req.url, entry)
@@ -15,16 +15,79 @@
 
 import sys
 
-import httplib2
-
+from requiem import batch
+from requiem import compression
 from requiem import headers as hdrs
+from requiem import metrics
 from requiem import processor
 from requiem import request
+from requiem import trace
+from requiem import transport
 
 
 __all__ = ['RESTClient']
 
 
+def _invalidating(name):
+    """
+    Construct a HeaderDict mutator method which also discards the
+    rendered headers.
+    """
+
+    meth = getattr(hdrs.HeaderDict, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.rendered = None
+        return meth(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = meth.__doc__
+
+    return wrapper
+
+
+class _GlobalHeaders(hdrs.HeaderDict):
+    """
+    The headers to set on every request made by a client.  The
+    'rendered' attribute caches the result of rendering the headers,
+    and is discarded whenever the headers are modified.
+    """
+
+    rendered = None
+
+    # Discard the rendered headers whenever the headers change
+    for _name in ('__delitem__', '__setitem__', 'add', 'clear', 'pop',
+                  'popitem', 'setdefault', 'update'):
+        vars()[_name] = _invalidating(_name)
+    del _name
+
+    def render(self):
+        """
+        Render the headers.  Returns a tuple of a read-only HeaderDict
+        of the static headers, with their values converted to strings,
+        and a tuple of (name, callable) pairs for the headers whose
+        values must be computed for each request.
+        """
+
+        rendered = self.rendered
+        if rendered is not None:
+            return rendered
+
+        static = hdrs.HeaderDict()
+        dynamic = []
+        for hdr, value in self.items():
+            if callable(value):
+                dynamic.append((hdr, value))
+            else:
+                # Stringify it; only attach it if it's meaningful
+                value = str(value)
+                if value:
+                    static[hdr] = value
+
+        self.rendered = rendered = (static.freeze(), tuple(dynamic))
+        return rendered
+
+
 class RESTClient(object):
     """Represent a REST client API.
 
@@ -38,11 +101,14 @@ class RESTClient(object):
     The HTTPRequest object additionally needs an
     httplib2.Http-compatible client object, which may be provided by
     passing the 'client' keyword argument to the RESTClient
-    constructor.  If no client is provided, a basic one will be
-    allocated.
+    constructor.  If no client is provided, one will be allocated by
+    calling the '_client_class' class attribute; by default, this is
+    a ConnectionPool, which allows a single RESTClient to be safely
+    shared by multiple threads.
     """
 
     _req_class = request.HTTPRequest
+    _client_class = transport.ConnectionPool
 
     def __init__(self, baseurl, headers=None, debug=None, client=None):
         """Initialize a REST client API.
@@ -60,10 +126,24 @@ class RESTClient(object):
 
         # Initialize an API client
         self._baseurl = baseurl
-        self._headers = hdrs.HeaderDict(headers)
+        self._headers = headers
         self._debug_stream = sys.stderr if debug is True else debug
-        self._client = client or httplib2.Http()
+        self._client = client or self._client_class()
         self._procstack = processor.ProcessorStack()
+        self._tracer = None
+        self._compression = None
+
+    @property
+    def _headers(self):
+        """The headers to set on every request."""
+
+        return self._global_headers
+
+    @_headers.setter
+    def _headers(self, value):
+        """Set the headers to set on every request."""
+
+        self._global_headers = _GlobalHeaders(value)
 
     def _debug(self, msg, *args, **kwargs):
         """Emit debugging messages."""
@@ -81,7 +161,19 @@ class RESTClient(object):
         # Emit the message
         print >>self._debug_stream, msg % fmtargs
 
-    def _push_processor(self, proc, index=None):
+    @property
+    def _debugging(self):
+        """Whether debugging messages are emitted.
+
+        True if there is a debugging stream, or if _debug() has been
+        overridden, as it may then emit messages regardless.
+        """
+
+        return (self._debug_stream not in (None, False) or
+                type(self)._debug.im_func is not RESTClient._debug.im_func)
+
+    def _push_processor(self, proc, index=None, methnames=None, methods=None,
+                        urls=None):
         """
         Pushes a processor onto the processor stack.  Processors are
         objects with proc_request(), proc_response(), and/or
@@ -98,42 +190,124 @@ class RESTClient(object):
         the index parameter is None (the default), or a processor may
         be inserted into the stack by specifying an integer index.
 
+        A processor may be restricted to some requests by specifying
+        one or more selectors: methnames, a list of the names of the
+        @restmethod() decorated methods it applies to; methods, a list
+        of HTTP methods; or urls, a list of regular expressions
+        matching request URLs.  Processors are only run for the
+        requests matching all of their selectors.
+
         For more information about processors, see the
         requiem.Processor class.
         """
 
+        if methnames is not None or methods is not None or urls is not None:
+            proc = processor.ScopedProcessor(proc, methnames, methods, urls)
+
         if index is None:
             self._procstack.append(proc)
         else:
             self._procstack.insert(index, proc)
 
+    def _batch(self, max_workers=10, per_host=None):
+        """
+        Creates a Batch for running many independent calls of this
+        client's methods concurrently.  Calls are run on at most
+        max_workers threads; if per_host is given, no more than that
+        many calls to a single host will be in flight at once.  For
+        example:
+
+            with client._batch(max_workers=20) as b:
+                results = list(b.map(client.get_item, item_ids))
+
+        Note that the default client, a ConnectionPool, also limits
+        the number of connections to each host; its maxsize should be
+        at least as large as the desired concurrency.
+        """
+
+        return batch.Batch(max_workers, per_host)
+
+    def _trace(self, sample_rate=1.0, size=100, preview=256, stream=None):
+        """
+        Enables tracing of requests.  A fraction sample_rate of the
+        requests made by this client are recorded in a ring buffer
+        holding the last size records, with bodies truncated to
+        preview bytes.  Formatting is deferred until the records are
+        dumped, or written to stream, if given, as each request
+        completes.  Returns the Tracer; use its dump() method to write
+        out the records.  Pass a sample_rate of 0 to disable tracing.
+        """
+
+        if not sample_rate:
+            self._tracer = None
+        else:
+            self._tracer = trace.Tracer(sample_rate, size, preview, stream)
+
+        return self._tracer
+
+    def _compress(self, encodings=('gzip', 'deflate'), level=6):
+        """
+        Enables compression.  The Accept-Encoding header is set to
+        accept responses compressed with the given encodings--'gzip'
+        and 'deflate' are supported; streamed responses are
+        decompressed as they are read, and others as they are
+        received, if the client has not already done so.  Pass an
+        empty sequence to accept only uncompressed responses.
+        Methods may then gzip large request bodies, at the given
+        level, by setting the request's 'compress_threshold' attribute
+        to the minimum size worth compressing.  Returns the
+        Compression object, whose stats() method reports the
+        compression ratios and the time spent compressing.
+        """
+
+        self._compression = compression.Compression(encodings, level)
+        self._headers['accept-encoding'] = self._compression.accept
+
+        return self._compression
+
     def _make_req(self, method, url, methname, headers=None):
         """Create a request object for the specified method and url."""
 
-        # Build up headers
-        hset = hdrs.HeaderDict()
+        # Start from the rendered global headers; these are shared
+        # with the request until it modifies its headers
+        hset, dynamic = self._global_headers.render()
 
-        # Walk through our global headers
-        for hdr, value in self._headers.items():
-            # If it's a callable, call it
-            if callable(value):
-                value = value(methname)
-            else:
-                # OK, just stringify it
-                value = str(value)
+        # Compute the dynamic headers and add the specified headers
+        if dynamic or headers:
+            hset = hset.copy()
+
+            for hdr, func in dynamic:
+                value = func(methname)
 
-            # If it's meaningful, attach it
-            if value:
-                hset[hdr] = value
+                # If it's meaningful, attach it
+                if value:
+                    hset[hdr] = value
 
-        # Were headers passed in?
-        if headers is not None:
-            # Update from specified headers
-            hset.update(headers)
+            if headers:
+                hset.update(headers)
+
+            hset.freeze()
 
         # Hook method to instantiate requests
         self._debug("Creating request %s.%s(%r, %r, headers=%r)",
                     self._req_class.__module__, self._req_class.__name__,
                     method, url, hset)
-        return self._req_class(method, url, self._client, self._procstack,
-                               headers=hset, debug=self._debug)
+        procstack = self._procstack.select(methname, method, url)
+        req = self._req_class(method, url, self._client, procstack,
+                              headers=hset, debug=self._debug,
+                              debugging=self._debugging)
+
+        # Time the request if any processor wants the timings
+        if procstack.timed:
+            req.timings = metrics.RequestTimings(methname, method, url)
+
+        # Compress the request, if desired
+        if self._compression is not None:
+            req.compression = self._compression
+
+        # Record the request, if it's sampled
+        tracer = self._tracer
+        if tracer is not None and tracer.sample():
+            req.trace = tracer.start(req, methname)
+
+        return req
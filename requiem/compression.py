@@ -0,0 +1,300 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import time
+import zlib
+
+import httplib2
+
+from requiem import exceptions as exc
+from requiem import transport
+
+
+__all__ = ['Compression', 'DecompressingBody']
+
+
+# zlib window sizes for each content coding; raw deflate streams are
+# tried if the zlib-wrapped format fails, as httplib2 does
+_wbits = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class DecompressingBody(transport.StreamBody):
+    """StreamBody which decompresses another StreamBody as it is read.
+
+    Only as much of the compressed body is read from the source as is
+    needed to satisfy each read, so neither the compressed nor the
+    decompressed body is ever held in memory as a whole.  If max_size
+    is given, BodyTooLarge is raised as soon as the decompressed body
+    exceeds it.  When the body has been read, the number of bytes
+    received and produced and the time spent decompressing are added
+    to the counters of the Compression object stats, if given.
+    """
+
+    def __init__(self, source, encoding, chunk_size=65536, max_size=None,
+                 stats=None):
+        """Initialize a decompressing body for the given content coding."""
+
+        super(DecompressingBody, self).__init__(source, self._release_source,
+                                                chunk_size, max_size)
+
+        self.encoding = encoding
+        self.bytes_in = 0
+        self.cpu_time = 0.0
+
+        self._stats = stats
+        self._decomp = zlib.decompressobj(_wbits[encoding])
+        self._try_raw = encoding == 'deflate'
+        self._buf = []
+        self._buflen = 0
+        self._eof = False
+
+    def _release_source(self, complete):
+        """Release the source, and report the counters."""
+
+        if not complete:
+            self._source.close()
+        if self._stats is not None:
+            self._stats._decompressed(self.bytes_in, self.bytes_read,
+                                      self.cpu_time)
+
+    def _decompress(self, data, limit):
+        """Decompress data, producing at most limit bytes (0 for no limit)."""
+
+        start = time.time()
+        try:
+            try:
+                out = self._decomp.decompress(data, limit)
+            except zlib.error:
+                # Some servers send raw deflate streams
+                if not self._try_raw:
+                    raise
+                self._decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+                out = self._decomp.decompress(data, limit)
+            self._try_raw = False
+            return out
+        finally:
+            self.cpu_time += time.time() - start
+
+    def _fill(self, size):
+        """Decompress until size bytes are buffered, or to the end.
+
+        A size < 0 decompresses the whole remaining body.
+        """
+
+        while not self._eof and (size < 0 or self._buflen < size):
+            data = self._decomp.unconsumed_tail
+            if not data:
+                data = self._source.read(self.chunk_size)
+                self.bytes_in += len(data)
+
+            if data:
+                out = self._decompress(data, max(size - self._buflen, 0))
+            else:
+                self._eof = True
+                out = self._decomp.flush()
+
+            if out:
+                self._buf.append(out)
+                self._buflen += len(out)
+
+    def read(self, size=-1):
+        """Read at most size bytes; reads everything if size < 0."""
+
+        if self.closed:
+            return ''
+        if size is None:
+            size = -1
+
+        try:
+            self._fill(size)
+        except zlib.error:
+            self._finish(False)
+            raise httplib2.FailedToDecompressContent(
+                "Content purported to be compressed with %s but failed "
+                "to decompress." % self.encoding, None, '')
+        except:
+            self._finish(False)
+            raise
+
+        # Take the data from the buffer
+        data = ''.join(self._buf)
+        if size >= 0 and len(data) > size:
+            self._buf = [data[size:]]
+            data = data[:size]
+        else:
+            self._buf = []
+        self._buflen -= len(data)
+
+        # Enforce the size limit
+        self.bytes_read += len(data)
+        if self.max_size is not None and self.bytes_read > self.max_size:
+            self._finish(False)
+            raise exc.BodyTooLarge(self.max_size)
+
+        if not self._buflen and self._eof:
+            self._finish(True)
+
+        return data
+
+
+class Compression(object):
+    """Compression settings and counters for a client.
+
+    The encodings are the content codings--'gzip' and 'deflate' are
+    supported--accepted for responses, in order of preference; if
+    there are none, only uncompressed responses are accepted.
+    Request bodies are compressed with gzip at the given level.
+
+    The counters record, for requests and responses separately, how
+    many bodies were compressed or decompressed, their sizes before
+    and after, and the time spent in zlib, which is CPU-bound.
+    Responses which the client decompressed itself, as httplib2.Http
+    does for responses which are not streamed, are only counted in
+    'client_decompressed', since their compressed size is not known.
+    """
+
+    def __init__(self, encodings=('gzip', 'deflate'), level=6):
+        """Initialize compression settings."""
+
+        for encoding in encodings:
+            if encoding not in _wbits:
+                raise ValueError("Unsupported content coding %r" % encoding)
+
+        self.encodings = tuple(encodings)
+        self.level = level
+        self.accept = ', '.join(self.encodings) or 'identity'
+
+        self.requests = 0
+        self.request_bytes = 0
+        self.request_compressed = 0
+        self.request_time = 0.0
+
+        self.responses = 0
+        self.response_bytes = 0
+        self.response_compressed = 0
+        self.response_time = 0.0
+        self.client_decompressed = 0
+
+        self._lock = threading.Lock()
+
+    def compress(self, data):
+        """Compress a request body with gzip, counting it."""
+
+        start = time.time()
+        comp = zlib.compressobj(self.level, zlib.DEFLATED,
+                                16 + zlib.MAX_WBITS)
+        result = comp.compress(data) + comp.flush()
+        elapsed = time.time() - start
+
+        with self._lock:
+            self.requests += 1
+            self.request_bytes += len(data)
+            self.request_compressed += len(result)
+            self.request_time += elapsed
+
+        return result
+
+    def _decompressed(self, compressed, size, elapsed):
+        """Count a decompressed response body."""
+
+        with self._lock:
+            self.responses += 1
+            self.response_bytes += size
+            self.response_compressed += compressed
+            self.response_time += elapsed
+
+    def inflate(self, resp, content):
+        """Decompress a response body which has been read in full.
+
+        If the response is compressed with a supported content
+        coding, returns the decompressed body and adjusts the headers
+        as httplib2 does; otherwise, returns content unchanged.
+        """
+
+        encoding = resp.get('content-encoding', '').strip().lower()
+        if encoding not in _wbits:
+            if '-content-encoding' in resp:
+                with self._lock:
+                    self.client_decompressed += 1
+            return content
+
+        start = time.time()
+        try:
+            try:
+                result = zlib.decompress(content, _wbits[encoding])
+            except zlib.error:
+                # Some servers send raw deflate streams
+                if encoding != 'deflate':
+                    raise
+                result = zlib.decompress(content, -zlib.MAX_WBITS)
+        except zlib.error:
+            raise httplib2.FailedToDecompressContent(
+                "Content purported to be compressed with %s but failed "
+                "to decompress." % encoding, resp, '')
+        self._decompressed(len(content), len(result), time.time() - start)
+
+        resp['-content-encoding'] = resp.pop('content-encoding')
+        resp['content-length'] = str(len(result))
+
+        return result
+
+    def decompress(self, resp, content, chunk_size=65536, max_size=None):
+        """Arrange for a streamed response body to be decompressed.
+
+        If the response is compressed with a supported content
+        coding, returns a DecompressingBody reading content; the
+        'content-encoding' header is moved to '-content-encoding' and
+        the 'content-length' header is removed, as httplib2 does.
+        Otherwise, returns content unchanged.
+        """
+
+        encoding = resp.get('content-encoding', '').strip().lower()
+        if encoding not in _wbits:
+            return content
+
+        resp['-content-encoding'] = resp.pop('content-encoding')
+        resp.pop('content-length', None)
+
+        return DecompressingBody(content, encoding, chunk_size, max_size,
+                                 self)
+
+    def stats(self):
+        """Return a dictionary of the counters and compression ratios.
+
+        A ratio is the uncompressed size divided by the compressed
+        size; it is None until a body has been counted.
+        """
+
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'request_bytes': self.request_bytes,
+                'request_compressed': self.request_compressed,
+                'request_ratio': (float(self.request_bytes) /
+                                  self.request_compressed
+                                  if self.request_compressed else None),
+                'request_time': self.request_time,
+                'responses': self.responses,
+                'response_bytes': self.response_bytes,
+                'response_compressed': self.response_compressed,
+                'response_ratio': (float(self.response_bytes) /
+                                   self.response_compressed
+                                   if self.response_compressed else None),
+                'response_time': self.response_time,
+                'client_decompressed': self.client_decompressed,
+            }
@@ -15,6 +15,9 @@
 
 import functools
 import inspect
+import string
+import sys
+import time
 import urllib
 import urlparse
 
@@ -176,6 +179,273 @@ def _urljoin(left, right):
         return left + '/' + right
 
 
+# Characters never escaped
+_unreserved = string.ascii_letters + string.digits + '_.-'
+
+# Characters left unescaped in replacement fields: in the path, in
+# the query string or fragment, and at the very start of the URI,
+# where the field may supply an entire URL
+_path_safe = _unreserved + "~:@!$&'()*+,;="
+_query_safe = _unreserved + "~"
+_url_safe = _unreserved + "~:/?#[]@!$&'()*+,;=%"
+
+# Bound on the number of base URLs for which joins are cached
+_join_cache_max = 64
+
+
+def _quote_field(value, safe):
+    """Percent-escape a formatted replacement field value."""
+
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+
+    # Most values need no escaping; checking is much cheaper
+    if not value.translate(None, safe):
+        return value
+
+    return urllib.quote(value, safe)
+
+
+def _quote_plus(value):
+    """Escape a query parameter value, like urllib.quote_plus()."""
+
+    if type(value) in (int, long):
+        # Integers need no escaping
+        return str(value)
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+
+    # Most values need no escaping; checking is much cheaper
+    if not value.translate(None, _unreserved):
+        return value
+
+    return urllib.quote_plus(value)
+
+
+def _encode_query(pairs):
+    """Encode a query string.
+
+    The pairs are a sequence of (quoted name, value) tuples.  Values
+    of None are omitted; lists and tuples produce one parameter for
+    each of their (non-None) items.  Unicode values are encoded as
+    UTF-8.
+    """
+
+    parts = []
+    for name, value in pairs:
+        if value is None:
+            continue
+        elif isinstance(value, (list, tuple)):
+            parts.extend(name + '=' + _quote_plus(item) for item in value
+                         if item is not None)
+        else:
+            parts.append(name + '=' + _quote_plus(value))
+
+    return '&'.join(parts)
+
+
+class _CallPlan(object):
+    """Precompiled description of how to invoke a @restmethod().
+
+    Everything about a decorated method that does not depend on the
+    actual call arguments--the argument specification, the parsed
+    URI template, and the query and header argument lists--is
+    computed once, when the decorator is applied.  The per-call work
+    is then reduced to a handful of dictionary operations.
+    """
+
+    def __init__(self, func, method, reluri, qargs, headers):
+        """Compile the call plan for func."""
+
+        self.func = func
+        self.method = method
+        self.reluri = reluri
+        self.qargs = tuple(qargs)
+        self.headers = tuple(headers.items())
+
+        self.qkeys = tuple((arg, _quote_plus(arg)) for arg in qargs)
+
+        # Pre-split the URI template; if there are no replacement
+        # fields, we can do the formatting once and for all
+        self.template = []
+        in_query = False
+        for text, fname, spec, conv in string.Formatter().parse(reluri):
+            in_query = in_query or '?' in text or '#' in text
+            if not self.template and not text:
+                safe = _url_safe
+            else:
+                safe = _query_safe if in_query else _path_safe
+            self.template.append((text, fname, spec, conv, safe))
+        self.fields = frozenset(part[1] for part in self.template
+                                if part[1] is not None)
+        self.static_uri = None if self.fields else reluri.format()
+
+        # Decide how to join the URI to a base URL.  If the URI is
+        # static, the joined URL is cached; if it begins with a
+        # (single) slash, it must be relative, and only the base URL
+        # needs adjusting.  Otherwise, the decision is made for each
+        # call.
+        prefix = self.template[0][0] if self.template else ''
+        if self.static_uri is not None:
+            self.join = 'static'
+        elif prefix[:1] == '/' and prefix[:2] != '//':
+            self.join = 'relative'
+        else:
+            self.join = None
+        self._joins = {}
+
+        # Compute the argument binding information
+        args, varargs, varkw, defaults = inspect.getargspec(func)
+        self.req_name = args[1]
+        self.simple = all(isinstance(arg, str) for arg in args)
+        self.varargs = varargs
+        self.varkw = varkw
+        if not self.simple:
+            # Tuple parameters; always use _getcallargs()
+            return
+
+        # Names bound by position; note the request argument is
+        # injected, so it is not bound
+        self.pos_names = tuple(args[:1]) + tuple(args[2:])
+        self.arg_names = frozenset(args)
+        self.defaults = (tuple(zip(args[-len(defaults):], defaults))
+                         if defaults else ())
+        self.required = tuple(arg for arg in self.pos_names
+                              if arg not in dict(self.defaults))
+
+    def bind(self, positional, named):
+        """Map the call arguments to the function arguments.
+
+        Returns the same tuple as _getcallargs().  Only the common
+        case is handled here; anything unusual (including all error
+        cases) falls back to _getcallargs(), which also generates the
+        appropriate TypeError.
+        """
+
+        if not self.simple or not positional:
+            return _getcallargs(self.func, positional, named)
+
+        # Bind positional arguments
+        pos_names = self.pos_names
+        argmap = dict(zip(pos_names, positional))
+        if len(positional) > len(pos_names):
+            if not self.varargs:
+                return _getcallargs(self.func, positional, named)
+            argmap[self.varargs] = positional[len(pos_names):]
+        elif self.varargs:
+            argmap[self.varargs] = ()
+
+        # Bind keyword arguments
+        if named:
+            arg_names = self.arg_names
+            extra = {}
+            for arg, value in named.items():
+                if arg not in arg_names:
+                    extra[arg] = value
+                elif arg in argmap or arg == self.req_name:
+                    return _getcallargs(self.func, positional, named)
+                else:
+                    argmap[arg] = value
+            if extra and not self.varkw:
+                return _getcallargs(self.func, positional, named)
+            if self.varkw:
+                argmap[self.varkw] = extra
+        elif self.varkw:
+            argmap[self.varkw] = {}
+
+        # Fill in defaults and check that we have everything
+        for arg, value in self.defaults:
+            if arg not in argmap:
+                argmap[arg] = value
+        for arg in self.required:
+            if arg not in argmap:
+                return _getcallargs(self.func, positional, named)
+
+        return argmap, positional[0], self.req_name
+
+    def format_uri(self, argmap):
+        """Format the URI template, percent-escaping the fields."""
+
+        formatter = None
+        parts = []
+        for text, fname, spec, conv, safe in self.template:
+            parts.append(text)
+            if fname is None:
+                continue
+
+            # Look up the value; only plain names are common
+            if fname in argmap:
+                value = argmap[fname]
+            else:
+                formatter = formatter or string.Formatter()
+                value = formatter.get_field(fname, (), argmap)[0]
+
+            # Integers need no formatting or escaping
+            if not spec and not conv and type(value) in (int, long):
+                parts.append(str(value))
+                continue
+
+            # Convert and format it
+            if conv:
+                formatter = formatter or string.Formatter()
+                value = formatter.convert_field(value, conv)
+            if '{' in spec:
+                formatter = formatter or string.Formatter()
+                spec = formatter.vformat(spec, (), argmap)
+            parts.append(_quote_field(format(value, spec), safe))
+
+        return ''.join(parts)
+
+    def _base(self, baseurl):
+        """Compute, and cache, the join of the base URL."""
+
+        joins = self._joins
+        if len(joins) >= _join_cache_max:
+            joins.clear()
+
+        if self.join == 'static':
+            base = _urljoin(baseurl, self.static_uri)
+        else:
+            # Relative URI starting with '/'; drop any trailing '/'
+            base = baseurl[:-1] if baseurl[-1:] == '/' else baseurl
+        joins[baseurl] = base
+
+        return base
+
+    def build_url(self, baseurl, argmap):
+        """Build the full URL, including any query string."""
+
+        # Build the URL
+        if self.join is None:
+            url = _urljoin(baseurl, self.format_uri(argmap))
+        else:
+            base = self._joins.get(baseurl)
+            if base is None:
+                base = self._base(baseurl)
+            url = base
+            if self.join == 'relative':
+                url += self.format_uri(argmap)
+
+        # Build the query string, as needed
+        if self.qkeys:
+            query = _encode_query([(qkey, argmap[arg])
+                                   for arg, qkey in self.qkeys])
+            if query:
+                url += '?' + query
+
+        return url
+
+    def build_headers(self, argmap):
+        """Build the headers to pass to _make_req(), if any."""
+
+        # If there are no headers, don't send any
+        hlist = [(hname, argmap[aname]) for aname, hname in self.headers
+                 if argmap[aname]]
+        return hdrs.HeaderDict(hlist) if hlist else None
+
+
 def restmethod(method, reluri, *qargs, **headers):
     """Decorate a method to inject an HTTPRequest.
 
@@ -188,46 +458,65 @@ def restmethod(method, reluri, *qargs, **headers):
     set from those values.  The request is injected as the first
     function argument after the 'self' argument.
 
+    Values substituted into reluri are percent-escaped; in the path,
+    this includes '/', unless the value begins reluri, in which case
+    it may be a complete URL.  Query parameters whose values are None are
+    omitted, and those whose values are lists or tuples are repeated
+    once for each item.
+
     Note that two attributes must exist on the object the method is
     called on: the '_baseurl' attribute specifies the URL that reluri
     is relative to; and the '_make_req' attribute specifies a method
     that instantiates an HTTPRequest from a method and full url (which
     will include query arguments).
+
+    If the request has a 'timings' attribute which is not None, the
+    time taken to build the request and to call the method are
+    recorded in it, and it is passed to the proc_timings() method of
+    the request's processor stack when the method returns.
+
+    The work that does not depend on the call arguments is done once,
+    when the decorator is applied; the resulting call plan is
+    available as the '_restmethod' attribute of the decorated method.
     """
 
     def decorator(func):
+        plan = _CallPlan(func, method, reluri, qargs, headers)
+        bind = plan.bind
+        build_url = plan.build_url
+        build_headers = plan.build_headers
+        methname = func.__name__
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            start = time.time()
+
             # Process the arguments against the original function
-            argmap, theSelf, req_name = _getcallargs(func, args, kwargs)
-
-            # Build the URL
-            url = _urljoin(theSelf._baseurl, reluri.format(**argmap))
-
-            # Build the query string, as needed
-            if qargs:
-                query = dict([(k, argmap[k]) for k in qargs
-                              if argmap[k] is not None])
-                if query:
-                    url += '?%s' % urllib.urlencode(query)
-
-            # Build the headers, if needed
-            hlist = None
-            if headers:
-                hlist = hdrs.HeaderDict()
-                for aname, hname in headers.items():
-                    if argmap[aname]:
-                        hlist[hname] = argmap[aname]
-                if not hlist:
-                    # If there are no headers, don't send any
-                    hlist = None
+            argmap, theSelf, req_name = bind(args, kwargs)
+
+            # Build the URL and headers
+            url = build_url(theSelf._baseurl, argmap)
+            hlist = build_headers(argmap) if plan.headers else None
 
             # Now, build the request and pass it to the method
-            argmap[req_name] = theSelf._make_req(method, url,
-                                                 func.__name__, hlist)
+            req = argmap[req_name] = theSelf._make_req(method, url,
+                                                       methname, hlist)
 
             # Call the method
-            return func(**argmap)
+            timings = getattr(req, 'timings', None)
+            if timings is None:
+                return func(**argmap)
+
+            # Time the call, and hand the timings to the processors
+            timings.add('build', time.time() - start)
+            try:
+                return func(**argmap)
+            finally:
+                timings.finish(time.time() - start)
+                req.procstack.proc_timings(req, timings)
+
+        # Make the call plan available
+        wrapper._restmethod = plan
 
         # Return the function wrapper
         return wrapper
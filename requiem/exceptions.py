@@ -17,7 +17,8 @@ import httplib
 import re
 
 
-__all__ = ['RESTException', 'HTTPException', 'exception_map']
+__all__ = ['RESTException', 'HTTPException', 'PoolExhausted',
+           'BodyTooLarge', 'CircuitOpen', 'RateLimited', 'exception_map']
 
 
 class RESTException(Exception):
@@ -37,6 +38,69 @@ class ShortCircuit(RESTException):
         self.response = response
 
 
+class RetryRequest(RESTException):
+    """Class for requesting a retry of a request from a processor."""
+
+    def __init__(self, delay=0):
+        """Initializes exception, attaching the delay before retrying."""
+
+        super(RetryRequest, self).__init__("Retry request.")
+
+        self.delay = delay
+
+
+class PoolExhausted(RESTException):
+    """Raised if no pooled connection is available for a request."""
+
+    def __init__(self, key):
+        """Initializes exception, attaching the pool key."""
+
+        super(PoolExhausted, self).__init__(
+            "No connections available to %s://%s:%s" % key)
+
+        self.key = key
+
+
+class BodyTooLarge(RESTException):
+    """Raised if a streamed response body exceeds the size limit."""
+
+    def __init__(self, max_size):
+        """Initializes exception, attaching the size limit."""
+
+        super(BodyTooLarge, self).__init__(
+            "Response body exceeds %d bytes" % max_size)
+
+        self.max_size = max_size
+
+
+class CircuitOpen(RESTException):
+    """Raised if a request is refused because a circuit breaker is open."""
+
+    def __init__(self, host, retry_after):
+        """Initializes exception, attaching the host and retry delay."""
+
+        super(CircuitOpen, self).__init__(
+            "Circuit open for %s; retry in %.1f seconds" %
+            (host, retry_after))
+
+        self.host = host
+        self.retry_after = retry_after
+
+
+class RateLimited(RESTException):
+    """Raised if a request is refused by a client-side rate limiter."""
+
+    def __init__(self, key, retry_after):
+        """Initializes exception, attaching the limiter key and delay."""
+
+        super(RateLimited, self).__init__(
+            "Rate limit exceeded%s; retry in %.3f seconds" %
+            (" for %s" % key if key else "", retry_after))
+
+        self.key = key
+        self.retry_after = retry_after
+
+
 class HTTPException(RESTException):
     """Superclass of exceptions raised if an error status is returned."""
 
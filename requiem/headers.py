@@ -12,28 +12,97 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
-
 __all__ = ['HeaderDict']
 
 
+# Cache of normalized header names
+_names = {}
+_names_max = 4096
+
+
+def _normalize(k):
+    """Normalize a header name to title case.
+
+    Normalized names are interned and cached.  Callers on hot paths
+    try the cache first, as "_names.get(k) or _normalize(k)", so that
+    normalizing a name which has been seen before costs a single
+    dictionary lookup.
+    """
+
+    try:
+        return _names[k]
+    except KeyError:
+        pass
+
+    name = k.title()
+    if isinstance(name, str):
+        name = intern(name)
+
+    # Don't let arbitrary header names grow the cache without bound
+    if len(_names) < _names_max:
+        _names[k] = name
+        _names[name] = name
+
+    return name
+
+
+# Prime the cache with common header names
+for _name in ('accept', 'accept-charset', 'accept-encoding',
+              'accept-language', 'accept-ranges', 'age', 'allow',
+              'authorization', 'cache-control', 'connection',
+              'content-disposition', 'content-encoding', 'content-language',
+              'content-length', 'content-location', 'content-range',
+              'content-type', 'cookie', 'date', 'etag', 'expect',
+              'expires', 'host', 'if-match', 'if-modified-since',
+              'if-none-match', 'if-range', 'if-unmodified-since',
+              'last-modified', 'link', 'location', 'pragma',
+              'proxy-authenticate', 'proxy-authorization', 'range',
+              'referer', 'retry-after', 'server', 'set-cookie', 'te',
+              'trailer', 'transfer-encoding', 'upgrade', 'user-agent',
+              'vary', 'via', 'warning', 'www-authenticate', 'x-auth-token'):
+    _normalize(_name)
+del _name
+
+
 class HeaderDict(dict):
-    """Class for representing a dictionary where keys are header names."""
+    """Class for representing a dictionary where keys are header names.
+
+    Header names are normalized to title case.  A header may be given
+    several values with add(); the dictionary value is then the values
+    joined with commas, as they will be sent, but the individual values
+    remain available through getall() and allitems().  This is meant
+    for building request headers; responses are httplib2.Response
+    objects, whose repeated headers have already been joined.
+
+    A HeaderDict may be made read-only with freeze(), allowing it to be
+    shared without copying; copy() returns a mutable copy.
+    """
+
+    # Individual values of headers with more than one value
+    _multi = None
+
+    # Set on read-only instances
+    frozen = False
 
     def __contains__(self, k):
         """Override dict.__contains__() to title-case keys."""
 
-        return super(HeaderDict, self).__contains__(k.title())
+        return dict.__contains__(self, _names.get(k) or _normalize(k))
 
     def __delitem__(self, k):
         """Override dict.__delitem__() to title-case keys."""
 
-        return super(HeaderDict, self).__delitem__(k.title())
+        k = _names.get(k) or _normalize(k)
+        if self._multi:
+            self._multi.pop(k, None)
+
+        return dict.__delitem__(self, k)
 
     def __init__(self, d=None, **kwargs):
         """Override dict.__init__() to title-case keys."""
 
         # Initialize ourself as if we were empty...
-        super(HeaderDict, self).__init__()
+        dict.__init__(self)
 
         # Use our own update method
         self.update(d, **kwargs)
@@ -41,12 +110,23 @@ class HeaderDict(dict):
     def __getitem__(self, k):
         """Override dict.__getitem__() to title-case keys."""
 
-        return super(HeaderDict, self).__getitem__(k.title())
+        return dict.__getitem__(self, _names.get(k) or _normalize(k))
 
     def __setitem__(self, k, v):
         """Override dict.__setitem__() to title-case keys."""
 
-        return super(HeaderDict, self).__setitem__(k.title(), v)
+        k = _names.get(k) or _normalize(k)
+        if self._multi:
+            self._multi.pop(k, None)
+
+        return dict.__setitem__(self, k, v)
+
+    def clear(self):
+        """Override dict.clear() to discard multiple values."""
+
+        self._multi = None
+
+        return dict.clear(self)
 
     def copy(self):
         """Override dict.copy() to return a HeaderDict instance."""
@@ -57,37 +137,171 @@ class HeaderDict(dict):
     def fromkeys(cls, seq, v=None):
         """Override dict.fromkeys() to title-case keys."""
 
-        return super(HeaderDict, cls).fromkeys(cls,
-                                               [s.title() for s in seq], v)
+        result = cls()
+        for k in seq:
+            result[k] = v
+
+        return result
 
     def get(self, k, d=None):
         """Override dict.get() to title-case keys."""
 
-        return super(HeaderDict, self).get(k.title(), d)
+        return dict.get(self, _names.get(k) or _normalize(k), d)
 
     def has_key(self, k):
         """Override dict.has_key() to title-case keys."""
 
-        return super(HeaderDict, self).has_key(k.title())
+        return dict.__contains__(self, _names.get(k) or _normalize(k))
+
+    def pop(self, k, *args):
+        """Override dict.pop() to title-case keys."""
+
+        k = _names.get(k) or _normalize(k)
+        if self._multi:
+            self._multi.pop(k, None)
+
+        return dict.pop(self, k, *args)
+
+    def popitem(self):
+        """Override dict.popitem() to keep repeated headers consistent."""
+
+        k, v = dict.popitem(self)
+        if self._multi:
+            self._multi.pop(k, None)
+
+        return k, v
 
     def setdefault(self, k, d=None):
         """Override dict.setdefault() to title-case keys."""
 
-        return super(HeaderDict, self).setdefault(k.title(), d)
+        return dict.setdefault(self, _names.get(k) or _normalize(k), d)
 
     def update(self, e=None, **f):
         """Override dict.update() to title-case keys."""
 
         # Handle e first
         if e is not None:
-            if hasattr(e, 'keys'):
-                for k in e:
-                    self[k.title()] = e[k]
+            if isinstance(e, HeaderDict):
+                # Fast path: keys are already normalized
+                if self._multi:
+                    for k in e:
+                        self._multi.pop(k, None)
+                dict.update(self, e)
+                if e._multi:
+                    multi = self._multi
+                    if multi is None:
+                        multi = self._multi = {}
+                    for k, values in e._multi.items():
+                        multi[k] = list(values)
+            elif hasattr(e, 'keys'):
+                for k in e.keys():
+                    self[k] = e[k]
             else:
                 for (k, v) in e:
-                    self[k.title()] = v
+                    self[k] = v
 
         # Now handle f
-        if len(f):
+        if f:
             for k in f:
-                self[k.title()] = f[k]
+                self[k] = f[k]
+
+    def add(self, k, v):
+        """Add a value for a header, keeping any existing values.
+
+        Values are converted to strings so that they can be joined.
+        """
+
+        k = _names.get(k) or _normalize(k)
+        v = str(v)
+        if not dict.__contains__(self, k):
+            return dict.__setitem__(self, k, v)
+
+        # Keep the individual values
+        multi = self._multi
+        if multi is None:
+            multi = self._multi = {}
+        values = multi.get(k)
+        if values is None:
+            values = multi[k] = [str(dict.__getitem__(self, k))]
+        values.append(v)
+
+        dict.__setitem__(self, k, ', '.join(values))
+
+    def getall(self, k, d=None):
+        """Return a list of all the values of a header.
+
+        If the header is not present, returns d, or an empty list if
+        d is not specified.
+        """
+
+        k = _names.get(k) or _normalize(k)
+        if self._multi and k in self._multi:
+            return list(self._multi[k])
+        if dict.__contains__(self, k):
+            return [dict.__getitem__(self, k)]
+
+        return [] if d is None else d
+
+    def allitems(self):
+        """Return a list of (name, value) pairs, one for each value."""
+
+        multi = self._multi or {}
+        result = []
+        for k, v in self.items():
+            if k in multi:
+                result.extend((k, value) for value in multi[k])
+            else:
+                result.append((k, v))
+
+        return result
+
+    def freeze(self):
+        """Make the HeaderDict read-only, in place.  Returns self."""
+
+        self.__class__ = _FrozenHeaderDict
+
+        return self
+
+
+def _read_only(name):
+    """Construct a mutator method which refuses to modify the dict."""
+
+    def method(self, *args, **kwargs):
+        raise TypeError("Headers are read-only; modify a copy instead")
+
+    method.__name__ = name
+    method.__doc__ = "Override dict.%s() to refuse modifications." % name
+
+    return method
+
+
+class _FrozenHeaderDict(HeaderDict):
+    """A read-only HeaderDict, produced by HeaderDict.freeze()."""
+
+    frozen = True
+
+    # Refuse all modifications
+    for _name in ('__delitem__', '__setitem__', 'add', 'clear', 'pop',
+                  'popitem', 'setdefault', 'update'):
+        vars()[_name] = _read_only(_name)
+    del _name
+
+    def __copy__(self):
+        """Read-only headers need not be copied."""
+
+        return self
+
+    def __deepcopy__(self, memo):
+        """Read-only headers need not be copied."""
+
+        return self
+
+    def copy(self):
+        """Return a mutable copy of the headers."""
+
+        return HeaderDict(self)
+
+    def freeze(self):
+        """Already read-only; returns self."""
+
+        return self
@@ -37,32 +37,301 @@ To use this client:
     >>> ec.echo({'foo': bar})
     {'foo': bar}
 
+Large listings need not be decoded all at once.  If a method sets
+req.stream to True before sending the request, the response's objs
+attribute is an iterator which decodes the elements of a top-level
+JSON array--or, for NDJSON responses, one object per line--as the
+data arrives:
+
+    class ListClient(jsclient.JSONClient):
+        @requiem.restmethod('GET', '/items')
+        def items(self, req):
+            req.stream = True
+            return req.send().objs
+
 See the documentation for JSONClient for more information.
 """
 
 
+import itertools
 import json
+import re
+import time
 
 from requiem import client
 from requiem import request
 
 
-__all__ = ['JSONRequest', 'JSONClient']
+__all__ = ['JSONCodec', 'JSONRequest', 'JSONClient']
+
+
+class JSONCodec(object):
+    """Encapsulate a JSON encoder and decoder.
+
+    The dumps callable must return the JSON serialization of an
+    object as a string; the loads callable must decode a string,
+    raising ValueError if it is not valid JSON.
+    """
+
+    def __init__(self, name, dumps, loads):
+        """Initialize a codec."""
+
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        """Return a representation of the codec."""
+
+        return '<%s %r>' % (self.__class__.__name__, self.name)
+
+
+def _find_codec():
+    """Select the fastest available JSON codec.
+
+    Uses ujson or simplejson, if installed, in preference to the
+    standard library json module.
+    """
+
+    for name in ('ujson', 'simplejson'):
+        try:
+            mod = __import__(name)
+        except ImportError:
+            continue
+
+        return JSONCodec(name, mod.dumps, mod.loads)
+
+    return JSONCodec('json', json.dumps, json.loads)
+
+
+# The default codec
+default_codec = _find_codec()
+
+
+# Matches JSON whitespace
+_ws_re = re.compile(r'[ \t\n\r]*')
+
+
+# Characters which may continue a JSON number; the empty string
+# indicates the end of the buffer
+_num_chars = frozenset(['', '.', 'e', 'E', '+', '-'] + list('0123456789'))
+
+
+# States for _iter_array()
+_START, _FIRST, _VALUE, _SEP, _SINGLE, _DONE = range(6)
+
+
+def _iter_array(chunks):
+    """Incrementally decode a JSON array from an iterable of strings.
+
+    Yields each element of the array as soon as it has been received;
+    only the current element is buffered.  If the document is not an
+    array, it is decoded as a whole and yielded as a single value.
+    Raises ValueError if the document is invalid.
+    """
+
+    decoder = json.JSONDecoder()
+    state = _START
+    buf = ''
+    idx = 0
+
+    for data in itertools.chain(chunks, [None]):
+        eof = data is None
+        if not eof:
+            buf = buf[idx:] + data
+            idx = 0
+
+        while state != _SINGLE:
+            idx = _ws_re.match(buf, idx).end()
+            if idx >= len(buf):
+                # Need more data
+                break
+
+            char = buf[idx]
+            if state == _START:
+                state = _FIRST if char == '[' else _SINGLE
+                idx += 1 if char == '[' else 0
+                continue
+            elif state in (_FIRST, _SEP) and char == ']':
+                return
+            elif state == _SEP:
+                if char != ',':
+                    raise ValueError("Expecting , delimiter at %r" %
+                                     buf[idx:idx + 20])
+                idx += 1
+                state = _VALUE
+                continue
+
+            # Decode the next element
+            try:
+                obj, end = decoder.raw_decode(buf, idx)
+            except ValueError:
+                if eof:
+                    raise
+                break
+
+            # A number may have been truncated, e.g., "1.5" split
+            # after "1"
+            if (not eof and isinstance(obj, (int, long, float)) and
+                    buf[end:end + 1] in _num_chars):
+                break
+
+            idx = end
+            state = _SEP
+            yield obj
+
+    # Not an array, or the array was never terminated
+    if state == _SINGLE:
+        yield json.loads(buf[idx:])
+    elif state != _START:
+        raise ValueError("Unterminated JSON array")
+
+
+def _iter_lines(chunks, loads=json.loads):
+    """Incrementally decode NDJSON from an iterable of strings.
+
+    Yields one object for each non-blank line, decoded using loads.
+    Raises ValueError if a line is not valid JSON.
+    """
+
+    pending = []
+    for data in chunks:
+        lines = data.split('\n')
+        if len(lines) == 1:
+            pending.append(data)
+            continue
+
+        # Complete the pending line
+        pending.append(lines[0])
+        lines[0] = ''.join(pending)
+        pending = [lines.pop()]
+
+        for line in lines:
+            if line.strip():
+                yield loads(line)
+
+    # Handle a final unterminated line
+    line = ''.join(pending)
+    if line.strip():
+        yield loads(line)
+
+
+class _LazyObj(object):
+    """Mixin to decode a response's 'obj' attribute on first access.
+
+    The decoder is stored in the '_obj_decode' attribute; it is
+    called with the response body, and the result is memoized.
+    """
+
+    def _get_obj(self):
+        """Retrieve the decoded body, decoding it if necessary."""
+
+        try:
+            return self.__dict__['_obj']
+        except KeyError:
+            pass
+
+        # Decode and memoize the object
+        obj = self.__dict__.pop('_obj_decode')(self.body)
+        self.__dict__['_obj'] = obj
+        return obj
+
+    def _set_obj(self, value):
+        """Set the decoded body."""
+
+        self.__dict__.pop('_obj_decode', None)
+        self.__dict__['_obj'] = value
+
+    obj = property(_get_obj, _set_obj)
+
+
+# Cache of response classes with the _LazyObj mixin
+_lazy_classes = {}
+
+
+def _lazy_obj(resp, decode):
+    """Arrange for resp.obj to be computed by decode on first access.
+
+    The class of resp is replaced with a subclass including the
+    _LazyObj mixin.  If that is not possible, the body is decoded
+    immediately.
+    """
+
+    cls = resp.__class__
+    if not issubclass(cls, _LazyObj):
+        lazy_cls = _lazy_classes.get(cls)
+        if lazy_cls is None:
+            lazy_cls = type(cls.__name__, (cls, _LazyObj),
+                            {'__module__': cls.__module__})
+            _lazy_classes[cls] = lazy_cls
+
+        try:
+            resp.__class__ = lazy_cls
+        except TypeError:
+            resp.obj = decode(resp.body)
+            return
+
+    resp.__dict__.pop('_obj', None)
+    resp._obj_decode = decode
 
 
 class JSONRequest(request.HTTPRequest):
-    """Variant of HTTPRequest to process JSON data in responses."""
+    """Variant of HTTPRequest to process JSON data in responses.
 
-    def proc_response(self, resp):
-        """Process JSON data found in the response."""
+    If the response is streamed, the 'objs' attribute of the response
+    is set to an iterator which incrementally decodes the body.
+    Responses with a content type in the 'ndjson_types' class
+    attribute are decoded as one JSON object per line; otherwise, the
+    iterator yields the elements of a top-level JSON array.
 
-        # Try to interpret any JSON
+    JSON is decoded using the JSONCodec in the 'codec' attribute.
+    """
+
+    codec = default_codec
+    ndjson_types = frozenset(['application/x-ndjson', 'application/ndjson',
+                              'application/jsonl',
+                              'application/x-json-stream'])
+
+    def _decode(self, body):
+        """Decode a response body, returning None if it is not JSON."""
+
+        start = time.time() if self.timings is not None else None
         try:
-            resp.obj = json.loads(resp.body)
-            self._debug("  Received entity: %r", resp.obj)
+            obj = self.codec.loads(body)
+            self._debug("  Received entity: %r", obj)
         except ValueError:
+            obj = None
+            self._debug("  No received entity; body %r", body)
+
+        if start is not None:
+            self.timings.add('decode', time.time() - start)
+
+        return obj
+
+    def proc_response(self, resp):
+        """Process JSON data found in the response.
+
+        The body is decoded lazily, when the 'obj' attribute of the
+        response is first accessed; it is None if the body is not
+        valid JSON.
+        """
+
+        # Try to interpret any JSON
+        if hasattr(resp.body, 'read'):
+            # Streamed response; decode as the caller iterates
+            ctype = resp.get('content-type', '').split(';')[0].strip()
+            if ctype.lower() in self.ndjson_types:
+                resp.objs = _iter_lines(resp.body, self.codec.loads)
+            else:
+                resp.objs = _iter_array(resp.body)
             resp.obj = None
-            self._debug("  No received entity; body %r", resp.body)
+        else:
+            # Decode only when obj is accessed
+            _lazy_obj(resp, self._decode)
+
+            # Force decoding so that the entity can be logged
+            if self._debugging:
+                resp.obj
 
         # Now, call superclass method for error handling
         super(JSONRequest, self).proc_response(resp)
@@ -75,25 +344,46 @@ class JSONClient(client.RESTClient):
     for attaching JSON objects to requests.  Also uses JSONRequest in
     preference to HTTPRequest, so that JSON data in responses is
     processed.
+
+    JSON is encoded and decoded using the JSONCodec in the '_codec'
+    class attribute, which may be overridden by passing the 'codec'
+    keyword argument to the constructor.  By default, ujson or
+    simplejson is used, if available; otherwise, the standard library
+    json module is used.
     """
 
     _req_class = JSONRequest
     _content_type = 'application/json'
+    _codec = default_codec
 
-    def __init__(self, baseurl, headers=None, debug=False, client=None):
+    def __init__(self, baseurl, headers=None, debug=False, client=None,
+                 codec=None):
         """Override RESTClient.__init__() to set an Accept header."""
 
         # Initialize superclass
         super(JSONClient, self).__init__(baseurl, headers, debug, client)
 
+        # Select the codec
+        if codec is not None:
+            self._codec = codec
+
         # Set the accept header
         self._headers.setdefault('accept', self._content_type)
 
+    def _make_req(self, method, url, methname, headers=None):
+        """Override RESTClient._make_req() to set the codec."""
+
+        req = super(JSONClient, self)._make_req(method, url, methname,
+                                                headers)
+        req.codec = self._codec
+
+        return req
+
     def _attach_obj(self, req, obj):
         """Helper method to attach obj to req as JSON data."""
 
-        # Attach the object to the request
-        json.dump(obj, req)
+        # Attach the object to the request, encoding it in one shot
+        req.write(self._codec.dumps(obj))
 
         # Also set the content-type header
         req['content-type'] = self._content_type
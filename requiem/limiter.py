@@ -0,0 +1,361 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import time
+import urlparse
+
+from requiem import exceptions as exc
+from requiem import processor
+from requiem import retry
+
+
+__all__ = ['TokenBucket', 'AdaptiveLimit', 'RateLimiter']
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket.
+
+    Tokens accumulate at rate per second, up to burst.  Each request
+    takes one token; if none are available, the request either waits
+    for its token or is rejected.  Waiting requests reserve their
+    tokens in advance, so they are served in order.
+    """
+
+    def __init__(self, rate, burst=None):
+        """Initialize a token bucket."""
+
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """Reserve a token.
+
+        Returns the time to wait before the token may be used, or None
+        if the token would not be available within max_wait seconds,
+        in which case no token is taken.
+        """
+
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            wait = max(0.0, (1.0 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+
+            self._tokens -= 1.0
+            return wait
+
+    @property
+    def tokens(self):
+        """The number of tokens currently available."""
+
+        with self._lock:
+            elapsed = time.time() - self._last
+            return min(self.burst, self._tokens + elapsed * self.rate)
+
+
+class AdaptiveLimit(object):
+    """An adaptive limit on the number of concurrent requests.
+
+    The limit follows an additive-increase, multiplicative-decrease
+    scheme: each successful request increases the limit by increase
+    divided by the current limit, so that the limit grows by roughly
+    increase for each round of requests; each throttled request
+    multiplies the limit by decrease.  Requests whose latency exceeds
+    latency_tolerance times the baseline latency--a slowly-decaying
+    minimum of the observed latencies--count as throttled.  Only
+    requests started after the last decrease can cause another one,
+    so a burst of failures shrinks the limit once.  The limit stays
+    between min_limit and max_limit.
+    """
+
+    def __init__(self, initial=10, min_limit=1, max_limit=100, increase=1.0,
+                 decrease=0.5, latency_tolerance=2.0):
+        """Initialize an adaptive limit."""
+
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+
+        self.inflight = 0
+        self.baseline = None
+
+        self._decreased = 0.0
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self, block=True, timeout=None):
+        """Acquire a slot.
+
+        Returns True if a slot was acquired.  If block is False, or
+        the timeout expires, returns False.
+        """
+
+        with self._cond:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                return True
+            if not block:
+                return False
+
+            deadline = None if timeout is None else time.time() + timeout
+            while self.inflight >= int(self.limit):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+
+            self.inflight += 1
+            return True
+
+    def release(self, start, latency=None, throttled=False):
+        """Release a slot acquired at time start.
+
+        The latency of the request and whether it was throttled adjust
+        the limit; pass a latency of None to release the slot without
+        adjusting it.
+        """
+
+        with self._cond:
+            self.inflight -= 1
+
+            if latency is not None:
+                self._adjust(start, latency, throttled)
+
+            self._cond.notify_all()
+
+    def _adjust(self, start, latency, throttled):
+        """Adjust the limit; must be called with the lock held."""
+
+        baseline = self.baseline
+        if baseline is None or latency < baseline:
+            self.baseline = latency
+        else:
+            # Forget old minima slowly, to follow real shifts
+            self.baseline = baseline + (latency - baseline) * 0.01
+
+            if latency > baseline * self.latency_tolerance:
+                throttled = True
+
+        if throttled:
+            if start >= self._decreased:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._decreased = time.time()
+        else:
+            self.limit = min(self.max_limit,
+                             self.limit + self.increase / self.limit)
+
+
+class _Limits(object):
+    """The limits applying to one key."""
+
+    def __init__(self, bucket, limit):
+        """Initialize the limits."""
+
+        self.bucket = bucket
+        self.limit = limit
+        self.hold_until = 0.0
+
+
+class RateLimiter(processor.Processor):
+    """Limit the rate and concurrency of requests.
+
+    If rate is given, requests are limited to rate per second, with
+    bursts of up to burst requests, using a TokenBucket.  If
+    concurrency is given, it is a callable returning an AdaptiveLimit
+    (or True, to use the default AdaptiveLimit), limiting the number
+    of requests in flight; the limit shrinks when responses have a
+    status in statuses or take too long, and grows otherwise.  If
+    per_host is True, each host has its own limits; otherwise, the
+    limits apply to all requests through the processor.
+
+    A Retry-After header on a response with a status in statuses
+    holds off all further requests with the same key for the given
+    delay.
+
+    If block is True, requests wait for the limits, for up to timeout
+    seconds if timeout is given; if block is False, or the timeout
+    expires, RateLimited is raised at once.  The 'throttled',
+    'rejected', and 'delayed' attributes count responses with a
+    status in statuses, requests refused locally, and requests which
+    had to wait.
+    """
+
+    def __init__(self, rate=None, burst=None, concurrency=None,
+                 per_host=False, block=True, timeout=None,
+                 statuses=(429, 503)):
+        """Initialize a rate limiter."""
+
+        if concurrency is True:
+            concurrency = AdaptiveLimit
+
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.block = block
+        self.timeout = timeout
+        self.statuses = frozenset(statuses)
+
+        self.throttled = 0
+        self.rejected = 0
+        self.delayed = 0
+
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _get_limits(self, key):
+        """Look up or create the limits for key."""
+
+        limits = self._limits.get(key)
+        if limits is None:
+            with self._lock:
+                limits = self._limits.get(key)
+                if limits is None:
+                    bucket = None
+                    if self.rate is not None:
+                        bucket = TokenBucket(self.rate, self.burst)
+                    limit = None
+                    if self.concurrency is not None:
+                        limit = self.concurrency()
+                    limits = self._limits[key] = _Limits(bucket, limit)
+
+        return limits
+
+    def _reject(self, key, retry_after):
+        """Count and raise a local rejection."""
+
+        with self._lock:
+            self.rejected += 1
+        raise exc.RateLimited(key, retry_after)
+
+    def _finish(self, req, latency=None, throttled=False):
+        """Release the concurrency slot held by req, if any."""
+
+        admitted = getattr(req, '_limit', None)
+        if admitted is None:
+            return
+        req._limit = None
+
+        limits, start = admitted
+        if limits.limit is not None:
+            limits.limit.release(start, latency, throttled)
+
+    def proc_request(self, req):
+        """Wait for the limits, or raise RateLimited."""
+
+        # Release any slot an earlier attempt failed to release
+        self._finish(req)
+
+        key = None
+        if self.per_host:
+            key = urlparse.urlsplit(req.url).netloc.lower()
+        limits = self._get_limits(key)
+        max_wait = None if self.block else 0.0
+        if self.block and self.timeout is not None:
+            max_wait = self.timeout
+
+        # Honor any hold-off requested by the server
+        wait = limits.hold_until - time.time()
+        if wait > 0:
+            if max_wait is not None and wait > max_wait:
+                self._reject(key, wait)
+        else:
+            wait = 0.0
+
+        # Take a token from the bucket
+        if limits.bucket is not None:
+            bucket_wait = limits.bucket.reserve(
+                None if max_wait is None else max_wait - wait)
+            if bucket_wait is None:
+                self._reject(key, 1.0 / limits.bucket.rate)
+            wait = max(wait, bucket_wait)
+
+        if wait > 0:
+            with self._lock:
+                self.delayed += 1
+            time.sleep(wait)
+
+        # Acquire a concurrency slot
+        if limits.limit is not None:
+            timeout = None if max_wait is None else max(0.0, max_wait - wait)
+            if not limits.limit.acquire(self.block, timeout):
+                self._reject(key, 0.0)
+
+        req._limit = (limits, time.time())
+
+    def proc_response(self, resp):
+        """Adjust the limits based on the response."""
+
+        req = getattr(resp, 'request', None)
+        admitted = getattr(req, '_limit', None)
+        if admitted is None:
+            return
+
+        # Cached responses say nothing about the server
+        if getattr(resp, 'fromcache', False):
+            self._finish(req)
+            return
+
+        limits, start = admitted
+        throttled = resp.status in self.statuses
+        if throttled:
+            with self._lock:
+                self.throttled += 1
+
+            delay = retry._retry_after(resp)
+            if delay:
+                limits.hold_until = max(limits.hold_until,
+                                        time.time() + delay)
+
+        self._finish(req, time.time() - start, throttled)
+
+    def proc_exception(self, exc_type, exc_value, traceback):
+        """Release the slot held by a request which failed."""
+
+        req = getattr(exc_value, 'request', None)
+        if req is not None and not hasattr(exc_value, 'response'):
+            self._finish(req)
+
+        return None
+
+    def stats(self):
+        """Return a dictionary of statistics for each key."""
+
+        with self._lock:
+            items = self._limits.items()
+
+        result = {}
+        for key, limits in items:
+            stats = {}
+            if limits.bucket is not None:
+                stats['tokens'] = limits.bucket.tokens
+            if limits.limit is not None:
+                stats['limit'] = limits.limit.limit
+                stats['inflight'] = limits.limit.inflight
+            result[key] = stats
+
+        return result
@@ -0,0 +1,319 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import bisect
+import Queue
+import random
+import threading
+import time
+
+from requiem import exceptions as exc
+from requiem import metrics
+
+
+__all__ = ['LoadGenerator', 'LoadReport']
+
+
+def _outcome(exc_value):
+    """Classify the outcome of a call.
+
+    Successful calls are 'ok'; HTTP errors are classified by status
+    class, e.g. '5xx'; other exceptions by the name of their class.
+    """
+
+    if exc_value is None:
+        return 'ok'
+    elif isinstance(exc_value, exc.HTTPException):
+        return '%dxx' % (exc_value.status // 100)
+
+    return exc_value.__class__.__name__
+
+
+class _Interval(object):
+    """The results for one interval of a load run."""
+
+    def __init__(self, start):
+        """Initialize the interval, starting start seconds into the run."""
+
+        self.start = start
+        self.sent = 0
+        self.completed = 0
+        self.outcomes = {}
+        self.latency = metrics.Histogram()
+
+    def add(self, outcome, latency):
+        """Record the completion of a call."""
+
+        self.completed += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.latency.record(latency)
+
+    def merge(self, other):
+        """Add the results of another interval."""
+
+        self.sent += other.sent
+        self.completed += other.completed
+        for outcome, count in other.outcomes.items():
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + count
+        self.latency.merge(other.latency)
+
+    def summary(self, duration, quantiles):
+        """Summarize the interval, which lasted duration seconds."""
+
+        errors = self.completed - self.outcomes.get('ok', 0)
+        result = {
+            'start': self.start,
+            'sent': self.sent,
+            'completed': self.completed,
+            'throughput': self.completed / duration if duration else None,
+            'error_rate': (float(errors) / self.completed
+                           if self.completed else None),
+            'outcomes': dict(self.outcomes),
+        }
+        result.update(self.latency.snapshot(quantiles))
+        del result['count']
+
+        return result
+
+
+class LoadReport(object):
+    """The results of a LoadGenerator run.
+
+    The run is divided into intervals.  For each, 'sent' counts the
+    calls scheduled to start in the interval, and the remaining
+    figures cover the calls which completed in it: the throughput,
+    the count of each outcome--'ok', an HTTP status class such as
+    '5xx', or the name of the exception raised--and the latency
+    percentiles.  Latencies are measured from the time each call was
+    scheduled to start, so they include any time spent waiting for a
+    worker.
+    """
+
+    def __init__(self, rate, interval, quantiles):
+        """Initialize an empty report."""
+
+        self.rate = rate
+        self.interval = interval
+        self.quantiles = quantiles
+        self.elapsed = None
+        self.max_backlog = 0
+        self.max_lag = 0.0
+
+        self.intervals = []
+
+    def _get(self, offset):
+        """Return the interval covering offset seconds into the run."""
+
+        idx = int(offset / self.interval)
+        while len(self.intervals) <= idx:
+            self.intervals.append(
+                _Interval(len(self.intervals) * self.interval))
+
+        return self.intervals[idx]
+
+    def total(self):
+        """Return an _Interval covering the whole run."""
+
+        total = _Interval(0.0)
+        for interval in self.intervals:
+            total.merge(interval)
+
+        return total
+
+    def summary(self):
+        """Summarize the run as a dictionary.
+
+        The 'intervals' key lists the summary of each interval; the
+        summary of the whole run is merged into the dictionary.
+        """
+
+        result = self.total().summary(self.elapsed, self.quantiles)
+        result.update(
+            rate=self.rate,
+            elapsed=self.elapsed,
+            max_backlog=self.max_backlog,
+            max_lag=self.max_lag,
+            intervals=[interval.summary(self.interval, self.quantiles)
+                       for interval in self.intervals],
+        )
+
+        return result
+
+    def format(self):
+        """Format the report as a table."""
+
+        def ms(value):
+            return '%9.2f' % (value * 1000.0) if value is not None else (
+                '%9s' % '-')
+
+        pcts = ['p%g' % (q * 100) for q in self.quantiles]
+        lines = ['%7s %6s %6s %9s %7s %s  %s' % (
+            'time', 'sent', 'done', 'req/s', 'errors',
+            ' '.join('%9s' % ('%s ms' % p) for p in pcts), 'outcomes')]
+
+        summary = self.summary()
+        for row in summary['intervals'] + [dict(summary, start=None)]:
+            lines.append('%7s %6d %6d %9.1f %6.1f%% %s  %s' % (
+                '%.1f' % row['start'] if row['start'] is not None else
+                'total',
+                row['sent'], row['completed'], row['throughput'] or 0.0,
+                (row['error_rate'] or 0.0) * 100.0,
+                ' '.join(ms(row[p]) for p in pcts),
+                ' '.join('%s=%d' % item
+                         for item in sorted(row['outcomes'].items()))))
+
+        lines.append('max backlog %d calls, max scheduling lag %.2f ms' %
+                     (self.max_backlog, self.max_lag * 1000.0))
+
+        return '\n'.join(lines)
+
+    __str__ = format
+
+
+class LoadGenerator(object):
+    """Drive the methods of a REST client at a target rate.
+
+    The calls are made through the client exactly as an application
+    would make them, including its processors and exception mapping.
+    The mix is a sequence of (weight, methname, args) tuples; each
+    call invokes the @restmethod() named methname, chosen with
+    probability proportional to weight.  The args element gives the
+    arguments: None for none, a tuple of positional arguments, a
+    dictionary of keyword arguments, or a callable which is passed a
+    random.Random instance and returns a tuple or dictionary.
+
+    Load is open-loop: calls are scheduled at rate calls per second,
+    with exponentially distributed gaps if poisson is True, and
+    evenly spaced otherwise, regardless of how long earlier calls
+    take.  They are run on a pool of workers threads, so the client
+    must be safe to share between threads; the default
+    ConnectionPool client is.  Latency is measured from the time each
+    call was scheduled, so that calls delayed by a slow server or a
+    busy pool are counted in full, rather than being omitted as they
+    would be by a closed-loop driver.
+    """
+
+    def __init__(self, client, mix, rate, workers=64, poisson=True,
+                 interval=1.0, quantiles=(0.5, 0.9, 0.99), seed=None):
+        """Initialize a load generator."""
+
+        self.client = client
+        self.rate = float(rate)
+        self.workers = workers
+        self.poisson = poisson
+        self.interval = interval
+        self.quantiles = quantiles
+
+        self._random = random.Random(seed)
+        self._mix = []
+        self._weights = []
+        total = 0.0
+        for weight, methname, args in mix:
+            total += weight
+            self._mix.append((getattr(client, methname), args))
+            self._weights.append(total)
+
+        self._queue = None
+        self._lock = threading.Lock()
+        self._report = None
+        self._start = None
+
+    def _choose(self):
+        """Choose the next call, returning the method and arguments."""
+
+        rand = self._random
+        idx = bisect.bisect_right(self._weights,
+                                  rand.random() * self._weights[-1])
+        meth, args = self._mix[min(idx, len(self._mix) - 1)]
+
+        if callable(args):
+            args = args(rand)
+        if args is None:
+            return meth, (), {}
+        elif isinstance(args, dict):
+            return meth, (), args
+
+        return meth, tuple(args), {}
+
+    def _worker(self):
+        """Worker thread main loop."""
+
+        while True:
+            work = self._queue.get()
+            if work is None:
+                return
+
+            scheduled, meth, args, kwargs = work
+            try:
+                meth(*args, **kwargs)
+            except Exception, exc_value:
+                outcome = _outcome(exc_value)
+            else:
+                outcome = 'ok'
+            now = time.time()
+
+            with self._lock:
+                self._report._get(now - self._start).add(outcome,
+                                                         now - scheduled)
+
+    def run(self, duration):
+        """Generate load for duration seconds, returning a LoadReport.
+
+        Returns once all the calls scheduled have completed.
+        """
+
+        self._report = report = LoadReport(self.rate, self.interval,
+                                           self.quantiles)
+        self._queue = Queue.Queue()
+        threads = [threading.Thread(target=self._worker)
+                   for _i in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        self._start = start = time.time()
+        offset = 0.0
+        try:
+            while True:
+                if self.poisson:
+                    offset += self._random.expovariate(self.rate)
+                else:
+                    offset += 1.0 / self.rate
+                if offset >= duration:
+                    break
+
+                meth, args, kwargs = self._choose()
+
+                # Wait until the call is due; if we're late, the
+                # call still counts from when it was due
+                delay = start + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    report.max_lag = max(report.max_lag, -delay)
+
+                with self._lock:
+                    report._get(offset).sent += 1
+                self._queue.put((start + offset, meth, args, kwargs))
+                report.max_backlog = max(report.max_backlog,
+                                         self._queue.qsize())
+        finally:
+            for _thread in threads:
+                self._queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        report.elapsed = time.time() - start
+
+        return report
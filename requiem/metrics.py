@@ -0,0 +1,322 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import math
+import threading
+import urlparse
+
+from requiem import processor
+
+
+__all__ = ['Histogram', 'RequestTimings', 'MetricsProcessor']
+
+
+# Histogram bucket parameters: bucket i holds values from
+# _hist_min * _hist_growth**i up to the next bucket, so that the
+# relative error of a percentile is at most half the growth
+_hist_min = 1e-6
+_hist_growth = 1.04
+_hist_scale = 1.0 / math.log(_hist_growth)
+
+
+class Histogram(object):
+    """A histogram of durations, in seconds.
+
+    Values are counted in logarithmically-sized buckets, so recording
+    a value is cheap and percentiles are accurate to within about 2%.
+    Histograms may be merged, e.g. to combine those kept by several
+    processes.  Histograms are not thread-safe.
+    """
+
+    def __init__(self):
+        """Initialize an empty histogram."""
+
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """Record a value."""
+
+        if value > _hist_min:
+            idx = int(math.log(value / _hist_min) * _hist_scale)
+        else:
+            idx = 0
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values recorded by another histogram."""
+
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, q):
+        """Estimate the q'th quantile (0 <= q <= 1) of the values.
+
+        Returns None if no values have been recorded.
+        """
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                break
+
+        # Use the geometric middle of the bucket, within the range seen
+        value = _hist_min * _hist_growth ** (idx + 0.5)
+        return min(max(value, self.min), self.max)
+
+    def snapshot(self, quantiles=(0.5, 0.9, 0.99)):
+        """Return a dictionary summarizing the histogram."""
+
+        result = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+        }
+        for q in quantiles:
+            result['p%g' % (q * 100)] = self.percentile(q)
+
+        return result
+
+
+class RequestTimings(object):
+    """Timings and sizes recorded for a single request.
+
+    The 'phases' dictionary maps phase names to the time, in seconds,
+    spent in each: 'build' (binding arguments and building the
+    request), 'pre' (processors' proc_request() methods), 'connect'
+    (obtaining and connecting a connection), 'ttfb' (sending the
+    request and waiting for the response headers), 'transfer'
+    (reading the response body), 'post' (response and exception
+    processing), 'decode' (decoding the body, e.g. by JSONRequest),
+    and 'total' (the whole call of the @restmethod() decorated
+    method).  Clients other than ConnectionPool cannot distinguish
+    connecting and transferring, so all the time spent in them is
+    counted as 'ttfb'.  Retried requests accumulate time in each
+    phase.  The body of a streamed response is read after the
+    response is returned, and is not included in 'transfer'.
+
+    The 'status' attribute is the status of the response, and
+    'error' the name of the exception raised if there was no
+    response.  'bytes_out' and 'bytes_in' are the sizes of the request
+    and response bodies, if known.
+    """
+
+    __slots__ = ('methname', 'method', 'url', 'status', 'error',
+                 'bytes_out', 'bytes_in', 'phases', 'stream')
+
+    def __init__(self, methname, method, url):
+        """Initialize the timings for a request."""
+
+        self.methname = methname
+        self.method = method
+        self.url = url
+        self.status = None
+        self.error = None
+        self.bytes_out = None
+        self.bytes_in = None
+        self.phases = {}
+        self.stream = None
+
+    def __repr__(self):
+        """Return a representation of the timings."""
+
+        return '<%s %s %s %s %r>' % (self.__class__.__name__, self.method,
+                                     self.url, self.status or self.error,
+                                     self.phases)
+
+    def add(self, phase, seconds):
+        """Add time spent in a phase."""
+
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def finish(self, total):
+        """Record the total time, and the size of a streamed body."""
+
+        self.phases['total'] = total
+        if self.stream is not None:
+            self.bytes_in = self.stream.bytes_read
+            self.stream = None
+
+    @property
+    def host(self):
+        """The host the request was sent to."""
+
+        return urlparse.urlsplit(self.url).netloc.lower()
+
+    def labels(self):
+        """Return the (methname, method, host, status) labels.
+
+        The status is the name of the exception raised if there was
+        no response.
+        """
+
+        return (self.methname, self.method, self.host,
+                self.status if self.status is not None else self.error)
+
+
+class _Series(object):
+    """The metrics kept for one set of labels."""
+
+    def __init__(self):
+        """Initialize the series."""
+
+        self.count = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.phases = {}
+
+    def record(self, timings):
+        """Record the timings of a request."""
+
+        self.count += 1
+        self.bytes_out += timings.bytes_out or 0
+        self.bytes_in += timings.bytes_in or 0
+        for phase, seconds in timings.phases.items():
+            hist = self.phases.get(phase)
+            if hist is None:
+                hist = self.phases[phase] = Histogram()
+            hist.record(seconds)
+
+    def merge(self, other):
+        """Add the metrics from another series."""
+
+        self.count += other.count
+        self.bytes_out += other.bytes_out
+        self.bytes_in += other.bytes_in
+        for phase, other_hist in other.phases.items():
+            hist = self.phases.get(phase)
+            if hist is None:
+                hist = self.phases[phase] = Histogram()
+            hist.merge(other_hist)
+
+
+class MetricsProcessor(processor.Processor):
+    """Collect request timings into latency histograms.
+
+    Adding a MetricsProcessor to a client's processor stack turns on
+    timing of its requests; see RequestTimings for the phases timed.
+    Requests are grouped by their @restmethod() method name, HTTP
+    method, host, and status, and a Histogram is kept for each phase
+    of each group, along with the request count and bytes sent and
+    received.
+
+    snapshot() returns the metrics as a dictionary keyed by the
+    (methname, method, host, status) labels, and export() as a list
+    of JSON-compatible dictionaries.  MetricsProcessor objects may be
+    merged with merge().
+    """
+
+    def __init__(self, quantiles=(0.5, 0.9, 0.99)):
+        """Initialize a metrics processor."""
+
+        self.quantiles = quantiles
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def proc_timings(self, req, timings):
+        """Record the timings of a request."""
+
+        key = timings.labels()
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.record(timings)
+
+    def merge(self, other):
+        """Add the metrics collected by another MetricsProcessor."""
+
+        with other._lock:
+            items = [(key, series) for key, series in other._series.items()]
+            copies = []
+            for key, series in items:
+                copy = _Series()
+                copy.merge(series)
+                copies.append((key, copy))
+
+        with self._lock:
+            for key, copy in copies:
+                series = self._series.get(key)
+                if series is None:
+                    self._series[key] = copy
+                else:
+                    series.merge(copy)
+
+    def reset(self):
+        """Discard all collected metrics."""
+
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self, reset=False):
+        """Return a dictionary of the collected metrics.
+
+        Keys are (methname, method, host, status) tuples; values are
+        dictionaries with 'count', 'bytes_out', and 'bytes_in' keys
+        and a 'phases' key mapping phase names to Histogram
+        summaries.  If reset is True, the metrics are discarded.
+        """
+
+        with self._lock:
+            series = self._series
+            if reset:
+                self._series = {}
+
+            return dict((key, {
+                'count': s.count,
+                'bytes_out': s.bytes_out,
+                'bytes_in': s.bytes_in,
+                'phases': dict((phase, hist.snapshot(self.quantiles))
+                               for phase, hist in s.phases.items()),
+            }) for key, s in series.items())
+
+    def export(self, reset=False):
+        """Return the collected metrics as a list of dictionaries.
+
+        Each dictionary is a snapshot() value with the labels added
+        under the 'methname', 'method', 'host', and 'status' keys.
+        """
+
+        result = []
+        for key, value in sorted(self.snapshot(reset).items()):
+            value.update(zip(('methname', 'method', 'host', 'status'), key))
+            result.append(value)
+
+        return result
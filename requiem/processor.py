@@ -13,12 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import re
 import sys
 
 from requiem import exceptions as exc
 
 
-__all__ = ['Processor']
+__all__ = ['Processor', 'ScopedProcessor']
 
 
 class Processor(object):
@@ -26,6 +27,12 @@ class Processor(object):
     Class for pre-processing requests and post-processing responses
     and exceptions.  It is not necessary for processors to inherit
     from this class.
+
+    Processors may additionally implement a proc_timings(req, timings)
+    method, which is called with a RequestTimings object once the
+    @restmethod() decorated method using the request returns.  The
+    requests of a client are only timed if some processor implements
+    this method, so it is deliberately not defined here.
     """
 
     def proc_request(self, req):
@@ -54,28 +61,260 @@ class Processor(object):
         pass
 
 
-def _safe_call(obj, methname, *args, **kwargs):
+class ScopedProcessor(object):
+    """
+    Wraps a processor so that it only applies to some requests.  The
+    processor applies to a request if the request matches all of the
+    given selectors: methnames is a list of the names of the
+    @restmethod() decorated methods; methods is a list of HTTP
+    methods; and urls is a list of regular expressions (strings or
+    compiled patterns), at least one of which must match the request
+    URL.  A selector of None matches everything.
+    """
+
+    def __init__(self, processor, methnames=None, methods=None, urls=None):
+        """Initialize a scoped processor."""
+
+        self.processor = processor
+        self.methnames = None if methnames is None else frozenset(methnames)
+        self.methods = (None if methods is None else
+                        frozenset(m.upper() for m in methods))
+        self.urls = (None if urls is None else
+                     tuple(re.compile(u) if isinstance(u, basestring) else u
+                           for u in urls))
+
+    def __getattr__(self, name):
+        """Delegate attribute access to the wrapped processor."""
+
+        return getattr(self.processor, name)
+
+    def __eq__(self, other):
+        """Compare equal to the wrapped processor, for list.remove()."""
+
+        return other is self or other is self.processor
+
+    def __ne__(self, other):
+        """Inverse of __eq__()."""
+
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        """Hash like the wrapped processor."""
+
+        return hash(self.processor)
+
+    def static_match(self, methname, method):
+        """
+        Determine whether the processor applies to requests made by the
+        method named methname using the given HTTP method.
+        """
+
+        return ((self.methnames is None or methname in self.methnames) and
+                (self.methods is None or method.upper() in self.methods))
+
+    def url_match(self, url):
+        """Determine whether the processor applies to the given URL."""
+
+        if self.urls is None:
+            return True
+
+        for pattern in self.urls:
+            if pattern.search(url):
+                return True
+
+        return False
+
+
+def _hook(obj, methname):
     """
-    Safely calls the method with the given methname on the given
-    object.  Remaining positional and keyword arguments are passed to
-    the method.  The return value is None, if the method is not
-    available, or the return value of the method.
+    Looks up the method with the given methname on the given object.
+    Returns None if the method is not available.
     """
 
     meth = getattr(obj, methname, None)
     if meth is None or not callable(meth):
-        return
+        return None
+
+    return meth
+
+
+def _invalidating(name):
+    """
+    Wraps the list method with the given name so that it invalidates
+    the compiled hooks of a ProcessorStack.
+    """
+
+    meth = getattr(list, name)
 
-    return meth(*args, **kwargs)
+    def wrapper(self, *args, **kwargs):
+        self._invalidate()
+        return meth(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = meth.__doc__
+    return wrapper
 
 
 class ProcessorStack(list):
     """
-    A list subclass for processor stacks, defining three
-    domain-specific methods: proc_request(), proc_response(), and
-    proc_exception().
+    A list subclass for processor stacks, defining four
+    domain-specific methods: proc_request(), proc_response(),
+    proc_exception(), and proc_timings().
+
+    The bound hook methods of the processors are looked up once and
+    cached; the cache is rebuilt whenever the stack is modified.  Thus,
+    processors which do not implement a given hook cost nothing when
+    that hook is invoked.  If a processor's hook methods change after
+    it has been added to the stack, call _invalidate().
+
+    The stack may contain ScopedProcessor objects; the select() method
+    returns the stack of processors applying to a particular request.
     """
 
+    def __init__(self, *args):
+        """Initialize the stack."""
+
+        super(ProcessorStack, self).__init__(*args)
+        self._invalidate()
+
+    # Invalidate the compiled hooks whenever the stack changes
+    for _name in ('__setitem__', '__delitem__', '__setslice__',
+                  '__delslice__', '__iadd__', 'append', 'extend', 'insert',
+                  'pop', 'remove', 'reverse', 'sort'):
+        vars()[_name] = _invalidating(_name)
+    del _name
+
+    def _invalidate(self):
+        """Discard the compiled hooks and selected stacks."""
+
+        self._hooks = None
+        self._selected = {}
+        self._substacks = {}
+
+    def select(self, methname, method, url):
+        """
+        Select the processors applying to a request made by the method
+        named methname, using the given HTTP method and URL.  Returns
+        a ProcessorStack, which is this stack if it contains no
+        ScopedProcessor objects.
+
+        The selection by method name and HTTP method is computed once
+        and memoized.  Only if some of the selected processors are
+        scoped by URL is any matching done for each request.
+        """
+
+        key = (methname, method)
+        plan = self._selected.get(key)
+        if plan is None:
+            plan = self._selected[key] = self._plan(methname, method)
+
+        # Common case: no URL matching needed
+        if isinstance(plan, ProcessorStack):
+            return plan
+
+        procs = [proc for proc, scope in plan
+                 if scope is None or scope.url_match(url)]
+        return self._substack(procs)
+
+    def _plan(self, methname, method):
+        """
+        Compute the selection plan for select().  This is either a
+        ProcessorStack, or, if some processors are scoped by URL, a
+        list of (processor, scope) pairs, where the scope is None for
+        processors which need no URL matching.
+        """
+
+        # Fast path: no scoped processors
+        if not any(isinstance(proc, ScopedProcessor) for proc in self):
+            return self
+
+        plan = []
+        url_scoped = False
+        for proc in self:
+            if not isinstance(proc, ScopedProcessor):
+                plan.append((proc, None))
+            elif proc.static_match(methname, method):
+                if proc.urls is None:
+                    plan.append((proc.processor, None))
+                else:
+                    plan.append((proc.processor, proc))
+                    url_scoped = True
+
+        if url_scoped:
+            return plan
+
+        return self._substack([proc for proc, _scope in plan])
+
+    def _substack(self, procs):
+        """Get the memoized ProcessorStack for the list of processors."""
+
+        key = tuple(id(proc) for proc in procs)
+        stack = self._substacks.get(key)
+        if stack is None:
+            stack = self._substacks[key] = ProcessorStack(procs)
+
+        return stack
+
+    def _compile(self):
+        """
+        Compile the hooks.  Returns a tuple of four lists: the
+        (index, proc_request) pairs, in stack order; the (index,
+        proc_response) pairs, in reverse order; the (index,
+        proc_response, proc_exception) triples, in reverse order; and
+        the proc_timings methods, in stack order.  Processors lacking
+        a hook are omitted from the corresponding list.
+        """
+
+        hooks = self._hooks
+        if hooks is not None:
+            return hooks
+
+        req_hooks = []
+        resp_hooks = []
+        exc_hooks = []
+        timing_hooks = []
+        for idx, proc in enumerate(self):
+            req_meth = _hook(proc, 'proc_request')
+            resp_meth = _hook(proc, 'proc_response')
+            exc_meth = _hook(proc, 'proc_exception')
+
+            if req_meth is not None:
+                req_hooks.append((idx, req_meth))
+            if resp_meth is not None:
+                resp_hooks.append((idx, resp_meth))
+            if resp_meth is not None or exc_meth is not None:
+                exc_hooks.append((idx, resp_meth, exc_meth))
+
+            timing_meth = _hook(proc, 'proc_timings')
+            if timing_meth is not None:
+                timing_hooks.append(timing_meth)
+
+        resp_hooks.reverse()
+        exc_hooks.reverse()
+
+        self._hooks = hooks = (req_hooks, resp_hooks, exc_hooks,
+                               timing_hooks)
+        return hooks
+
+    @property
+    def timed(self):
+        """True if any processor in the stack implements proc_timings()."""
+
+        hooks = self._hooks
+        if hooks is None:
+            hooks = self._compile()
+
+        return bool(hooks[3])
+
+    def proc_timings(self, req, timings):
+        """
+        Pass the timings of a completed request to all processors in
+        the stack implementing proc_timings(), in order.
+        """
+
+        for meth in self._compile()[3]:
+            meth(req, timings)
+
     def proc_request(self, req):
         """
         Pre-process a request through all processors in the stack, in
@@ -85,17 +324,48 @@ class ProcessorStack(list):
         processors preceding that processor in the stack.  (Note that
         the response returned this way is not passed to the
         processor's proc_response() method.)  Such a response will
-        then be attached to a ShortCircuit exception.
+        then be attached to a ShortCircuit exception.  If the
+        response has no 'request' attribute, it is set to req, so that
+        the preceding processors can release anything they hold for
+        the request.
+
+        If a processor's proc_request() method raises an exception,
+        the exception is post-processed through the proc_exception()
+        methods of the processors preceding that processor, with its
+        'request' attribute set to req, so that they may release
+        anything they hold for the request.  If one of them returns a
+        response, it is attached to a ShortCircuit exception;
+        otherwise, the exception is re-raised.
 
         For convenience, returns the request passed to the method.
         """
 
-        for idx in range(len(self)):
-            resp = _safe_call(self[idx], 'proc_request', req)
+        for idx, meth in self._compile()[0]:
+            try:
+                resp = meth(req)
+            except (exc.ShortCircuit, exc.RetryRequest):
+                raise
+            except:
+                exc_info = sys.exc_info()
+                try:
+                    exc_info[1].request = req
+                except (AttributeError, TypeError):
+                    pass
+                resp = self.proc_exception(*exc_info, startidx=idx - 1)
+                if not resp:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
+                # Handled; already post-processed
+                raise exc.ShortCircuit(resp)
 
             # Do we have a response?
             if resp is not None:
                 # Short-circuit
+                if getattr(resp, 'request', None) is None:
+                    try:
+                        resp.request = req
+                    except (AttributeError, TypeError):
+                        pass
                 raise exc.ShortCircuit(self.proc_response(resp, idx - 1))
 
         # Return the request we were passed
@@ -112,27 +382,25 @@ class ProcessorStack(list):
         response through a subset of response processors.
         """
 
-        # If we're empty, bail out early
-        if not self:
-            return resp
-
-        # Select appropriate starting index
         if startidx is None:
-            startidx = len(self)
-
-        for idx in range(startidx, -1, -1):
-            _safe_call(self[idx], 'proc_response', resp)
+            for _idx, meth in self._compile()[1]:
+                meth(resp)
+        else:
+            for idx, meth in self._compile()[1]:
+                if idx <= startidx:
+                    meth(resp)
 
         # Return the response we were passed
         return resp
 
-    def proc_exception(self, exc_type, exc_value, traceback):
+    def proc_exception(self, exc_type, exc_value, traceback, startidx=None):
         """
         Post-process an exception through all processors in the stack,
         in reverse order.  The exception so post-processed is any
         exception raised by the Request object's proc_response()
-        method; if the httplib2.Http raises an exception, that
-        exception will not be processed by this mechanism.
+        method, or by the client when issuing the request; in the
+        latter case, the exception's 'request' attribute refers to the
+        request.
 
         Exception processors may return a response object to preempt
         exception processing.  The response object will be
@@ -143,23 +411,46 @@ class ProcessorStack(list):
         processor's proc_response() method will be called on it prior
         to calling proc_exception().
 
+        If a processor raises RetryRequest, the remaining processors
+        still see the exception--and the response, if any--so that
+        they can record the failed attempt; RetryRequest is then
+        re-raised, taking precedence over any response they return.
+
         The return value will be None if the exception was not
         handled, or a response object returned by one of the
         processors.
+
+        The startidx argument is an internal interface only used by
+        the proc_request() method to process an exception through a
+        subset of exception processors.
         """
 
-        # If we're empty, bail out early
-        if not self:
-            return
+        exc_resp = getattr(exc_value, 'response', None)
+        has_resp = hasattr(exc_value, 'response')
+
+        retry = None
+        for idx, resp_meth, exc_meth in self._compile()[2]:
+            if startidx is not None and idx > startidx:
+                continue
 
-        for idx in range(len(self), -1, -1):
             # First, process the response...
-            if hasattr(exc_value, 'response'):
-                _safe_call(self[idx], 'proc_response', exc_value.response)
+            if has_resp and resp_meth is not None:
+                resp_meth(exc_resp)
 
-            resp = _safe_call(self[idx], 'proc_exception',
-                              exc_type, exc_value, traceback)
+            if exc_meth is None:
+                continue
+
+            try:
+                resp = exc_meth(exc_type, exc_value, traceback)
+            except exc.RetryRequest:
+                # Let the remaining processors see the failure first
+                if retry is None:
+                    retry = sys.exc_info()
+                continue
 
             # If we have a response, finish processing and return it
-            if resp:
+            if resp and retry is None:
                 return self.proc_response(resp, idx - 1)
+
+        if retry is not None:
+            raise retry[0], retry[1], retry[2]
@@ -13,35 +13,142 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import StringIO
 import sys
+import time
 
 from requiem import exceptions as exc
 from requiem import headers as hdrs
+from requiem import transport
 
 
 __all__ = ['HTTPRequest']
 
 
+def _join(chunks):
+    """Join body chunks into a single string.
+
+    Chunks may be strings or any object supporting the buffer
+    protocol, such as bytearray, buffer, or memoryview.
+    """
+
+    try:
+        return ''.join(chunks)
+    except TypeError:
+        return ''.join(c if isinstance(c, basestring) else bytes(bytearray(c))
+                       for c in chunks)
+
+
+def _is_stream(body):
+    """Determine if body is a streaming body rather than a string."""
+
+    return (body is not None and
+            not isinstance(body, (basestring, bytearray, buffer, memoryview)))
+
+
+class _IterBody(object):
+    """Adapt an iterable of strings to a readable file-like object.
+
+    If chunked is True, each string is framed using the "chunked"
+    transfer-coding.  This allows bodies produced by generators to be
+    sent without loading them fully into memory.
+    """
+
+    def __init__(self, iterable, chunked=True):
+        """Initialize the adapter."""
+
+        self._iter = iter(iterable)
+        self._chunked = chunked
+        self._done = False
+
+    def read(self, size=-1):
+        """Read the next piece of the body.
+
+        Returns the framing for the next non-empty string from the
+        iterable, regardless of size, or '' when exhausted.
+        """
+
+        if self._done:
+            return ''
+
+        for data in self._iter:
+            if not data:
+                continue
+            if not isinstance(data, basestring):
+                data = bytes(bytearray(data))
+            if self._chunked:
+                return '%x\r\n%s\r\n' % (len(data), data)
+            return data
+
+        # Iterable is exhausted
+        self._done = True
+        return '0\r\n\r\n' if self._chunked else ''
+
+
 class HTTPRequest(object):
     """Represent and perform HTTP requests.
 
     Implements the dictionary access protocol to modify headers
     (headers can also be accessed directly at the 'headers' attribute)
-    and the stream protocol to build up the body.  Handles
+    and the stream protocol to build up the body.  Data written to
+    the body is accumulated as a list of chunks, which are joined only
+    once; the body may alternatively be set to a file-like object, an
+    mmap, or an iterable (such as a generator) producing strings, in
+    which case it is streamed to the server without loading it into
+    memory.  File-like objects are sent with a Content-Length, if
+    their size can be determined; iterables are sent using chunked
+    transfer encoding unless a Content-Length header is set.  Note
+    that a streamed body can only be sent once.  Handles
     redirections under control of the class attribute 'max_redirects'.
     Understands schemes supported by the specified client, which must
     be compatible with the httplib2.Http object.
+
+    If the 'stream' attribute is set to True, the body of a successful
+    response is not read by send(); instead, the response's 'body'
+    attribute is a StreamBody, from which the body may be read in
+    pieces of up to 'chunk_size' bytes, or written directly to a file
+    or buffer.  If 'max_size' is set, BodyTooLarge is raised if the
+    body exceeds that many bytes.  Processors still see the status and
+    headers before the body is consumed.  Streaming may be enabled per
+    request, by setting these attributes in the decorated method, or
+    for all requests by overriding the class attributes.  (Error
+    response bodies are always read in full.)
+
+    If the 'timings' attribute is set to a RequestTimings object, as
+    RESTClient does when a processor implements proc_timings(), the
+    time spent in each phase of sending the request is recorded in
+    it.
+
+    If the 'compression' attribute is set to a Compression object, as
+    RESTClient does once compression has been enabled with
+    _compress(), streamed responses compressed with gzip or deflate
+    are decompressed as they are read; other responses are normally
+    decompressed by the client, as httplib2.Http does, and are
+    otherwise decompressed when they are received.  If
+    the 'compress_threshold' attribute is also set, typically by the
+    decorated method, a request body of at least that many bytes is
+    sent compressed with gzip.
     """
 
     max_redirects = 10
+    stream = False
+    chunk_size = 65536
+    max_size = None
+    timings = None
+    trace = None
+    compression = None
+    compress_threshold = None
 
     def __init__(self, method, url, client, procstack,
-                 body=None, headers=None, debug=None):
+                 body=None, headers=None, debug=None, debugging=None):
         """Initialize a request.
 
         The method and url must be specified.  The body and headers
         are optional, and may be manipulated after instantiating the
-        object.
+        object.  Debugging messages are passed to debug, if given;
+        debugging tells whether they are actually emitted, so that
+        work done only for them may be skipped.  It defaults to
+        whether debug was given.
         """
 
         # Save the relevant data
@@ -49,23 +156,81 @@ class HTTPRequest(object):
         self.url = url
         self.client = client
         self.procstack = procstack
-        self.body = body or ''
-        self.headers = hdrs.HeaderDict()
+        self.body = body
+        self.headers = headers
         self._debug = debug or (lambda *args, **kwargs: None)
-
-        # Set up the headers...
-        if headers:
-            self.headers.update(headers)
+        self._debugging = bool(debug) if debugging is None else debugging
 
         self._debug("Initialized %r request for %r", self.method, self.url)
 
+    @property
+    def headers(self):
+        """Retrieve the headers.
+
+        Read-only headers, such as those shared with the client, are
+        copied the first time the headers are retrieved, so that they
+        may be modified.
+        """
+
+        if self._headers.frozen:
+            self._headers = self._headers.copy()
+
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        """Set the headers.
+
+        Read-only HeaderDict objects are shared until they must be
+        modified; anything else is copied into a new HeaderDict.
+        """
+
+        if not getattr(value, 'frozen', False):
+            value = hdrs.HeaderDict(value)
+
+        self._headers = value
+
+    @property
+    def body(self):
+        """Retrieve the body.
+
+        If the body was built from written data, the data is joined
+        into a single string.  Streaming bodies are returned as-is.
+        """
+
+        if self._stream is not None:
+            return self._stream
+
+        # Join the chunks, keeping the result for next time
+        chunks = self._chunks
+        if len(chunks) > 1:
+            chunks[:] = [_join(chunks)]
+
+        return chunks[0] if chunks else ''
+
+    @body.setter
+    def body(self, value):
+        """Set the body, replacing any previously written data."""
+
+        if _is_stream(value):
+            self._stream = value
+            self._chunks = []
+        else:
+            self._stream = None
+            self._chunks = [value] if value else []
+
     def write(self, data):
         """Write data to the body."""
 
         self._debug("Adding %r to request body", data)
 
+        # Can't add to a streaming body
+        if self._stream is not None:
+            raise ValueError("Cannot write to a streaming request body")
+
         # Add the written data to our body
-        self.body += data
+        if data:
+            self._chunks.append(data)
 
     def flush(self):
         """Flush body stream--no-op for compatibility."""
@@ -78,14 +243,136 @@ class HTTPRequest(object):
 
         Uses httplib2.Http support for handling redirects.  Returns an
         httplib2.Response, which may be augmented by the
-        proc_response() method.
+        proc_response() method.  The response's 'request' attribute
+        refers back to this request.
 
         Note that the default implementation of proc_response() causes
         an appropriate exception to be raised if the response code is
-        >= 400.
+        >= 400.  Exceptions raised by the client, such as connection
+        errors, are also passed to the processors' proc_exception()
+        methods, with the 'request' attribute of the exception set to
+        this request.
+
+        A processor may cause the request to be retried by raising
+        RetryRequest from any of its methods; send() then waits for
+        the specified delay and sends the request again, through all
+        the processors.  The 'attempts' attribute counts the retries.
+
+        The work is split into three stages--_prepare(), _issue(), and
+        _complete()--so that alternate transports which do not block
+        in the client's request() method may drive the request
+        processing themselves.
+
+        If the 'trace' attribute is set to a TraceRecord, the outcome
+        of the request is recorded in it.
         """
 
+        if self.trace is not None:
+            return self.trace.run(self, self._send_retrying)
+
+        return self._send_retrying()
+
+    def _send_retrying(self):
+        """Send the request, retrying as the processors request."""
+
+        self.attempts = 0
+        while True:
+            try:
+                return self._send()
+            except exc.RetryRequest, e:
+                self.attempts += 1
+                self._debug("Retrying request in %.3f seconds (attempt %d)",
+                            e.delay, self.attempts)
+                if e.delay > 0:
+                    time.sleep(e.delay)
+
+    def _send(self):
+        """Make a single attempt at issuing the request."""
+
+        timings = self.timings
+
         # Pre-process the request
+        if timings is None:
+            resp = self._prepare()
+        else:
+            resp = self._timed('pre', self._prepare)
+        if resp is not None:
+            return resp
+
+        # Issue the request
+        try:
+            if timings is None:
+                (resp, content) = self._issue()
+            else:
+                (resp, content) = self._timed_issue(timings)
+        except exc.RetryRequest:
+            raise
+        except:
+            # Let the processors see the exception
+            exc_info = sys.exc_info()
+            if timings is not None:
+                timings.error = exc_info[0].__name__
+            try:
+                exc_info[1].request = self
+            except (AttributeError, TypeError):
+                pass
+            result = self.procstack.proc_exception(*exc_info)
+            if not result:
+                # Not handled, re-raise it
+                raise exc_info[0], exc_info[1], exc_info[2]
+            return result
+
+        # Post-process the response
+        if timings is None:
+            return self._complete(resp, content)
+
+        timings.status = resp.status
+        if isinstance(content, basestring):
+            timings.bytes_in = len(content)
+        else:
+            timings.stream = content
+        return self._timed('post', self._complete, resp, content)
+
+    def _timed(self, phase, func, *args):
+        """Call func, adding the time it takes to the given phase."""
+
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.timings.add(phase, time.time() - start)
+
+    def _timed_issue(self, timings):
+        """Issue the request, recording its timings.
+
+        Clients which can record the connect, ttfb, and transfer
+        phases themselves claim the timings from transport._timing;
+        otherwise, all the time is counted as ttfb.
+        """
+
+        body = self.body
+        if isinstance(body, basestring):
+            timings.bytes_out = len(body)
+        elif self._headers.get('content-length', '').isdigit():
+            timings.bytes_out = int(self._headers['content-length'])
+
+        transport._timing.current = timings
+        start = time.time()
+        try:
+            return self._issue()
+        finally:
+            if transport._timing.current is not None:
+                transport._timing.current = None
+                timings.add('ttfb', time.time() - start)
+
+    def _prepare(self):
+        """Pre-process the request.
+
+        Returns None if the request should be issued, or an already
+        post-processed response if a processor short-circuited the
+        request.
+        """
+
         try:
             self.procstack.proc_request(self)
         except exc.ShortCircuit, e:
@@ -94,20 +381,85 @@ class HTTPRequest(object):
             # Short-circuited; we have an (already processed) response
             return e.response
 
-        self._debug("Sending %r request to %r (body %r, headers %r)",
-                    self.method, self.url, self.body, self.headers)
+        return None
 
-        # Issue the request
-        (resp, content) = self.client.request(self.url, self.method,
-                                              self.body, self.headers,
+    def _issue(self):
+        """Issue the request to the client.
+
+        Returns a tuple of the response and the content.
+        """
+
+        body = self.body
+        compression = self.compression
+        if (self.compress_threshold is not None and compression is not None and
+                isinstance(body, basestring) and
+                len(body) >= self.compress_threshold and
+                'content-encoding' not in self._headers):
+            # Compress the body; only once, if the request is retried
+            body = self.body = compression.compress(body)
+            self.headers['content-encoding'] = 'gzip'
+        elif self._stream is not None and not hasattr(body, 'read'):
+            # Adapt iterables for httplib; use chunked transfer
+            # encoding if we don't know the length
+            chunked = 'content-length' not in self._headers
+            if chunked:
+                self.headers['transfer-encoding'] = 'chunked'
+            body = _IterBody(body, chunked)
+
+        self._debug("Sending %r request to %r (body %r, headers %r)",
+                    self.method, self.url, body, self._headers)
+
+        if not self.stream:
+            (resp, content) = self.client.request(self.url, self.method,
+                                                  body, self._headers,
+                                                  self.max_redirects)
+            if compression is not None:
+                content = compression.inflate(resp, content)
+            return resp, content
+
+        # Stream the response, if the client knows how
+        stream = getattr(self.client, 'stream', None)
+        if stream is not None:
+            (resp, content) = stream(self.url, self.method, body,
+                                     self._headers, self.max_redirects,
+                                     chunk_size=self.chunk_size,
+                                     max_size=self.max_size)
+            if compression is not None:
+                content = compression.decompress(resp, content,
+                                                 self.chunk_size,
+                                                 self.max_size)
+            return resp, content
+
+        # Not a streaming client; present the content as a stream
+        (resp, content) = self.client.request(self.url, self.method, body,
+                                              self._headers,
                                               self.max_redirects)
+        if compression is not None:
+            content = compression.inflate(resp, content)
+        return resp, transport.StreamBody(StringIO.StringIO(content),
+                                          chunk_size=self.chunk_size,
+                                          max_size=self.max_size)
+
+    def _complete(self, resp, content):
+        """Post-process the response to an issued request.
+
+        Returns the final response, or raises an exception if the
+        response indicates an error which no processor handled.
+        """
+
+        # Error bodies are always read in full
+        if self.stream and resp.status >= 400:
+            content = content.read()
 
-        # Save the body in the response
+        # Save the body and the request in the response
         resp.body = content
+        resp.request = self
 
         # Do any processing on the response that's desired
         try:
             self.proc_response(resp)
+        except exc.RetryRequest:
+            raise
         except:
             # Process the exception
             result = self.procstack.proc_exception(*sys.exc_info())
@@ -141,28 +493,34 @@ class HTTPRequest(object):
         """Allow headers to be retrieved via dictionary access."""
 
         # Headers are done by item access
-        return self.headers[item.title()]
+        return self._headers[item]
+
+    def get(self, item, default=None):
+        """Allow headers to be retrieved like dict.get()."""
+
+        # Headers are done by item access
+        return self._headers.get(item, default)
 
     def __setitem__(self, item, value):
         """Allow headers to be set via dictionary access."""
 
         # Headers are done by item access
-        self.headers[item.title()] = value
+        self.headers[item] = value
 
     def __delitem__(self, item):
         """Allow headers to be removed via dictionary access."""
 
         # Headers are done by item access
-        del self.headers[item.title()]
+        del self.headers[item]
 
     def __contains__(self, item):
         """Allow header presence to be discovered via dictionary access."""
 
         # Headers are done by item access
-        return item.title() in self.headers
+        return item in self._headers
 
     def __len__(self):
         """Obtain the number of headers present on the request."""
 
         # Headers are done by item access
-        return len(self.headers)
+        return len(self._headers)
@@ -0,0 +1,245 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import email.utils
+import errno
+import httplib
+import random
+import socket
+import threading
+import time
+
+from requiem import exceptions as exc
+from requiem import processor
+
+
+__all__ = ['RetryBudget', 'RetryProcessor']
+
+
+# Methods which may safely be repeated
+_idempotent_methods = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS',
+                                 'TRACE'])
+
+
+def _retry_after(resp, now=None):
+    """Determine the delay requested by a Retry-After header.
+
+    Returns None if the header is absent or invalid.
+    """
+
+    value = resp.get('retry-after') if resp is not None else None
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+
+    if now is None:
+        now = time.time()
+
+    return max(0.0, email.utils.mktime_tz(parsed) - now)
+
+
+class RetryBudget(object):
+    """Limit retries to a fraction of the requests issued.
+
+    Each original request deposits ratio tokens in the budget, and
+    each retry withdraws one, so that retries make up at most that
+    fraction of the traffic.  To allow retries when traffic is light,
+    min_rate tokens per second are also deposited.  The budget holds
+    at most max_tokens tokens.  A budget is thread-safe, and may be
+    shared between several RetryProcessor objects.
+    """
+
+    def __init__(self, ratio=0.1, min_rate=1.0, max_tokens=100.0):
+        """Initialize a retry budget."""
+
+        self.ratio = ratio
+        self.min_rate = min_rate
+        self.max_tokens = max_tokens
+
+        self._tokens = max_tokens
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _fill(self, amount):
+        """Add tokens to the budget; must be called with the lock held."""
+
+        now = time.time()
+        amount += self.min_rate * max(0.0, now - self._last)
+        self._last = now
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def deposit(self):
+        """Record an original request."""
+
+        with self._lock:
+            self._fill(self.ratio)
+
+    def withdraw(self):
+        """Attempt to withdraw a token for a retry.
+
+        Returns True if the retry may proceed.
+        """
+
+        with self._lock:
+            self._fill(0.0)
+            if self._tokens < 1.0:
+                return False
+
+            self._tokens -= 1.0
+            return True
+
+    @property
+    def tokens(self):
+        """The number of tokens currently in the budget."""
+
+        with self._lock:
+            self._fill(0.0)
+            return self._tokens
+
+
+class RetryProcessor(processor.Processor):
+    """Retry requests which fail transiently.
+
+    A request is retried if the response status is in statuses, or if
+    the client raised one of the exceptions (connection errors, by
+    default).  Only methods in methods are retried, since repeating
+    other requests may not be safe; the exception is a refused
+    connection, which is retried regardless of the method, as the
+    server never saw the request.  Requests with streaming bodies are
+    never retried, as the body cannot be replayed.
+
+    At most max_attempts attempts are made in total.  The delay before
+    each retry uses "decorrelated jitter": a random value between base
+    and three times the previous delay, capped at cap seconds.  A
+    Retry-After header on the response takes precedence; if it asks
+    for a delay longer than cap, the request is not retried.
+
+    Each retry must also withdraw a token from budget, a RetryBudget;
+    by default, each processor has its own.  Pass the same budget to
+    several processors to limit their retries together.
+
+    The processor may be pushed anywhere in the stack: the
+    processors on either side of it, such as a RateLimiter or a
+    CircuitBreaker, see the failed response or exception of every
+    attempt, including those which are retried.
+
+    The 'retries', 'giveups', and 'budget_exhausted' attributes count
+    retries issued, retryable failures which were not retried because
+    the attempts ran out, and those which were not retried because
+    the budget was exhausted.
+    """
+
+    def __init__(self, max_attempts=3, base=0.1, cap=10.0,
+                 statuses=(502, 503, 504), methods=_idempotent_methods,
+                 exceptions=(socket.error, httplib.HTTPException),
+                 budget=None):
+        """Initialize a retry processor."""
+
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(m.upper() for m in methods)
+        self.exceptions = tuple(exceptions)
+        self.budget = budget or RetryBudget()
+
+        self.retries = 0
+        self.giveups = 0
+        self.budget_exhausted = 0
+
+        self._lock = threading.Lock()
+
+    def _retryable(self, req, exc_value):
+        """Determine whether the failure may be retried.
+
+        Returns a tuple of a boolean and the failed response, if any.
+        """
+
+        resp = getattr(exc_value, 'response', None)
+        if isinstance(exc_value, exc.HTTPException):
+            if resp.status not in self.statuses:
+                return False, resp
+            safe = False
+        elif isinstance(exc_value, self.exceptions):
+            safe = getattr(exc_value, 'errno', None) == errno.ECONNREFUSED
+        else:
+            return False, resp
+
+        # Make sure it's safe to repeat the request
+        if not safe and req.method not in self.methods:
+            return False, resp
+
+        return req._stream is None, resp
+
+    def _delay(self, req):
+        """Compute the delay before the next attempt."""
+
+        prev = getattr(req, 'retry_delay', None) or self.base
+        delay = min(self.cap, random.uniform(self.base, prev * 3))
+        req.retry_delay = delay
+
+        return delay
+
+    def proc_request(self, req):
+        """Deposit original requests in the retry budget."""
+
+        if not getattr(req, 'attempts', 0):
+            self.budget.deposit()
+
+    def proc_exception(self, exc_type, exc_value, traceback):
+        """Retry the request, if appropriate.
+
+        Raises RetryRequest to ask the request to be sent again.
+        """
+
+        req = getattr(exc_value, 'request', None)
+        if req is None:
+            resp = getattr(exc_value, 'response', None)
+            req = getattr(resp, 'request', None)
+        if req is None:
+            return None
+
+        retryable, resp = self._retryable(req, exc_value)
+        if not retryable:
+            return None
+
+        if getattr(req, 'attempts', 0) + 1 >= self.max_attempts:
+            with self._lock:
+                self.giveups += 1
+            return None
+
+        # Honor any delay the server asked for
+        delay = _retry_after(resp)
+        if delay is None:
+            delay = self._delay(req)
+        elif delay > self.cap:
+            with self._lock:
+                self.giveups += 1
+            return None
+
+        if not self.budget.withdraw():
+            with self._lock:
+                self.budget_exhausted += 1
+            return None
+
+        with self._lock:
+            self.retries += 1
+        raise exc.RetryRequest(delay)
@@ -0,0 +1,251 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import random
+import sys
+import threading
+import time
+
+
+__all__ = ['Tracer', 'TraceRecord']
+
+
+def _preview(data, limit):
+    """Capture a size-capped preview of a body or other value.
+
+    Returns a tuple of the (possibly truncated) value and its full
+    length, or None for the length if the value is not a string.
+    """
+
+    if isinstance(data, basestring):
+        return data[:limit], len(data)
+    elif data is None:
+        return '', 0
+
+    return '<%s>' % type(data).__name__, None
+
+
+def _capture(arg, limit):
+    """Capture a debugging message argument without keeping a reference.
+
+    Strings are truncated to limit characters and numbers are kept
+    as-is; anything else is replaced by its truncated repr(), since it
+    may be (or refer to) a large or short-lived object.
+    """
+
+    if isinstance(arg, basestring):
+        return arg[:limit]
+    elif arg is None or isinstance(arg, (bool, int, long, float)):
+        return arg
+
+    return repr(arg)[:limit]
+
+
+def _format_preview(preview):
+    """Format a preview captured by _preview()."""
+
+    data, length = preview
+    if length is None:
+        return data
+    elif len(data) < length:
+        return '%r... (%d bytes)' % (data, length)
+
+    return repr(data)
+
+
+class TraceRecord(object):
+    """A summary of one request, kept by a Tracer.
+
+    Only references and size-capped previews are captured while the
+    request is in flight; nothing is formatted until the record is
+    emitted by format().  Debugging messages logged by the request
+    are kept the same way, with their arguments capped; an exception
+    is kept only as its type name and a capped message, so the record
+    holds no reference to the request, the response, or their bodies.
+    """
+
+    def __init__(self, tracer, req, methname):
+        """Initialize a trace record for req."""
+
+        self.tracer = tracer
+        self.methname = methname
+        self.method = req.method
+        self.url = req.url
+        self.start = time.time()
+        self.elapsed = None
+        self.attempts = 0
+        self.req_headers = None
+        self.req_body = None
+        self.status = None
+        self.reason = None
+        self.resp_headers = None
+        self.resp_body = None
+        self.error = None
+        self.error_message = None
+        self.messages = []
+
+    def log(self, msg, *args, **kwargs):
+        """Keep a debugging message, to be formatted when emitted."""
+
+        limit = self.tracer.preview
+        if kwargs:
+            args = dict((key, _capture(value, limit))
+                        for key, value in kwargs.items())
+        else:
+            args = tuple(_capture(arg, limit) for arg in args)
+        self.messages.append((msg, args))
+
+    def _response(self, resp):
+        """Capture a summary of the response."""
+
+        self.status = resp.status
+        self.reason = getattr(resp, 'reason', None)
+        self.resp_headers = dict(resp)
+        self.resp_body = _preview(getattr(resp, 'body', None),
+                                  self.tracer.preview)
+
+    def run(self, req, send):
+        """Call send() to send req, recording the outcome."""
+
+        try:
+            resp = send()
+        except:
+            exc_type, exc_value = sys.exc_info()[:2]
+            self.error = exc_type.__name__
+            try:
+                self.error_message = str(exc_value)[:self.tracer.preview]
+            except Exception:
+                self.error_message = '<unprintable %s>' % self.error
+            resp = getattr(exc_value, 'response', None)
+            if resp is not None:
+                self._response(resp)
+            raise
+        else:
+            self._response(resp)
+            return resp
+        finally:
+            self.elapsed = time.time() - self.start
+            self.attempts = getattr(req, 'attempts', 0)
+            self.req_headers = dict(req._headers)
+            self.req_body = _preview(req.body, self.tracer.preview)
+            self.tracer.finish(self)
+
+    def format(self):
+        """Format the record as a multi-line string."""
+
+        lines = ['%s %s %s -> %s in %.3fs%s' % (
+            time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.start)),
+            self.method, self.url,
+            self.status if self.status is not None else 'no response',
+            self.elapsed or 0.0,
+            ' (%d retries)' % self.attempts if self.attempts else '')]
+
+        if self.methname:
+            lines.append('  method: %s' % self.methname)
+        if self.req_headers is not None:
+            lines.append('  request headers: %r' % self.req_headers)
+        if self.req_body is not None and self.req_body[1] != 0:
+            lines.append('  request body: %s' %
+                         _format_preview(self.req_body))
+        if self.resp_headers is not None:
+            lines.append('  response: %s %s %r' %
+                         (self.status, self.reason, self.resp_headers))
+        if self.resp_body is not None and self.resp_body[1] != 0:
+            lines.append('  response body: %s' %
+                         _format_preview(self.resp_body))
+        if self.error is not None:
+            lines.append('  error: %s: %s' %
+                         (self.error, self.error_message))
+        for msg, args in self.messages:
+            try:
+                lines.append('  | ' + msg % args)
+            except (TypeError, ValueError, KeyError):
+                lines.append('  | %s %r' % (msg, args))
+
+        return '\n'.join(lines)
+
+    __str__ = format
+
+
+class Tracer(object):
+    """A sampling flight recorder for a client's requests.
+
+    Each request is recorded with probability sample_rate.  The
+    records of the last size sampled requests are kept in a ring
+    buffer, and may be retrieved with records() or written out with
+    dump(); bodies are captured as previews of at most preview bytes.
+    If stream is given, each record is also written to it as the
+    request completes.  Requests which are not sampled cost a single
+    branch.
+    """
+
+    def __init__(self, sample_rate=1.0, size=100, preview=256, stream=None):
+        """Initialize a tracer."""
+
+        self.sample_rate = sample_rate
+        self.preview = preview
+        self.stream = stream
+
+        self.sampled = 0
+
+        self._records = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """Decide whether to trace a request."""
+
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def start(self, req, methname=None):
+        """Start tracing req, returning its TraceRecord.
+
+        Unless the request is already emitting debugging messages,
+        they are kept in the record.
+        """
+
+        record = TraceRecord(self, req, methname)
+        if not getattr(req, '_debugging', True):
+            req._debug = record.log
+
+        return record
+
+    def finish(self, record):
+        """Add a completed record to the ring buffer."""
+
+        with self._lock:
+            self.sampled += 1
+            self._records.append(record)
+
+        if self.stream is not None:
+            print >>self.stream, record.format()
+
+    def records(self):
+        """Return a list of the buffered records, oldest first."""
+
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        """Discard the buffered records."""
+
+        with self._lock:
+            self._records.clear()
+
+    def dump(self, stream=None):
+        """Write the buffered records to stream (sys.stderr by default)."""
+
+        stream = stream or sys.stderr
+        for record in self.records():
+            print >>stream, record.format()
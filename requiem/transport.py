@@ -0,0 +1,845 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import copy
+import httplib
+import socket
+import sys
+import threading
+import time
+import urlparse
+import weakref
+
+import httplib2
+
+from requiem import exceptions as exc
+
+
+__all__ = ['ConnectionPool', 'Coalescer', 'StreamBody']
+
+
+# Default ports for the schemes we understand
+_default_ports = {
+    'http': 80,
+    'https': 443,
+}
+
+
+# Redirection status codes followed when streaming
+_redirect_codes = frozenset([301, 302, 303, 307, 308])
+
+
+class _Timing(threading.local):
+    """Per-thread hand-off of request timings to the transport.
+
+    HTTPRequest sets 'current' to the RequestTimings of a request
+    while it is issued; a transport which can time the phases of the
+    request itself claims the timings by resetting 'current' to None.
+    """
+
+    current = None
+
+
+_timing = _Timing()
+
+
+def _close(http):
+    """Close all connections held by an httplib2.Http-compatible object."""
+
+    # Newer httplib2.Http objects have a close() method
+    close = getattr(http, 'close', None)
+    if close is not None and callable(close):
+        close()
+        return
+
+    # Otherwise, close the cached connections by hand
+    for conn in getattr(http, 'connections', {}).values():
+        conn.close()
+
+
+class StreamBody(object):
+    """File-like and iterable view of a response body.
+
+    The body is read incrementally from the source--normally the
+    socket--rather than being held in memory.  Iterating over a
+    StreamBody yields chunks of at most chunk_size bytes.  If max_size
+    is given, BodyTooLarge is raised as soon as more than that many
+    bytes have been received.
+
+    When the body has been completely read, the underlying connection
+    is returned for reuse; if the body is closed before it has been
+    completely read, the connection is discarded.
+    """
+
+    def __init__(self, source, release=None, chunk_size=65536,
+                 max_size=None):
+        """Initialize a stream body.
+
+        The source must have a read() method.  The release callable,
+        if given, is called with True once the body has been fully
+        read, or with False if it is closed early.
+        """
+
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.bytes_read = 0
+        self.closed = False
+
+        self._source = source
+        self._release = release
+
+    def __del__(self):
+        """Make sure the connection is released."""
+
+        self.close()
+
+    def __enter__(self):
+        """Enter the context manager."""
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the context manager, closing the body."""
+
+        self.close()
+
+    def __iter__(self):
+        """Iterate over the body in chunks of chunk_size bytes."""
+
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+            yield data
+
+    def _finish(self, complete):
+        """Mark the body as closed and release the connection."""
+
+        if self.closed:
+            return
+
+        self.closed = True
+        if self._release is not None:
+            self._release(complete)
+
+    def read(self, size=-1):
+        """Read at most size bytes; reads everything if size < 0."""
+
+        if self.closed:
+            return ''
+
+        try:
+            if size is None or size < 0:
+                data = self._source.read()
+            else:
+                data = self._source.read(size)
+        except:
+            self._finish(False)
+            raise
+
+        # Enforce the size limit
+        self.bytes_read += len(data)
+        if self.max_size is not None and self.bytes_read > self.max_size:
+            self._finish(False)
+            raise exc.BodyTooLarge(self.max_size)
+
+        # Release the connection when we hit the end
+        isclosed = getattr(self._source, 'isclosed', None)
+        if (size is None or size < 0 or not data or
+                (isclosed is not None and isclosed())):
+            self._finish(True)
+
+        return data
+
+    def readinto(self, buf):
+        """Read into the caller-supplied buffer buf.
+
+        Returns the number of bytes read; 0 indicates the end of the
+        body.
+        """
+
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def write_to(self, fileobj):
+        """Write the remaining body to fileobj.
+
+        Returns the number of bytes written.
+        """
+
+        total = 0
+        for data in self:
+            fileobj.write(data)
+            total += len(data)
+
+        return total
+
+    def close(self):
+        """Close the body, discarding any unread data."""
+
+        self._finish(False)
+
+
+class _HostPool(object):
+    """A bounded pool of clients talking to a single (scheme, host, port).
+
+    Each client is an httplib2.Http-compatible object, which keeps its
+    own keep-alive connections; a client is only ever used by one
+    thread at a time.
+    """
+
+    def __init__(self, key, factory, maxsize, idle_timeout, block,
+                 block_timeout):
+        """Initialize a host pool."""
+
+        self.key = key
+        self.factory = factory
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.block = block
+        self.block_timeout = block_timeout
+
+        # Idle clients, as (client, last used) tuples; the most
+        # recently used client is at the right
+        self._idle = collections.deque()
+        self._count = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _expire(self, now):
+        """Close idle clients that have exceeded the idle timeout.
+
+        Must be called with the lock held.
+        """
+
+        if self.idle_timeout is None:
+            return
+
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            http, _stamp = self._idle.popleft()
+            self._count -= 1
+            _close(http)
+
+    def checkout(self):
+        """Check out a client, allocating one if necessary.
+
+        If the pool is at its maximum size, waits for a client to be
+        checked back in, if the pool is blocking; otherwise,
+        PoolExhausted is raised.  PoolExhausted is also raised if the
+        wait exceeds the block timeout.
+        """
+
+        with self._cond:
+            deadline = None
+            while True:
+                now = time.time()
+                self._expire(now)
+
+                # Prefer the most recently used client
+                if self._idle:
+                    return self._idle.pop()[0]
+
+                # Can we allocate a new client?
+                if self._count < self.maxsize:
+                    self._count += 1
+                    break
+
+                # Pool is exhausted; wait, if we're allowed to
+                if not self.block:
+                    raise exc.PoolExhausted(self.key)
+                if self.block_timeout is None:
+                    self._cond.wait()
+                    continue
+                if deadline is None:
+                    deadline = now + self.block_timeout
+                elif now >= deadline:
+                    raise exc.PoolExhausted(self.key)
+                self._cond.wait(deadline - now)
+
+        # Allocate the new client outside the lock
+        try:
+            return self.factory()
+        except:
+            self.discard(None)
+            raise
+
+    def checkin(self, http):
+        """Return a client to the pool."""
+
+        with self._cond:
+            self._idle.append((http, time.time()))
+            self._cond.notify()
+
+    def discard(self, http):
+        """Discard a client that is in an unknown state."""
+
+        if http is not None:
+            _close(http)
+
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    def clear(self):
+        """Close all idle clients."""
+
+        with self._cond:
+            while self._idle:
+                http, _stamp = self._idle.popleft()
+                self._count -= 1
+                _close(http)
+            self._cond.notify_all()
+
+
+class ConnectionPool(object):
+    """Thread-safe, httplib2.Http-compatible client with connection pooling.
+
+    Maintains a bounded pool of keep-alive connections for each
+    (scheme, host, port) combination.  A single ConnectionPool, and
+    thus a single RESTClient, may safely be shared by many threads;
+    each request checks out a connection for its exclusive use and
+    returns it to the pool when the response has been read.
+
+    Like httplib2.Http, a ConnectionPool has add_credentials(),
+    clear_credentials(), and add_certificate() methods and
+    follow_redirects and follow_all_redirects attributes; these are
+    recorded and applied to every pooled client, including those
+    created later.
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=60.0, block=True,
+                 block_timeout=None, factory=httplib2.Http, **kwargs):
+        """Initialize a connection pool.
+
+        At most maxsize connections will be opened to any given
+        (scheme, host, port).  Connections which have been idle for
+        more than idle_timeout seconds are closed; pass None to keep
+        idle connections open indefinitely.  If block is True (the
+        default), requests wait for a connection to become available
+        when the pool is exhausted, for at most block_timeout seconds
+        (forever, if None); otherwise, or if the wait times out,
+        PoolExhausted is raised.
+
+        Connections are created by calling factory, which defaults to
+        httplib2.Http; any additional keyword arguments, such as
+        timeout or ca_certs, are passed to it.
+        """
+
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.block = block
+        self.block_timeout = block_timeout
+        self.factory = factory
+        self.factory_kwargs = kwargs
+
+        self._pools = {}
+        self._lock = threading.Lock()
+
+        # Client settings, as (method name, arguments) and attribute
+        # values, and the clients they must be applied to
+        self._settings = []
+        self._attrs = {}
+        self._clients = weakref.WeakSet()
+
+    def _make_client(self):
+        """Allocate a new httplib2.Http-compatible client."""
+
+        http = self.factory(**self.factory_kwargs)
+
+        with self._lock:
+            for methname, args in self._settings:
+                getattr(http, methname)(*args)
+            for attr, value in self._attrs.items():
+                setattr(http, attr, value)
+            self._clients.add(http)
+
+        return http
+
+    def _apply(self, methname, *args):
+        """Record a client setting and apply it to all clients."""
+
+        with self._lock:
+            if methname == 'clear_credentials':
+                self._settings = [setting for setting in self._settings
+                                  if setting[0] != 'add_credentials']
+            else:
+                self._settings.append((methname, args))
+
+            for http in self._clients:
+                getattr(http, methname)(*args)
+
+    def _set_attr(self, attr, value):
+        """Record a client attribute and set it on all clients."""
+
+        with self._lock:
+            self._attrs[attr] = value
+            for http in self._clients:
+                setattr(http, attr, value)
+
+    def add_credentials(self, name, password, domain=''):
+        """Add a name and password for HTTP authentication.
+
+        See httplib2.Http.add_credentials().
+        """
+
+        self._apply('add_credentials', name, password, domain)
+
+    def clear_credentials(self):
+        """Remove all the names and passwords added."""
+
+        self._apply('clear_credentials')
+
+    def add_certificate(self, key, cert, domain, password=None):
+        """Add a client key and certificate for SSL connections.
+
+        See httplib2.Http.add_certificate().  Connections that are
+        already open are not affected.
+        """
+
+        self._apply('add_certificate', key, cert, domain, password)
+
+    @property
+    def follow_redirects(self):
+        """Whether redirections are followed; True by default."""
+
+        return self._attrs.get('follow_redirects', True)
+
+    @follow_redirects.setter
+    def follow_redirects(self, value):
+        """Set whether redirections are followed."""
+
+        self._set_attr('follow_redirects', value)
+
+    @property
+    def follow_all_redirects(self):
+        """Whether redirections of unsafe methods are followed.
+
+        False by default.
+        """
+
+        return self._attrs.get('follow_all_redirects', False)
+
+    @follow_all_redirects.setter
+    def follow_all_redirects(self, value):
+        """Set whether redirections of unsafe methods are followed."""
+
+        self._set_attr('follow_all_redirects', value)
+
+    def _get_pool(self, uri):
+        """Look up the host pool for the specified URI."""
+
+        parts = urlparse.urlsplit(uri)
+        scheme = parts.scheme.lower()
+        key = (scheme, parts.hostname,
+               parts.port or _default_ports.get(scheme))
+
+        # Fast path: pool already exists
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = _HostPool(key, self._make_client, self.maxsize,
+                                     self.idle_timeout, self.block,
+                                     self.block_timeout)
+                    self._pools[key] = pool
+
+        return pool
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                connection_type=None):
+        """Issue a request, using a pooled connection.
+
+        Takes the same arguments and returns the same (response,
+        content) tuple as httplib2.Http.request().
+        """
+
+        # Claim the timings of the request, if it's timed
+        timings = _timing.current
+        if timings is not None:
+            _timing.current = None
+            return self._timed_request(timings, uri, method, body, headers,
+                                       redirections, connection_type)
+
+        pool = self._get_pool(uri)
+        http = pool.checkout()
+
+        try:
+            result = http.request(uri, method, body, headers, redirections,
+                                  connection_type)
+        except:
+            # The connection is in an unknown state; don't reuse it
+            pool.discard(http)
+            raise
+
+        pool.checkin(http)
+        return result
+
+    def _timed_request(self, timings, uri, method, body, headers,
+                       redirections, connection_type):
+        """Issue a request, recording the time spent in each phase."""
+
+        start = time.time()
+        marks = {'connect': 0.0}
+        try:
+            return self._marked_request(marks, uri, method, body, headers,
+                                        redirections, connection_type)
+        finally:
+            # Waiting for the pool counts as connecting
+            end = time.time()
+            ready = marks.get('ready', end)
+            first = marks.get('ttfb', end)
+            timings.add('connect', ready - start + marks['connect'])
+            timings.add('ttfb', first - ready - marks['connect'])
+            timings.add('transfer', end - first)
+
+    def _marked_request(self, marks, uri, method, body, headers,
+                        redirections, connection_type):
+        """Issue a request, noting the times of its phases in marks.
+
+        The connection httplib2 will use--created ahead of time by
+        _connection(), exactly as httplib2 would create it, with the
+        given connection_type and any client certificate--has its
+        connect() and getresponse() methods wrapped for the duration
+        of the request, to find out when it connects and when the
+        response headers arrive.
+        """
+
+        pool = self._get_pool(uri)
+        http = pool.checkout()
+
+        try:
+            conn, _request_uri = self._connection(http, uri,
+                                                  connection_type)
+            connect = conn.connect
+            getresponse = conn.getresponse
+
+            def timed_connect(*args, **kwargs):
+                begin = time.time()
+                try:
+                    return connect(*args, **kwargs)
+                finally:
+                    marks['connect'] += time.time() - begin
+
+            def timed_getresponse(*args, **kwargs):
+                response = getresponse(*args, **kwargs)
+                marks.setdefault('ttfb', time.time())
+                return response
+
+            conn.connect = timed_connect
+            conn.getresponse = timed_getresponse
+            marks['ready'] = time.time()
+            try:
+                result = http.request(uri, method, body, headers,
+                                      redirections, connection_type)
+            finally:
+                del conn.connect
+                del conn.getresponse
+        except:
+            # The connection is in an unknown state; don't reuse it
+            pool.discard(http)
+            raise
+
+        pool.checkin(http)
+        return result
+
+    def _connection(self, http, uri, connection_type=None):
+        """Look up or create the connection http uses for uri.
+
+        Returns a tuple of the connection and the request URI to
+        send.  The connection is shared with the httplib2.Http
+        object, so that streaming and non-streaming requests use the
+        same keep-alive connections; it is created just as
+        httplib2.Http.request() would create it, including any client
+        certificate added with add_certificate().
+        """
+
+        # Normalize the URI the way httplib2 does, so that we find
+        # the connection it would use
+        uri = httplib2.iri2uri(uri)
+        uri = uri.replace(' ', '%20').replace('\r', '%0D').replace('\n', '%0A')
+
+        scheme, authority, request_uri, _defrag_uri = httplib2.urlnorm(uri)
+        conn_key = scheme + ':' + authority
+        conn = http.connections.get(conn_key)
+        if conn is None:
+            kwargs = {
+                'timeout': http.timeout,
+                'proxy_info': http._get_proxy_info(scheme, authority),
+            }
+            if scheme == 'https':
+                kwargs.update(
+                    ca_certs=http.ca_certs,
+                    disable_ssl_certificate_validation=(
+                        http.disable_ssl_certificate_validation),
+                    ssl_version=http.ssl_version)
+                certificates = getattr(http, 'certificates', None)
+                certs = (list(certificates.iter(authority))
+                         if certificates is not None else [])
+                if certs:
+                    kwargs.update(key_file=certs[0][0],
+                                  cert_file=certs[0][1],
+                                  key_password=certs[0][2])
+            conn_class = (connection_type or
+                          httplib2.SCHEME_TO_CONNECTION[scheme])
+            conn = http.connections[conn_key] = conn_class(authority,
+                                                           **kwargs)
+            conn.set_debuglevel(httplib2.debuglevel)
+
+        return conn, request_uri
+
+    def _stream_one(self, uri, method, body, headers, chunk_size, max_size,
+                    timings=None):
+        """Issue a single request, without following redirects."""
+
+        start = time.time() if timings is not None else None
+        pool = self._get_pool(uri)
+        http = pool.checkout()
+
+        def release(complete):
+            if complete:
+                pool.checkin(http)
+            else:
+                pool.discard(http)
+
+        try:
+            conn, request_uri = self._connection(http, uri)
+
+            # Retry once if a kept-alive connection went stale, as
+            # long as the body can be re-sent
+            retry = body is None or isinstance(body, basestring)
+            while True:
+                reused = conn.sock is not None
+                try:
+                    if conn.sock is None:
+                        conn.connect()
+                    ready = time.time() if timings is not None else None
+                    conn.request(method, request_uri, body, headers or {})
+                    response = conn.getresponse()
+                    break
+                except (socket.error, httplib.HTTPException):
+                    conn.close()
+                    if not (reused and retry):
+                        raise
+                    retry = False
+        except:
+            pool.discard(http)
+            raise
+
+        if timings is not None:
+            timings.add('connect', ready - start)
+            timings.add('ttfb', time.time() - ready)
+
+        resp = httplib2.Response(response)
+        content = StreamBody(response, release, chunk_size, max_size)
+
+        # Check the size limit before reading anything
+        length = resp.get('content-length')
+        if (max_size is not None and length and length.isdigit() and
+                int(length) > max_size):
+            content.close()
+            raise exc.BodyTooLarge(max_size)
+
+        return resp, content
+
+    def stream(self, uri, method='GET', body=None, headers=None,
+               redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+               chunk_size=65536, max_size=None):
+        """Issue a request, streaming the response body.
+
+        Similar to request(), except that the content returned is a
+        StreamBody, from which the body may be read incrementally.
+        The pooled connection is in use until the body has been fully
+        read or closed.  Redirections are followed for GET and HEAD
+        requests, and for 303 responses, subject to follow_redirects
+        and follow_all_redirects.  Credentials added with
+        add_credentials() are not used for streamed requests.
+        """
+
+        # Claim the timings of the request, if it's timed
+        timings = _timing.current
+        if timings is not None:
+            _timing.current = None
+
+        for _i in range(redirections + 1):
+            resp, content = self._stream_one(uri, method, body, headers,
+                                             chunk_size, max_size, timings)
+
+            # Follow redirections
+            if (resp.status in _redirect_codes and 'location' in resp and
+                    self.follow_redirects and
+                    (method in ('GET', 'HEAD') or resp.status == 303 or
+                     self.follow_all_redirects)):
+                content.read()
+                uri = urlparse.urljoin(uri, resp['location'])
+                if resp.status == 303:
+                    method = 'GET'
+                    body = None
+                continue
+
+            return resp, content
+
+        raise httplib2.RedirectLimit(
+            "Redirected more times than redirection_limit allows.",
+            resp, '')
+
+    def clear(self):
+        """Close all idle connections in the pool."""
+
+        with self._lock:
+            pools = self._pools.values()
+
+        for pool in pools:
+            pool.clear()
+
+
+class _Flight(object):
+    """Represent an in-flight request that others may wait on."""
+
+    def __init__(self):
+        """Initialize a flight."""
+
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+def _copy_exception(exc_value):
+    """Copy an exception, so that each waiter may annotate its own.
+
+    Processors attach the request to an exception raised by the
+    client, so each request sharing a failure needs its own copy.
+    Exceptions whose constructors take other arguments than their
+    'args' are copied without calling the constructor.
+    """
+
+    try:
+        return copy.copy(exc_value)
+    except Exception:
+        pass
+
+    try:
+        cls = exc_value.__class__
+        result = cls.__new__(cls)
+        result.args = exc_value.args
+        result.__dict__.update(exc_value.__dict__)
+        return result
+    except Exception:
+        return exc_value
+
+
+class Coalescer(object):
+    """Collapse identical concurrent requests into one (single-flight).
+
+    Wraps an httplib2.Http-compatible client.  While a request is in
+    flight, identical requests--same method, URL, and headers--wait
+    for it to complete and share its response or exception, rather
+    than going to the network themselves.  Each caller receives its
+    own copy of the response, so processors and exception mapping
+    apply to each request as usual.
+
+    Only requests without a body using one of the specified methods
+    (by default, GET and HEAD) are coalesced.  If key_headers is
+    given, only those headers are compared; otherwise, all headers
+    must match.  Streaming requests are passed straight through.  The
+    'requests' and 'coalesced' attributes count the requests seen and
+    the requests which were collapsed into another.
+    """
+
+    def __init__(self, client=None, methods=('GET', 'HEAD'),
+                 key_headers=None):
+        """Initialize a coalescer wrapping client.
+
+        If client is not given, a ConnectionPool is used.
+        """
+
+        self.client = client or ConnectionPool()
+        self.methods = frozenset(methods)
+        self.key_headers = (None if key_headers is None else
+                            tuple(sorted(h.lower() for h in key_headers)))
+
+        self.requests = 0
+        self.coalesced = 0
+
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        # Pass streaming requests through
+        if hasattr(self.client, 'stream'):
+            self.stream = self.client.stream
+
+    def _key(self, uri, method, headers):
+        """Compute the key identifying identical requests."""
+
+        headers = dict((k.lower(), v) for k, v in (headers or {}).items())
+        if self.key_headers is None:
+            hkey = tuple(sorted(headers.items()))
+        else:
+            hkey = tuple((h, headers.get(h)) for h in self.key_headers)
+
+        return (method, uri, hkey)
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                connection_type=None):
+        """Issue a request, sharing the result of an identical one.
+
+        Takes the same arguments and returns the same (response,
+        content) tuple as httplib2.Http.request().
+        """
+
+        if method not in self.methods or body:
+            with self._lock:
+                self.requests += 1
+            return self.client.request(uri, method, body, headers,
+                                       redirections, connection_type)
+
+        key = self._key(uri, method, headers)
+        with self._lock:
+            self.requests += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        # Wait for the leader and share its result
+        if not leader:
+            flight.event.wait()
+            if flight.exc_info is not None:
+                exc_type, exc_value, tb = flight.exc_info
+                raise exc_type, _copy_exception(exc_value), tb
+            resp, content = flight.result
+            return copy.copy(resp), content
+
+        try:
+            resp, content = self.client.request(uri, method, body, headers,
+                                                redirections,
+                                                connection_type)
+
+            # Keep a pristine copy for the followers
+            flight.result = (copy.copy(resp), content)
+        except:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+        return resp, content
@@ -0,0 +1,159 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import socket
+import time
+import unittest
+
+import httplib2
+
+import requiem
+from requiem import breaker
+
+
+class _SwitchableHttp(object):
+    """httplib2.Http stand-in whose outcome may be changed."""
+
+    def __init__(self, outcome=200):
+        """Initialize the fake client.
+
+        The outcome is a status code, or an exception to raise.
+        """
+
+        self.outcome = outcome
+        self.requests = 0
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Answer a request."""
+
+        self.requests += 1
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+
+        resp = httplib2.Response({'status': str(self.outcome)})
+        resp.reason = 'Fault'
+        return resp, ''
+
+
+class _Client(requiem.RESTClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/thing')
+    def get_thing(self, req):
+        """Retrieve the thing."""
+
+        return req.send()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def _client(self, brk, outcome=200, url='http://example.com'):
+        http = _SwitchableHttp(outcome)
+        client = _Client(url, client=http)
+        client._push_processor(brk)
+
+        return client, http
+
+    def test_opens_on_failures(self):
+        events = []
+        brk = breaker.CircuitBreaker(
+            min_requests=4, failure_ratio=0.5,
+            listener=lambda *args: events.append(args))
+        client, http = self._client(brk, 200)
+
+        for _i in range(2):
+            client.get_thing()
+        http.outcome = 503
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+        self.assertEqual(brk.state('example.com'), breaker.CLOSED)
+        http.outcome = socket.error(111, 'Connection refused')
+        self.assertRaises(socket.error, client.get_thing)
+        self.assertEqual(brk.state('example.com'), breaker.OPEN)
+
+        # Now requests fail fast
+        self.assertRaises(requiem.CircuitOpen, client.get_thing)
+        self.assertEqual(http.requests, 4)
+        self.assertEqual(events,
+                         [('example.com', breaker.CLOSED, breaker.OPEN)])
+
+        stats = brk.stats()['example.com']
+        self.assertEqual((stats['successes'], stats['failures']), (2, 2))
+        self.assertEqual((stats['rejected'], stats['opens']), (1, 1))
+
+    def test_other_statuses_succeed(self):
+        brk = breaker.CircuitBreaker(min_requests=2)
+        client, http = self._client(brk, 404)
+
+        for _i in range(5):
+            self.assertRaises(requiem.HTTPException, client.get_thing)
+
+        self.assertEqual(brk.state('example.com'), breaker.CLOSED)
+        self.assertEqual(brk.stats()['example.com']['successes'], 5)
+
+    def test_hosts_are_separate(self):
+        brk = breaker.CircuitBreaker(min_requests=2)
+        bad, _http = self._client(brk, 503, 'http://bad.example.com')
+        good, _http = self._client(brk, 200, 'http://good.example.com')
+
+        for _i in range(2):
+            self.assertRaises(requiem.HTTPException, bad.get_thing)
+
+        self.assertRaises(requiem.CircuitOpen, bad.get_thing)
+        good.get_thing()
+        self.assertEqual(brk.state('good.example.com'), breaker.CLOSED)
+
+    def test_half_open(self):
+        brk = breaker.CircuitBreaker(min_requests=1, reset_timeout=0.05,
+                                     close_after=2)
+        client, http = self._client(brk, 503)
+
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+        self.assertEqual(brk.state('example.com'), breaker.OPEN)
+
+        # A failed probe opens the circuit again
+        time.sleep(0.06)
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+        self.assertEqual(brk.state('example.com'), breaker.OPEN)
+        self.assertRaises(requiem.CircuitOpen, client.get_thing)
+
+        # Enough successful probes close it
+        time.sleep(0.06)
+        http.outcome = 200
+        client.get_thing()
+        self.assertEqual(brk.state('example.com'), breaker.HALF_OPEN)
+        client.get_thing()
+        self.assertEqual(brk.state('example.com'), breaker.CLOSED)
+
+        self.assertEqual(brk.transitions[breaker.HALF_OPEN, breaker.OPEN], 1)
+        self.assertEqual(
+            brk.transitions[breaker.HALF_OPEN, breaker.CLOSED], 1)
+
+    def test_probe_limit(self):
+        brk = breaker.CircuitBreaker(reset_timeout=1.0, half_open_probes=1)
+        circuit = brk._circuit('http://example.com/')
+        events = []
+        circuit.state = breaker.OPEN
+        circuit.opened_at = time.time() - 2.0
+
+        self.assertTrue(circuit.admit(time.time(), events))
+        self.assertRaises(requiem.CircuitOpen, circuit.admit, time.time(),
+                          events)
+
+        # Releasing the probe lets another through
+        circuit.release(True)
+        self.assertTrue(circuit.admit(time.time(), events))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import httplib2
+
+import requiem
+from requiem import cache
+
+
+class _ScriptedHttp(object):
+    """httplib2.Http stand-in answering from a list of responses."""
+
+    def __init__(self, *responses):
+        """Initialize the fake client.
+
+        Each response is a tuple of the status, a dictionary of
+        headers, and the body; the last one is repeated.
+        """
+
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Answer a request, recording its method and headers."""
+
+        self.requests.append((method, dict(headers or {})))
+        if len(self.responses) > 1:
+            status, hdrs, content = self.responses.pop(0)
+        else:
+            status, hdrs, content = self.responses[0]
+
+        resp = httplib2.Response(dict(hdrs, status=str(status)))
+        resp.reason = 'OK'
+        return resp, content
+
+
+class _Client(requiem.RESTClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/thing')
+    def get_thing(self, req, accept=None):
+        """Retrieve the thing."""
+
+        if accept:
+            req['Accept'] = accept
+        return req.send()
+
+    @requiem.restmethod('POST', '/thing')
+    def update_thing(self, req):
+        """Update the thing."""
+
+        return req.send()
+
+
+class TestCacheProcessor(unittest.TestCase):
+    def _client(self, *responses, **kwargs):
+        http = _ScriptedHttp(*responses)
+        proc = cache.CacheProcessor(**kwargs)
+        client = _Client('http://example.com', client=http)
+        client._push_processor(proc)
+
+        return client, http, proc
+
+    def test_fresh_hit(self):
+        client, http, proc = self._client(
+            (200, {'cache-control': 'max-age=60'}, 'thing'))
+
+        client.get_thing()
+        resp = client.get_thing()
+
+        self.assertEqual(len(http.requests), 1)
+        self.assertTrue(resp.fromcache)
+        self.assertEqual(resp.body, 'thing')
+        self.assertEqual(proc.hits, 1)
+        self.assertEqual(proc.misses, 1)
+
+    def test_not_modified(self):
+        client, http, proc = self._client(
+            (200, {'cache-control': 'max-age=0', 'etag': '"v1"'}, 'thing'),
+            (304, {'cache-control': 'max-age=60'}, ''))
+
+        client.get_thing()
+        resp = client.get_thing()
+
+        self.assertEqual(http.requests[1][1].get('If-None-Match'), '"v1"')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.body, 'thing')
+        self.assertEqual(resp['etag'], '"v1"')
+        self.assertEqual(proc.revalidated, 1)
+
+        # The 304 refreshed the entry
+        self.assertTrue(client.get_thing().fromcache)
+        self.assertEqual(len(http.requests), 2)
+
+    def test_vary(self):
+        client, http, proc = self._client(
+            (200, {'cache-control': 'max-age=60', 'vary': 'Accept'}, 'x'))
+
+        client.get_thing(accept='text/plain')
+        client.get_thing(accept='application/json')
+        resp = client.get_thing(accept='application/json')
+
+        self.assertEqual(len(http.requests), 2)
+        self.assertTrue(resp.fromcache)
+
+    def test_unsafe_method_invalidates(self):
+        client, http, proc = self._client(
+            (200, {'cache-control': 'max-age=60'}, 'thing'))
+
+        client.get_thing()
+        client.update_thing()
+        resp = client.get_thing()
+
+        self.assertEqual([method for method, _hdrs in http.requests],
+                         ['GET', 'POST', 'GET'])
+        self.assertFalse(getattr(resp, 'fromcache', False))
+
+    def test_stale_while_revalidate(self):
+        client, http, proc = self._client(
+            (200, {'cache-control': 'max-age=0, stale-while-revalidate=60',
+                   'etag': '"v1"'}, 'old'),
+            (200, {'cache-control': 'max-age=60'}, 'new'))
+
+        client.get_thing()
+        resp = client.get_thing()
+        self.assertTrue(resp.fromcache)
+        self.assertEqual(resp.body, 'old')
+        self.assertEqual(proc.stale_hits, 1)
+
+        # Wait for the background revalidation
+        deadline = time.time() + 5.0
+        while proc._refreshing or len(http.requests) < 2:
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+
+        self.assertEqual(http.requests[1][1].get('Cache-Control'),
+                         'no-cache')
+        self.assertEqual(client.get_thing().body, 'new')
+        self.assertEqual(len(http.requests), 2)
+
+
+class TestSQLiteStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _entry(self, size):
+        return cache.CacheEntry(200, 'OK', {'etag': '"x"'}, 'x' * size, {},
+                                time.time() + 60)
+
+    def test_round_trip(self):
+        store = cache.SQLiteStore(self.path)
+        store.put('http://example.com/', cache.CacheEntry(
+            200, 'OK', {'etag': '"x"'}, '\x00\xff', {'accept': None}, 10.0,
+            20.0))
+
+        entry = cache.SQLiteStore(self.path).get('http://example.com/')
+        self.assertEqual(entry.status, 200)
+        self.assertEqual(entry.headers, {'etag': '"x"'})
+        self.assertEqual(entry.body, '\x00\xff')
+        self.assertEqual(entry.vary, {'accept': None})
+        self.assertEqual((entry.expires, entry.stale_until), (10.0, 20.0))
+
+    def test_totals_and_eviction(self):
+        store = cache.SQLiteStore(self.path, max_entries=3)
+        size = self._entry(10).size
+
+        for i in range(5):
+            store.put('key%d' % i, self._entry(10))
+        store.put('key4', self._entry(20))
+
+        stats = store.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['bytes'], 3 * size + 10)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertTrue(store.get('key1') is None)
+        self.assertTrue(store.get('key2') is not None)
+
+        store.delete('key4')
+        self.assertEqual(store.stats()['bytes'], 2 * size)
+        store.clear()
+        self.assertEqual(store.stats()['entries'], 0)
+        self.assertEqual(store.stats()['bytes'], 0)
+
+    def test_max_bytes(self):
+        size = self._entry(100).size
+        store = cache.SQLiteStore(self.path, max_bytes=2 * size)
+
+        for i in range(3):
+            store.put('key%d' % i, self._entry(100))
+        store.put('big', self._entry(10 * size))
+
+        self.assertEqual(store.stats()['entries'], 2)
+        self.assertTrue(store.get('key0') is None)
+        self.assertTrue(store.get('big') is None)
+
+    def test_old_schema_replaced(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE entries (key TEXT PRIMARY KEY, '
+                     'status INTEGER, reason TEXT, headers TEXT, body BLOB, '
+                     'vary TEXT, expires REAL, stale_until REAL, '
+                     'size INTEGER, atime REAL)')
+        conn.commit()
+        conn.close()
+
+        store = cache.SQLiteStore(self.path)
+        store.put('key', self._entry(10))
+
+        self.assertEqual(store.stats()['entries'], 1)
+        self.assertEqual(store.get('key').body, 'x' * 10)
+        self.assertEqual(store.errors, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import StringIO
+import unittest
+
+import requiem
+from requiem import jsclient
+
+from benchmarks import support
+
+
+class _Client(jsclient.JSONClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/items/{count}')
+    def list_items(self, req, count):
+        """List some items."""
+
+        return req.send()
+
+
+class _LoggingClient(_Client):
+    """A client collecting its debugging messages itself."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the client."""
+
+        super(_LoggingClient, self).__init__(*args, **kwargs)
+        self.messages = []
+
+    def _debug(self, msg, *args, **kwargs):
+        """Collect a debugging message."""
+
+        self.messages.append(msg % (kwargs or args))
+
+
+class TestDebugging(unittest.TestCase):
+    def test_disabled(self):
+        client = _Client('http://example.com', client=support.FakeHttp())
+
+        req = client._make_req('GET', 'http://example.com/', 'list_items')
+
+        self.assertFalse(client._debugging)
+        self.assertFalse(req._debugging)
+
+    def test_stream(self):
+        stream = StringIO.StringIO()
+        client = _Client('http://example.com', debug=stream,
+                         client=support.FakeHttp())
+
+        client.list_items(1)
+
+        self.assertTrue(client._debugging)
+        self.assertTrue('Received entity' in stream.getvalue())
+
+    def test_overridden_debug(self):
+        client = _LoggingClient('http://example.com',
+                                client=support.FakeHttp())
+
+        client.list_items(1)
+
+        self.assertTrue(client._debugging)
+        self.assertTrue(any(msg.startswith('Sending')
+                            for msg in client.messages))
+        self.assertTrue(any('Received entity' in msg
+                            for msg in client.messages))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import unittest
+
+import requiem
+from requiem import decorators
+
+
+class _Client(requiem.RESTClient):
+    """A client whose methods return the request without sending it."""
+
+    @requiem.restmethod('GET', '/things')
+    def list_things(self, req):
+        """List the things."""
+
+        return req
+
+    @requiem.restmethod('GET', '/things/{name}/parts/{part}')
+    def get_part(self, req, name, part=0):
+        """Retrieve a part of a thing."""
+
+        return req
+
+    @requiem.restmethod('GET', '{url}')
+    def follow(self, req, url):
+        """Retrieve an arbitrary URL."""
+
+        return req
+
+    @requiem.restmethod('GET', 'things?page={page}')
+    def get_page(self, req, page):
+        """Retrieve a page of things."""
+
+        return req
+
+    @requiem.restmethod('GET', '/search', 'q', 'tag', 'limit')
+    def search(self, req, q, tag=None, limit=None):
+        """Search for things."""
+
+        return req
+
+    @requiem.restmethod('PUT', '/things/{name}', token='X-Auth-Token')
+    def put_thing(self, req, name, token=None):
+        """Replace a thing."""
+
+        return req
+
+class TestUrlBuilding(unittest.TestCase):
+    def test_static(self):
+        for base in ('http://example.com/api', 'http://example.com/api/'):
+            client = _Client(base)
+            self.assertEqual(client.list_things().url,
+                             'http://example.com/api/things')
+
+    def test_base_urls_cached_separately(self):
+        first = _Client('http://one.example.com')
+        second = _Client('http://two.example.com/')
+
+        for _i in range(2):
+            self.assertEqual(first.get_part('a', 1).url,
+                             'http://one.example.com/things/a/parts/1')
+            self.assertEqual(second.get_part('a', 1).url,
+                             'http://two.example.com/things/a/parts/1')
+
+    def test_fields_escaped(self):
+        client = _Client('http://example.com')
+
+        self.assertEqual(client.get_part('a/b c', u'caf\xe9').url,
+                         'http://example.com/things/a%2Fb%20c/parts/caf%C3%A9')
+        self.assertEqual(client.get_page('1&x=2').url,
+                         'http://example.com/things?page=1%26x%3D2')
+
+    def test_leading_field_is_url(self):
+        client = _Client('http://example.com/api')
+
+        self.assertEqual(client.follow('http://other.example.com/x?y=1').url,
+                         'http://other.example.com/x?y=1')
+        self.assertEqual(client.follow('things/a').url,
+                         'http://example.com/api/things/a')
+
+    def test_query(self):
+        client = _Client('http://example.com')
+
+        self.assertEqual(client.search('a b').url,
+                         'http://example.com/search?q=a+b')
+        self.assertEqual(client.search('x', tag=['t1', None, 't&2'],
+                                       limit=10).url,
+                         'http://example.com/search?q=x&tag=t1&tag=t%262'
+                         '&limit=10')
+        self.assertEqual(client.search(None).url,
+                         'http://example.com/search')
+
+    def test_headers(self):
+        client = _Client('http://example.com')
+
+        req = client.put_thing('a', token='secret')
+        self.assertEqual(req.method, 'PUT')
+        self.assertEqual(req['x-auth-token'], 'secret')
+        self.assertFalse('X-Auth-Token' in client.put_thing('a'))
+
+
+class TestBinding(unittest.TestCase):
+    def setUp(self):
+        self.client = _Client('http://example.com')
+
+    def test_keywords_and_defaults(self):
+        self.assertEqual(self.client.get_part(part=2, name='a').url,
+                         'http://example.com/things/a/parts/2')
+        self.assertEqual(self.client.get_part('a').url,
+                         'http://example.com/things/a/parts/0')
+
+    def test_errors(self):
+        self.assertRaises(TypeError, self.client.get_part)
+        self.assertRaises(TypeError, self.client.get_part, 'a', name='b')
+        self.assertRaises(TypeError, self.client.get_part, 'a', 1, 2)
+        self.assertRaises(TypeError, self.client.list_things, bogus=1)
+
+    def test_call_plan(self):
+        plan = _Client.get_part._restmethod
+
+        self.assertEqual(plan.method, 'GET')
+        self.assertEqual(plan.fields, frozenset(['name', 'part']))
+        self.assertEqual(plan.join, 'relative')
+        self.assertEqual(_Client.list_things._restmethod.join, 'static')
+        self.assertTrue(_Client.follow._restmethod.join is None)
+
+
+class TestUrlJoin(unittest.TestCase):
+    def test_slashes(self):
+        self.assertEqual(decorators._urljoin('http://x/a/', '/b'),
+                         'http://x/a/b')
+        self.assertEqual(decorators._urljoin('http://x/a', 'b'),
+                         'http://x/a/b')
+        self.assertEqual(decorators._urljoin('http://x/a/', 'b'),
+                         'http://x/a/b')
+
+    def test_absolute(self):
+        self.assertEqual(decorators._urljoin('http://x/a', 'http://y/b'),
+                         'http://y/b')
+        self.assertEqual(decorators._urljoin('http://x/a', '//y/b'),
+                         'http://y/b')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import unittest
+
+from requiem import headers
+
+
+class TestHeaderDict(unittest.TestCase):
+    def test_add(self):
+        hdrs = headers.HeaderDict()
+        hdrs['accept'] = 'text/plain'
+        hdrs.add('ACCEPT', 'application/json')
+
+        self.assertEqual(hdrs['Accept'], 'text/plain, application/json')
+        self.assertEqual(hdrs.getall('accept'),
+                         ['text/plain', 'application/json'])
+
+    def test_add_non_string(self):
+        hdrs = headers.HeaderDict()
+        hdrs['x-count'] = 1
+        hdrs.add('x-count', 2)
+        hdrs.add('x-other', 3)
+
+        self.assertEqual(hdrs['X-Count'], '1, 2')
+        self.assertEqual(hdrs.getall('x-count'), ['1', '2'])
+        self.assertEqual(hdrs['X-Other'], '3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import unittest
+
+import httplib2
+
+import requiem
+from requiem import breaker
+from requiem import limiter
+from requiem import retry
+
+
+class _FakeHttp(object):
+    """httplib2.Http stand-in returning the given status."""
+
+    def __init__(self, status):
+        """Initialize the fake client."""
+
+        self.status = status
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Answer a request."""
+
+        resp = httplib2.Response({'status': str(self.status)})
+        resp.reason = 'Fault'
+        return resp, ''
+
+
+class _Client(requiem.RESTClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/thing')
+    def get_thing(self, req):
+        """Retrieve the thing."""
+
+        return req.send()
+
+
+class _ShortCircuit(object):
+    """Processor answering every request itself."""
+
+    def proc_request(self, req):
+        """Return a canned response."""
+
+        return httplib2.Response({'status': '200'})
+
+
+class TestLimiterStacking(unittest.TestCase):
+    def _client(self, status, *procs):
+        client = _Client('http://example.com', client=_FakeHttp(status))
+        for proc in procs:
+            client._push_processor(proc)
+
+        return client
+
+    def _inflight(self, limit):
+        return limit.stats()[None]['inflight']
+
+    def test_breaker_rejection_releases_slot(self):
+        limit = limiter.RateLimiter(
+            concurrency=lambda: limiter.AdaptiveLimit(initial=3),
+            block=False)
+        brk = breaker.CircuitBreaker(min_requests=2)
+        client = self._client(503, limit, brk)
+
+        for _i in range(2):
+            self.assertRaises(requiem.HTTPException, client.get_thing)
+        for _i in range(5):
+            self.assertRaises(requiem.CircuitOpen, client.get_thing)
+
+        self.assertEqual(self._inflight(limit), 0)
+
+    def test_short_circuit_releases_slot(self):
+        limit = limiter.RateLimiter(
+            concurrency=lambda: limiter.AdaptiveLimit(initial=1),
+            block=False)
+        client = self._client(200, limit, _ShortCircuit())
+
+        for _i in range(3):
+            self.assertEqual(client.get_thing().status, 200)
+
+        self.assertEqual(self._inflight(limit), 0)
+
+    def test_retried_throttle_shrinks_limit(self):
+        limit = limiter.RateLimiter(
+            concurrency=lambda: limiter.AdaptiveLimit(initial=8),
+            block=False)
+        retrier = retry.RetryProcessor(max_attempts=3, base=0.0, cap=0.0)
+        client = self._client(503, limit, retrier)
+
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+
+        self.assertEqual(retrier.retries, 2)
+        self.assertEqual(limit.throttled, 3)
+        self.assertEqual(limit.stats()[None]['limit'], 1)
+        self.assertEqual(self._inflight(limit), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import unittest
+
+import requiem
+from requiem import processor
+
+from benchmarks import support
+
+
+class _Recorder(object):
+    """Processor recording the requests it sees."""
+
+    def __init__(self):
+        """Initialize the recorder."""
+
+        self.seen = []
+
+    def proc_request(self, req):
+        """Record the request."""
+
+        self.seen.append((req.method, req.url))
+
+
+class _Client(requiem.RESTClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/items/{count}')
+    def list_items(self, req, count):
+        """List some items."""
+
+        return req.send()
+
+    @requiem.restmethod('POST', '/thing')
+    def create_thing(self, req):
+        """Create the thing."""
+
+        return req.send()
+
+
+class TestProcessorStack(unittest.TestCase):
+    def test_unscoped_select(self):
+        stack = processor.ProcessorStack([_Recorder(), _Recorder()])
+
+        self.assertTrue(stack.select('meth', 'GET', 'http://x/') is stack)
+
+    def test_static_scope(self):
+        plain = _Recorder()
+        by_name = _Recorder()
+        by_method = _Recorder()
+        stack = processor.ProcessorStack([
+            plain,
+            processor.ScopedProcessor(by_name, methnames=['list_items']),
+            processor.ScopedProcessor(by_method, methods=['post']),
+        ])
+
+        selected = stack.select('list_items', 'GET', 'http://x/')
+        self.assertEqual(list(selected), [plain, by_name])
+        self.assertTrue(stack.select('list_items', 'GET', 'http://y/') is
+                        selected)
+        self.assertEqual(list(stack.select('other', 'POST', 'http://x/')),
+                         [plain, by_method])
+
+    def test_url_scope(self):
+        plain = _Recorder()
+        by_url = _Recorder()
+        stack = processor.ProcessorStack([
+            plain,
+            processor.ScopedProcessor(by_url, urls=[r'/items/\d+$']),
+        ])
+
+        self.assertEqual(list(stack.select(None, 'GET', 'http://x/items/3')),
+                         [plain, by_url])
+        self.assertEqual(list(stack.select(None, 'GET', 'http://x/thing')),
+                         [plain])
+        self.assertTrue(stack.select(None, 'GET', 'http://x/items/4') is
+                        stack.select(None, 'GET', 'http://x/items/5'))
+
+    def test_change_invalidates(self):
+        scoped = _Recorder()
+        stack = processor.ProcessorStack([
+            processor.ScopedProcessor(scoped, methods=['GET']),
+        ])
+        self.assertEqual(list(stack.select(None, 'GET', 'http://x/')),
+                         [scoped])
+
+        added = _Recorder()
+        stack.append(added)
+        self.assertEqual(list(stack.select(None, 'GET', 'http://x/')),
+                         [scoped, added])
+
+        stack.remove(scoped)
+        self.assertTrue(stack.select(None, 'GET', 'http://x/') is stack)
+        self.assertEqual(list(stack), [added])
+
+
+class TestScopedClient(unittest.TestCase):
+    def test_push_processor_scoped(self):
+        client = _Client('http://example.com', client=support.FakeHttp())
+        everything = _Recorder()
+        listing = _Recorder()
+        posting = _Recorder()
+        client._push_processor(everything)
+        client._push_processor(listing, methnames=['list_items'])
+        client._push_processor(posting, methods=['POST'],
+                               urls=['/thing$'])
+
+        client.list_items(count=2)
+        client.create_thing()
+
+        self.assertEqual(everything.seen, [
+            ('GET', 'http://example.com/items/2'),
+            ('POST', 'http://example.com/thing'),
+        ])
+        self.assertEqual(listing.seen,
+                         [('GET', 'http://example.com/items/2')])
+        self.assertEqual(posting.seen,
+                         [('POST', 'http://example.com/thing')])
+
+
+if __name__ == '__main__':
+    unittest.main()
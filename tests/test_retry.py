@@ -0,0 +1,190 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import errno
+import socket
+import unittest
+
+import httplib2
+
+import requiem
+from requiem import retry
+
+
+class _ScriptedHttp(object):
+    """httplib2.Http stand-in failing as scripted.
+
+    Each outcome is a status code, or an exception to raise; the last
+    one is repeated.
+    """
+
+    def __init__(self, *outcomes, **headers):
+        """Initialize the fake client."""
+
+        self.outcomes = list(outcomes)
+        self.headers = headers
+        self.methods = []
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Answer a request."""
+
+        self.methods.append(method)
+        if len(self.outcomes) > 1:
+            outcome = self.outcomes.pop(0)
+        else:
+            outcome = self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        resp = httplib2.Response(dict(self.headers, status=str(outcome)))
+        resp.reason = 'Fault'
+        return resp, ''
+
+
+class _Client(requiem.RESTClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/thing')
+    def get_thing(self, req):
+        """Retrieve the thing."""
+
+        return req.send()
+
+    @requiem.restmethod('POST', '/thing')
+    def create_thing(self, req):
+        """Create the thing."""
+
+        return req.send()
+
+
+def _refused():
+    """Construct a connection refused error."""
+
+    return socket.error(errno.ECONNREFUSED, 'Connection refused')
+
+
+class TestRetryProcessor(unittest.TestCase):
+    def _client(self, http, **kwargs):
+        kwargs.setdefault('base', 0.0)
+        kwargs.setdefault('cap', 0.0)
+        retrier = retry.RetryProcessor(**kwargs)
+        client = _Client('http://example.com', client=http)
+        client._push_processor(retrier)
+
+        return client, retrier
+
+    def test_retry_then_succeed(self):
+        http = _ScriptedHttp(503, _refused(), 200)
+        client, retrier = self._client(http)
+
+        resp = client.get_thing()
+
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(len(http.methods), 3)
+        self.assertEqual(retrier.retries, 2)
+
+    def test_give_up(self):
+        http = _ScriptedHttp(503)
+        client, retrier = self._client(http, max_attempts=2)
+
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+
+        self.assertEqual(len(http.methods), 2)
+        self.assertEqual((retrier.retries, retrier.giveups), (1, 1))
+
+    def test_status_not_retried(self):
+        http = _ScriptedHttp(500)
+        client, retrier = self._client(http)
+
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+
+        self.assertEqual(len(http.methods), 1)
+        self.assertEqual(retrier.retries, 0)
+
+    def test_unsafe_method(self):
+        http = _ScriptedHttp(503)
+        client, retrier = self._client(http)
+
+        self.assertRaises(requiem.HTTPException, client.create_thing)
+        self.assertEqual(len(http.methods), 1)
+
+        # The server never saw a refused request
+        http = _ScriptedHttp(_refused(), 200)
+        client, retrier = self._client(http)
+
+        self.assertEqual(client.create_thing().status, 200)
+        self.assertEqual(http.methods, ['POST', 'POST'])
+
+    def test_retry_after(self):
+        http = _ScriptedHttp(503, 200, **{'retry-after': '0'})
+        client, retrier = self._client(http, cap=1.0)
+
+        self.assertEqual(client.get_thing().status, 200)
+        self.assertEqual(retrier.retries, 1)
+
+        # Delays longer than the cap aren't worth waiting for
+        http = _ScriptedHttp(503, 200, **{'retry-after': '120'})
+        client, retrier = self._client(http, cap=1.0)
+
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+        self.assertEqual((retrier.retries, retrier.giveups), (0, 1))
+
+    def test_budget_exhausted(self):
+        budget = retry.RetryBudget(ratio=0.0, min_rate=0.0, max_tokens=1.0)
+        http = _ScriptedHttp(503)
+        client, retrier = self._client(http, max_attempts=5, budget=budget)
+
+        self.assertRaises(requiem.HTTPException, client.get_thing)
+
+        self.assertEqual(len(http.methods), 2)
+        self.assertEqual(retrier.retries, 1)
+        self.assertEqual(retrier.budget_exhausted, 1)
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_ratio(self):
+        budget = retry.RetryBudget(ratio=0.5, min_rate=0.0, max_tokens=1.0)
+
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_max_tokens(self):
+        budget = retry.RetryBudget(ratio=1.0, min_rate=0.0, max_tokens=2.0)
+
+        for _i in range(5):
+            budget.deposit()
+
+        self.assertEqual(budget.tokens, 2.0)
+
+
+class TestRetryAfter(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(retry._retry_after({'retry-after': '5'}), 5.0)
+        self.assertEqual(retry._retry_after(
+            {'retry-after': 'Thu, 01 Jan 1970 00:01:40 GMT'}, now=40.0),
+            60.0)
+        self.assertEqual(retry._retry_after(
+            {'retry-after': 'Thu, 01 Jan 1970 00:01:40 GMT'}, now=400.0),
+            0.0)
+        self.assertTrue(retry._retry_after({'retry-after': 'soon'}) is None)
+        self.assertTrue(retry._retry_after({}) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import sys
+import unittest
+import weakref
+
+import requiem
+from requiem import processor
+
+from benchmarks import support
+
+
+class _Client(requiem.RESTClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/status/{code}')
+    def get_status(self, req, code):
+        """Retrieve a status."""
+
+        req.body = 'x' * 1000
+        return req.send()
+
+
+class TestTraceRecord(unittest.TestCase):
+    def test_error_drops_references(self):
+        client = _Client('http://example.com', client=support.FakeHttp())
+        tracer = client._trace(preview=16)
+
+        try:
+            client.get_status(code=404)
+        except requiem.HTTPException, e:
+            exc = weakref.ref(e)
+            resp = weakref.ref(e.response)
+        else:
+            self.fail('HTTPException not raised')
+        del e
+        sys.exc_clear()
+
+        record, = tracer.records()
+        self.assertEqual(record.error, 'NotFoundException')
+        self.assertEqual(record.error_message, 'Error')
+        self.assertEqual(record.status, 404)
+        self.assertEqual(record.req_body, ('x' * 16, 1000))
+        self.assertTrue(exc() is None)
+        self.assertTrue(resp() is None)
+        self.assertTrue('error: NotFoundException: Error' in record.format())
+
+    def test_log_caps_arguments(self):
+        tracer = requiem.Tracer(preview=8)
+        record = tracer.start(requiem.HTTPRequest(
+            'GET', 'http://example.com', support.FakeHttp(),
+            processor.ProcessorStack()))
+        big = ['item'] * 100
+
+        record.log('%s %r %d', 'y' * 100, big, 42)
+        record.log('%(value)s', value=big)
+
+        self.assertEqual(record.messages, [
+            ('%s %r %d', ('y' * 8, repr(big)[:8], 42)),
+            ('%(value)s', {'value': repr(big)[:8]}),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,317 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import socket
+import threading
+import time
+import unittest
+
+import httplib2
+
+import requiem
+from requiem import limiter
+from requiem import metrics
+from requiem import transport
+
+from benchmarks import support
+
+
+class _FailingHttp(object):
+    """httplib2.Http stand-in which fails slowly."""
+
+    def __init__(self, delay=0.05):
+        """Initialize the fake client."""
+
+        self.delay = delay
+        self.requests = 0
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Fail the request."""
+
+        self.requests += 1
+        time.sleep(self.delay)
+        raise socket.error(111, 'Connection refused')
+
+
+class _SlowHttp(object):
+    """httplib2.Http stand-in which answers slowly."""
+
+    def __init__(self, delay=0.1):
+        """Initialize the fake client."""
+
+        self.delay = delay
+        self.requests = 0
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Answer the request after a delay."""
+
+        self.requests += 1
+        time.sleep(self.delay)
+        resp = httplib2.Response({'status': '200'})
+        resp.reason = 'OK'
+        return resp, '%s %s' % (method, uri)
+
+
+class _Client(requiem.RESTClient):
+    """A minimal client."""
+
+    @requiem.restmethod('GET', '/thing')
+    def get_thing(self, req):
+        """Retrieve the thing."""
+
+        return req.send()
+
+
+def _run_threads(count, func):
+    """Call func in count threads at once, returning the results."""
+
+    results = [None] * count
+
+    def run(idx):
+        try:
+            results[idx] = func()
+        except Exception, e:
+            results[idx] = e
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class TestCoalescer(unittest.TestCase):
+    def test_waiters_get_their_own_exception(self):
+        http = _FailingHttp()
+        coalescer = transport.Coalescer(http)
+        limit = limiter.RateLimiter(
+            concurrency=lambda: limiter.AdaptiveLimit(initial=50))
+        client = _Client('http://example.com', client=coalescer)
+        client._push_processor(limit)
+
+        results = _run_threads(20, client.get_thing)
+
+        self.assertTrue(all(isinstance(r, socket.error) for r in results))
+        self.assertEqual(len(set(id(r) for r in results)), 20)
+        self.assertEqual(len(set(id(r.request) for r in results)), 20)
+        self.assertTrue(coalescer.coalesced > 0)
+        self.assertTrue(http.requests < 20)
+        self.assertEqual(limit.stats()[None]['inflight'], 0)
+
+    def test_identical_requests_coalesced(self):
+        http = _SlowHttp()
+        coalescer = transport.Coalescer(http)
+
+        results = _run_threads(10, lambda: coalescer.request(
+            'http://example.com/thing', headers={'Accept': 'text/plain'}))
+
+        self.assertEqual(http.requests, 1)
+        self.assertEqual(coalescer.requests, 10)
+        self.assertEqual(coalescer.coalesced, 9)
+        self.assertEqual(len(set(id(resp) for resp, _c in results)), 10)
+        self.assertEqual(set(content for _r, content in results),
+                         set(['GET http://example.com/thing']))
+
+        # Once the flight has landed, a new request goes out
+        coalescer.request('http://example.com/thing')
+        self.assertEqual(http.requests, 2)
+
+    def test_unsafe_requests_not_coalesced(self):
+        http = _SlowHttp()
+        coalescer = transport.Coalescer(http)
+
+        _run_threads(5, lambda: coalescer.request(
+            'http://example.com/thing', 'POST'))
+
+        self.assertEqual(http.requests, 5)
+        self.assertEqual(coalescer.coalesced, 0)
+
+    def test_key_headers(self):
+        http = _SlowHttp()
+        coalescer = transport.Coalescer(http, key_headers=['Accept'])
+        counter = iter(range(10))
+
+        _run_threads(10, lambda: coalescer.request(
+            'http://example.com/thing',
+            headers={'Accept': 'text/plain',
+                     'X-Request-Id': str(next(counter))}))
+        self.assertEqual(http.requests, 1)
+
+        accepts = iter(['text/plain', 'application/json'])
+        _run_threads(2, lambda: coalescer.request(
+            'http://example.com/thing', headers={'Accept': next(accepts)}))
+        self.assertEqual(http.requests, 3)
+
+
+class _RecordingConnection(object):
+    """Connection class recording how it was created."""
+
+    def __init__(self, authority, **kwargs):
+        """Record the arguments."""
+
+        self.authority = authority
+        self.kwargs = kwargs
+
+    def set_debuglevel(self, level):
+        """Ignore the debugging level."""
+
+        pass
+
+
+class TestConnection(unittest.TestCase):
+    def test_client_certificate(self):
+        http = httplib2.Http()
+        http.add_certificate('/key.pem', '/cert.pem', '', 'secret')
+        pool = transport.ConnectionPool()
+
+        conn, request_uri = pool._connection(
+            http, 'https://example.com/thing?x=1', _RecordingConnection)
+
+        self.assertTrue(isinstance(conn, _RecordingConnection))
+        self.assertEqual(request_uri, '/thing?x=1')
+        self.assertEqual(conn.kwargs['key_file'], '/key.pem')
+        self.assertEqual(conn.kwargs['cert_file'], '/cert.pem')
+        self.assertEqual(conn.kwargs['key_password'], 'secret')
+        self.assertTrue(http.connections['https:example.com'] is conn)
+
+    def test_certificate_domain(self):
+        http = httplib2.Http()
+        http.add_certificate('/key.pem', '/cert.pem', 'other.example.com')
+        pool = transport.ConnectionPool()
+
+        conn, _request_uri = pool._connection(
+            http, 'https://example.com/thing', _RecordingConnection)
+
+        self.assertFalse('cert_file' in conn.kwargs)
+
+
+class _CountingConnection(httplib2.HTTPConnectionWithTimeout):
+    """HTTP connection class counting its instances."""
+
+    created = 0
+
+    def __init__(self, *args, **kwargs):
+        """Count the connection."""
+
+        _CountingConnection.created += 1
+        httplib2.HTTPConnectionWithTimeout.__init__(self, *args, **kwargs)
+
+
+class TestTimedRequest(unittest.TestCase):
+    def test_connection_type(self):
+        _CountingConnection.created = 0
+        pool = transport.ConnectionPool()
+        timings = metrics.RequestTimings('get_thing', 'GET', 'url')
+
+        with support.Server() as server:
+            resp, _content = pool._timed_request(
+                timings, server.url + '/status/200', 'GET', None, None, 5,
+                _CountingConnection)
+            pool.clear()
+
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(_CountingConnection.created, 1)
+        for phase in ('connect', 'ttfb', 'transfer'):
+            self.assertTrue(phase in timings.phases)
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_checkout_reuses_client(self):
+        pool = transport.ConnectionPool()
+
+        with support.Server() as server:
+            for _i in range(3):
+                resp, _content = pool.request(server.url + '/status/200')
+                self.assertEqual(resp.status, 200)
+            host = pool._get_pool(server.url)
+            self.assertEqual(host._count, 1)
+            self.assertEqual(len(host._idle), 1)
+            pool.clear()
+
+    def test_blocking_waits_for_checkin(self):
+        pool = transport.ConnectionPool(maxsize=1, factory=support.FakeHttp)
+        host = pool._get_pool('http://example.com/')
+        http = host.checkout()
+
+        timer = threading.Timer(0.05, host.checkin, (http,))
+        timer.start()
+        start = time.time()
+        self.assertTrue(host.checkout() is http)
+        self.assertTrue(time.time() - start >= 0.04)
+        timer.join()
+
+    def test_block_timeout(self):
+        pool = transport.ConnectionPool(maxsize=1, block_timeout=0.05,
+                                        factory=support.FakeHttp)
+        host = pool._get_pool('http://example.com/')
+        host.checkout()
+
+        start = time.time()
+        self.assertRaises(requiem.PoolExhausted, host.checkout)
+        self.assertTrue(time.time() - start >= 0.04)
+
+    def test_non_blocking(self):
+        pool = transport.ConnectionPool(maxsize=1, block=False,
+                                        factory=support.FakeHttp)
+        host = pool._get_pool('http://example.com/')
+        http = host.checkout()
+
+        self.assertRaises(requiem.PoolExhausted, host.checkout)
+        host.discard(http)
+        self.assertTrue(host.checkout() is not http)
+
+    def test_idle_expiry(self):
+        pool = transport.ConnectionPool(idle_timeout=0.02,
+                                        factory=support.FakeHttp)
+        host = pool._get_pool('http://example.com/')
+        http = host.checkout()
+        host.checkin(http)
+
+        time.sleep(0.05)
+        self.assertTrue(host.checkout() is not http)
+        self.assertEqual(host._count, 1)
+
+    def test_client_settings(self):
+        pool = transport.ConnectionPool()
+        host = pool._get_pool('http://example.com/')
+        old = host.checkout()
+
+        pool.add_credentials('user', 'secret')
+        pool.add_certificate('/key.pem', '/cert.pem', 'example.com')
+        pool.follow_redirects = False
+        new = host.checkout()
+
+        for http in (old, new):
+            self.assertEqual(list(http.credentials.iter('example.com')),
+                             [('user', 'secret')])
+            self.assertEqual(len(list(
+                http.certificates.iter('example.com'))), 1)
+            self.assertFalse(http.follow_redirects)
+            self.assertFalse(http.follow_all_redirects)
+
+        pool.clear_credentials()
+        host.checkin(old)
+        self.assertEqual(list(host.checkout().credentials.iter('')), [])
+        self.assertEqual(list(pool._get_pool(
+            'http://other.example.com/').checkout().credentials.iter('')),
+            [])
+
+
+if __name__ == '__main__':
+    unittest.main()